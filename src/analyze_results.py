@@ -6,26 +6,35 @@ from YOLOv8 and LLaVA models. Outputs include:
 - Confusion matrices (percentages)
 - Heatmap comparing YOLO vs LLAVA counts
 - CSV summary of metrics (Accuracy, Precision, Recall, F1-Score)
+- Metrics for every count threshold, count errors (MAE, exact-match,
+  over/under-count) and frames/persons per dataset_x
+Metrics come from the incremental engine in evaluation.py: only the count
+columns are loaded (from merged-results.csv or, with --store, from the
+columnar results_store.py), and with --state only rows appended since the
+previous run are read.
+
+The plotting libraries (matplotlib, seaborn, sklearn) and the engine's
+pandas are imported on first use, so --help returns at once and
+--metrics-only (the CSV tables, no figures) never loads the plotting stack.
 """
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay, precision_score, recall_score, f1_score, accuracy_score
+import argparse
 from pathlib import Path
-import numpy as np
 
 # ---------------------- Configuration ----------------------
 INPUT_CSV = "merged-results.csv"  # Path to your CSV file
 OUTPUT_DIR = Path("conclusion")
-OUTPUT_DIR.mkdir(exist_ok=True)
+SUMMARY_CSV = "data/dataset_person_summary.csv"
 
 # ---------------------- Functions ----------------------
-def plot_and_save_confusion_matrix(y_true, y_pred, model_name):
+def plot_and_save_confusion_matrix(cm, model_name, output_dir=OUTPUT_DIR):
     """
     Plot a confusion matrix in percentages and save as PNG.
     """
-    cm = confusion_matrix(y_true, y_pred)
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import ConfusionMatrixDisplay
+
     # Convert counts to percentages
     cm_percent = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis] * 100
 
@@ -35,37 +44,43 @@ def plot_and_save_confusion_matrix(y_true, y_pred, model_name):
     disp.plot(ax=ax, cmap="Blues", values_format=".1f")  # 1 decimal place
     plt.title(f"{model_name} Confusion Matrix (%)\n(rows sum to 100%)")
     plt.tight_layout()
-    plt.savefig(OUTPUT_DIR / f"{model_name}_confusion_matrix_percent.png")
+    plt.savefig(Path(output_dir) / f"{model_name}_confusion_matrix_percent.png")
     plt.close(fig)
     return cm
 
-def compute_metrics(y_true, y_pred):
+def load_engine(input_csv=INPUT_CSV, store_dir=None, state_path=None):
     """
-    Compute basic classification metrics: Accuracy, Precision, Recall, F1-Score
+    Build the evaluation engine. With state_path, the saved counts are
+    restored and only new CSV rows are folded in; with store_dir, the
+    merged rows come from the columnar results store (read in full, so
+    there is no state to keep).
     """
-    return {
-        "Accuracy": accuracy_score(y_true, y_pred),
-        "Precision": precision_score(y_true, y_pred),
-        "Recall": recall_score(y_true, y_pred),
-        "F1-Score": f1_score(y_true, y_pred)
-    }
+    from evaluation import EvaluationEngine, DATASET_COLUMN
 
-# ---------------------- Main Execution ----------------------
-if __name__ == "__main__":
-    # Load CSV data
-    df = pd.read_csv(INPUT_CSV)
+    if store_dir is not None:
+        if state_path:
+            raise ValueError("state_path only applies to CSV input, the store is always read in full")
+        from results_store import ResultsStore
+        engine = EvaluationEngine()
+        df = ResultsStore(store_dir).merged(engine.columns())
+        engine.update(df.rename(columns={"dataset": DATASET_COLUMN}))
+        return engine
 
-    # Binarize person counts for evaluation
-    df["gt_person"] = df["true_person_count"] > 0
-    df["yolo_detected"] = df["yolo_count"] > 0
-    df["llava_detected"] = df["llava_count"] > 0
+    engine = EvaluationEngine.load(state_path) if state_path else EvaluationEngine()
+    new_rows = engine.update_csv(input_csv)
+    print(f"Folded in {new_rows} new rows from {input_csv}")
+    if state_path:
+        engine.save(state_path)
+    return engine
 
-    # Plot confusion matrices
-    cm_yolo = plot_and_save_confusion_matrix(df["gt_person"], df["yolo_detected"], "YOLO")
-    cm_llava = plot_and_save_confusion_matrix(df["gt_person"], df["llava_detected"], "LLAVA")
+def plot_heatmap(engine, output_dir=OUTPUT_DIR):
+    """
+    Heatmap comparing YOLO vs LLAVA person counts, normalized per YOLO count.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-    # Heatmap comparing YOLO vs LLAVA person counts
-    pivot = df.pivot_table(index="yolo_count", columns="llava_count", aggfunc="size", fill_value=0)
+    pivot = engine.joint_table()
     pivot_norm = pivot.div(pivot.sum(axis=1), axis=0).fillna(0)
 
     plt.figure(figsize=(12,8))
@@ -74,18 +89,55 @@ if __name__ == "__main__":
     plt.xlabel("LLAVA Person Count")
     plt.ylabel("YOLO Person Count")
     plt.tight_layout()
-    plt.savefig(OUTPUT_DIR / "heatmap_yolo_vs_llava.png")
+    plt.savefig(Path(output_dir) / "heatmap_yolo_vs_llava.png")
     plt.close()
 
-    # Compute metrics
-    metrics_yolo = compute_metrics(df["gt_person"], df["yolo_detected"])
-    metrics_llava = compute_metrics(df["gt_person"], df["llava_detected"])
+def run_analysis(engine, output_dir=OUTPUT_DIR, summary_csv=SUMMARY_CSV, plots=True):
+    """
+    Write the confusion matrices, heatmap and metric tables of an engine
+    to output_dir (only the tables with plots=False). Returns the summary
+    metrics DataFrame.
+    """
+    from evaluation import compare_summary
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if plots:
+        # Plot confusion matrices (person predicted when count > 0)
+        plot_and_save_confusion_matrix(engine.total("YOLO").confusion_matrix(), "YOLO", output_dir)
+        plot_and_save_confusion_matrix(engine.total("LLAVA").confusion_matrix(), "LLAVA", output_dir)
+        plot_heatmap(engine, output_dir)
 
     # Save summary metrics to CSV
-    summary_df = pd.DataFrame([metrics_yolo, metrics_llava], index=["YOLO", "LLAVA"])
-    summary_df.to_csv(OUTPUT_DIR / "summary_metrics.csv")
+    summary_df = engine.summary()
+    summary_df.to_csv(output_dir / "summary_metrics.csv")
+
+    # Threshold sweep, count errors and per-dataset breakdowns
+    engine.threshold_table().to_csv(output_dir / "threshold_metrics.csv", index=False)
+    engine.count_table().to_csv(output_dir / "count_metrics.csv", index=False)
+    if summary_csv and Path(summary_csv).exists():
+        compare_summary(engine, summary_csv).to_csv(output_dir / "dataset_summary_check.csv", index=False)
+    return summary_df
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate YOLO and LLaVA person detection")
+    parser.add_argument("--input-csv", default=INPUT_CSV)
+    parser.add_argument("--store", default=None, help="Read from a results_store.py directory instead")
+    parser.add_argument("--state", default=None, help="Engine state file for incremental runs")
+    parser.add_argument("--summary-csv", default=SUMMARY_CSV, help="dataset_person_summary.csv to check against")
+    parser.add_argument("--output-dir", default=str(OUTPUT_DIR))
+    parser.add_argument("--metrics-only", action="store_true",
+                        help="Only write the metric CSVs (no figures, plotting libraries not loaded)")
+    args = parser.parse_args()
+    if args.store and args.state:
+        parser.error("--state only applies to --input-csv runs (the store is always read in full)")
+
+    engine = load_engine(args.input_csv, args.store, args.state)
+    summary_df = run_analysis(engine, args.output_dir, args.summary_csv, plots=not args.metrics_only)
 
     # Print summary to terminal
     print("=== Metrics Summary ===")
     print(summary_df)
-    print(f"\nResults have been saved in the folder: {OUTPUT_DIR.resolve()}")
+    print(f"\nResults have been saved in the folder: {Path(args.output_dir).resolve()}")
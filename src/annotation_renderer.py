@@ -0,0 +1,242 @@
+"""
+annotation_renderer.py
+
+Shared drawing of YOLO detections and LLaVA answers on frames, used by
+run_yolo_detection.py (draw_boxes) and llava_analysis.py (--visualize).
+
+- label sizes are measured once per distinct label (confidence labels are
+  precomputed), instead of a cv2.getTextSize call per box
+- boxes are drawn in place: no full-frame copy per annotated frame, and
+  label backgrounds are filled with array slices
+- "side" mode renders the YOLO and LLaVA results of a frame next to each
+  other in a single output image
+- whole result sets are rendered by a thread pool (decode, resize and encode
+  release the GIL); with --scale the frames are decoded at reduced size
+  (JPEG DCT scaling) and written downscaled, for quick visual QA
+
+Usage:
+    python annotation_renderer.py --frames-dir frames_extracted --output-dir qa \
+        --yolo-metadata yolo_results/metadata --llava-dir llava_results --mode side --scale 0.5
+"""
+
+import os
+import cv2
+import json
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+# ---------------------- Configuration ----------------------
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.6        # YOLO confidence labels
+LABEL_COLOR = (255, 255, 255)
+BOX_THICKNESS = 2
+
+LLAVA_BOX_COLOR = (0, 0, 255)  # Red
+LLAVA_COUNT_SCALE = 1.0
+LLAVA_COUNT_THICKNESS = 2
+LLAVA_DESC_SCALE = 0.6
+
+SCALE = 1.0          # Output size relative to the frame
+JPEG_QUALITY = 90
+WORKERS = os.cpu_count() or 4
+MODES = ("yolo", "llava", "side")
+
+# cv2.imread flags decoding a JPEG directly at 1/2, 1/4 or 1/8 of its size
+REDUCED_READS = ((0.125, cv2.IMREAD_REDUCED_COLOR_8), (0.25, cv2.IMREAD_REDUCED_COLOR_4),
+                 (0.5, cv2.IMREAD_REDUCED_COLOR_2))
+
+# ---------------------- Functions ----------------------
+@lru_cache(maxsize=4096)
+def text_size(text, scale=LABEL_SCALE, thickness=1):
+    """cv2.getTextSize of a label, measured once per (text, scale, thickness)."""
+    return cv2.getTextSize(text, FONT, scale, thickness)[0]
+
+def precompute_labels(scale=LABEL_SCALE):
+    """Measure every "person: 0.00".."person: 1.00" label up front."""
+    for c in range(101):
+        text_size(f"person: {c / 100:.2f}", scale)
+
+def fill_rect(img, x1, y1, x2, y2, color):
+    """Filled rectangle (inclusive corners, like cv2.rectangle(..., -1)) as an array slice."""
+    h, w = img.shape[:2]
+    x1, y1 = max(x1, 0), max(y1, 0)
+    x2, y2 = min(x2, w - 1), min(y2, h - 1)
+    if x1 <= x2 and y1 <= y2:
+        img[y1:y2 + 1, x1:x2 + 1] = color
+
+def draw_detections(img, detections, color, scale=1.0):
+    """
+    Draw bounding boxes with confidence labels on img, in place, and return it.
+    Box coordinates are multiplied by scale (for downscaled frames).
+    """
+    label_scale = LABEL_SCALE * scale if scale < 1.0 else LABEL_SCALE
+    pad = max(1, round(5 * min(scale, 1.0)))
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        if scale != 1.0:
+            x1, y1, x2, y2 = (int(v * scale) for v in (x1, y1, x2, y2))
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, BOX_THICKNESS)
+
+        label = f"person: {det['confidence']:.2f}"
+        w, h = text_size(label, label_scale)
+        fill_rect(img, x1, y1 - h - 2 * pad, x1 + w, y1, color)
+        cv2.putText(img, label, (x1, y1 - pad), FONT, label_scale, LABEL_COLOR, 1)
+    return img
+
+def llava_boxes(result, width, height):
+    """
+    Approximate boxes of the LLaVA pedestrians: the left, center or right
+    third of the lower half of the frame (LLaVA gives no coordinates).
+    """
+    boxes = []
+    for pedestrian in result.get("pedestrians", []):
+        if "position" not in pedestrian:
+            continue
+        if pedestrian["position"] == "left":
+            x1, x2 = 0, width // 3
+        elif pedestrian["position"] == "right":
+            x1, x2 = 2 * width // 3, width
+        else:  # center
+            x1, x2 = width // 3, 2 * width // 3
+        desc = f"{pedestrian.get('approximate_age', 'person')} {pedestrian.get('activity', '')}"
+        boxes.append(((x1, height // 2, x2, height), desc))
+    return boxes
+
+def draw_llava(img, result, scale=1.0):
+    """
+    Draw the LLaVA human count and approximate pedestrian boxes on img, in
+    place. Failed frames (llava_analysis.error_result) show their error type.
+    """
+    height, width = img.shape[:2]
+    text_scale = min(scale, 1.0)
+    if "error" in result:
+        count_text = f"LLaVA error: {result.get('error_type') or 'unknown'}"
+    else:
+        count_text = f"Humans: {result.get('human_count', 0)} (Confidence: {result.get('confidence') or 0:.2f})"
+    cv2.putText(img, count_text, (int(20 * text_scale), int(40 * text_scale)), FONT,
+                LLAVA_COUNT_SCALE * text_scale, LABEL_COLOR, max(1, round(LLAVA_COUNT_THICKNESS * text_scale)))
+    for (x1, y1, x2, y2), desc in llava_boxes(result, width, height):
+        cv2.rectangle(img, (x1, y1), (x2, y2), LLAVA_BOX_COLOR, BOX_THICKNESS)
+        cv2.putText(img, desc, (x1, y1 - int(10 * text_scale)), FONT, LLAVA_DESC_SCALE * text_scale, LABEL_COLOR, 1)
+    return img
+
+def read_frame(frame_path, scale=SCALE):
+    """
+    Decode a frame at scale. JPEGs are decoded directly at the largest
+    reduced size not below scale, then resized the rest of the way.
+    Returns (image, effective scale) or (None, None).
+    """
+    flag, factor = cv2.IMREAD_COLOR, 1.0
+    if frame_path.lower().endswith((".jpg", ".jpeg")):
+        for reduced_factor, reduced in REDUCED_READS:
+            if scale <= reduced_factor:
+                flag, factor = reduced, reduced_factor
+                break
+    img = cv2.imread(frame_path, flag)
+    if img is None:
+        return None, None
+    rest = scale / factor
+    if rest != 1.0:
+        size = (max(1, round(img.shape[1] * rest)), max(1, round(img.shape[0] * rest)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img, scale
+
+def yolo_overlay(frame_data):
+    """Boxes and colour run_yolo_detection.py draws for a frame decision."""
+    from run_yolo_detection import decision_boxes
+    return decision_boxes(frame_data)
+
+def render(img, yolo_data=None, llava_result=None, mode="side", scale=1.0):
+    """
+    Render the results of one frame. img is drawn on in place for "yolo" and
+    "llava"; "side" writes both views into one new image of twice the width.
+    """
+    if mode == "side":
+        h, w = img.shape[:2]
+        canvas = np.empty((h, 2 * w, 3), dtype=img.dtype)
+        canvas[:, :w] = img
+        canvas[:, w:] = img
+        left, right = canvas[:, :w], canvas[:, w:]
+    else:
+        canvas = left = right = img
+    if mode in ("yolo", "side") and yolo_data is not None and yolo_data.get("decision", "none") != "none":
+        boxes, color = yolo_overlay(yolo_data)
+        draw_detections(left, boxes, color, scale)
+    if mode in ("llava", "side") and llava_result is not None:
+        draw_llava(right, llava_result, scale)
+    return canvas
+
+def load_llava_result(llava_dir, frame_name):
+    """The LLaVA JSON of a frame, or None when it has not been analyzed."""
+    path = os.path.join(llava_dir, f"{os.path.splitext(frame_name)[0]}.json")
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def render_batch(frames_dir, output_dir, yolo_metadata=None, llava_dir=None, mode="side",
+                 scale=SCALE, workers=WORKERS, frames=None):
+    """
+    Render every frame of frames_dir (or the given frames) with its YOLO
+    metadata (frame name -> frame_data) and/or LLaVA results directory, in a
+    thread pool. Returns the number of frames written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if frames is None:
+        frames = sorted(f for f in os.listdir(frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    yolo_metadata = yolo_metadata or {}
+    precompute_labels(LABEL_SCALE * scale if scale < 1.0 else LABEL_SCALE)
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+
+    def work(frame_name):
+        img, effective = read_frame(os.path.join(frames_dir, frame_name), scale)
+        if img is None:
+            return False
+        llava_result = load_llava_result(llava_dir, frame_name) if llava_dir else None
+        out = render(img, yolo_metadata.get(frame_name), llava_result, mode, effective)
+        return cv2.imwrite(os.path.join(output_dir, frame_name), out, params)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        written = sum(tqdm(pool.map(work, frames), total=len(frames), desc=f"Rendering ({mode})"))
+    return written
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render YOLO and LLaVA results on frames")
+    parser.add_argument("--frames-dir", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--yolo-metadata", default=None, help="YOLO metadata folder")
+    parser.add_argument("--store", default=None, help="results_store.py directory (YOLO results of --dataset)")
+    parser.add_argument("--dataset", default=None)
+    parser.add_argument("--llava-dir", default=None, help="LLaVA results folder")
+    parser.add_argument("--mode", choices=MODES, default="side")
+    parser.add_argument("--scale", type=float, default=SCALE, help="Output size, e.g. 0.5 or 0.25 for QA")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--only-annotated", action="store_true",
+                        help="Only frames with a YOLO decision or a LLaVA result")
+    args = parser.parse_args()
+
+    metadata = {}
+    if args.store:
+        from llava_routing import load_store_metadata
+        metadata = load_store_metadata(args.store, args.dataset)
+    elif args.yolo_metadata:
+        from llava_routing import load_yolo_metadata
+        metadata = load_yolo_metadata(args.yolo_metadata)
+
+    frames = None
+    if args.only_annotated:
+        llava_frames = set()
+        if args.llava_dir:
+            stems = {os.path.splitext(n)[0] for n in os.listdir(args.llava_dir) if n.endswith(".json")}
+            llava_frames = {f for f in os.listdir(args.frames_dir) if os.path.splitext(f)[0] in stems}
+        frames = sorted(set(metadata) | llava_frames)
+
+    written = render_batch(args.frames_dir, args.output_dir, metadata, args.llava_dir,
+                           args.mode, args.scale, args.workers, frames)
+    print(f"Rendered {written} frames -> {args.output_dir}")
@@ -0,0 +1,482 @@
+"""
+benchmark.py
+
+Reproducible CPU-only benchmark of the pipeline hot paths, to compare
+commits. Everything is generated locally from a seed, no network needed:
+- synthetic driving-like frames (sky, buildings, road with lane markings,
+  cars and pedestrians) and a video made of them (MJPG .avi)
+- a synthetic merged-results.csv for analyze_results.py
+- the deterministic Ollama stub (ollama_stub.py) with configurable latency,
+  HTTP error rate and malformed-answer rate
+
+Cases:
+- process_frame:   run_yolo_detection.process_frame on every frame, with
+                   the real model on CPU or (--detector stub) a
+                   deterministic fake detector, to measure decode/draw/write
+- analyze_image:   llava_analysis.analyze_image against the stub
+- extract_opencv:  frame_stream.opencv_frames + JPEG writes from the video
+- extract_ffmpeg:  extract_frames.extract_frames (skipped without ffmpeg)
+- analyze_results: evaluation + plots of the synthetic CSV, repeated
+
+Each case runs in a fresh Python process, so its peak RSS is its own.
+Results (frames/sec, p50/p95/max latency, peak RSS, errors, environment and
+commit) are written as JSON; `compare` diffs two result files.
+
+    python src/benchmark.py run --output benchmarks/before.json
+    python src/benchmark.py compare benchmarks/before.json benchmarks/after.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import subprocess
+
+import cv2
+import numpy as np
+
+from profiling import peak_rss_bytes, quantile
+
+# ---------------------- Configuration ----------------------
+DATA_DIR = "benchmarks/data"
+OUTPUT_DIR = "benchmarks"
+SEED = 0
+FRAMES = 100              # Synthetic frames for process_frame / analyze_image
+FRAME_SIZE = (1280, 720)  # (width, height)
+VIDEO_FRAMES = 300
+VIDEO_FPS = 30
+FRAME_INTERVAL = 10
+CSV_ROWS = 200_000        # Rows of the synthetic merged-results.csv
+REPEATS = 3               # Runs of analyze_results
+THREADS = 4               # OpenCV / OpenMP threads of every case
+
+# Stub VLM server
+STUB_LATENCY = 0.05
+STUB_JITTER = 0.01
+STUB_ERROR_RATE = 0.05
+STUB_MALFORMED_RATE = 0.05
+
+# Fake detector (--detector stub)
+STUB_DETECTOR_LATENCY = 0.0
+
+CASES = ["process_frame", "analyze_image", "extract_opencv", "extract_ffmpeg", "analyze_results"]
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ---------------------- Synthetic data ----------------------
+def synth_frame(rng, width=FRAME_SIZE[0], height=FRAME_SIZE[1], t=0):
+    """
+    One driving-like BGR frame and its number of pedestrians. t shifts the
+    lane markings so consecutive video frames differ like a moving car.
+    """
+    img = np.empty((height, width, 3), np.uint8)
+    horizon = height * 2 // 5
+    sky = np.linspace(235, 150, horizon, dtype=np.float32)
+    img[:horizon] = np.stack([sky, sky * 0.9, sky * 0.7], axis=1)[:, None, :].astype(np.uint8)
+    img[horizon:] = (85, 85, 90)
+
+    # Buildings on both sides
+    for _ in range(rng.integers(4, 9)):
+        x = int(rng.integers(0, width))
+        w, h = int(rng.integers(width // 12, width // 5)), int(rng.integers(horizon // 2, horizon))
+        color = tuple(int(c) for c in rng.integers(60, 200, 3))
+        cv2.rectangle(img, (x, horizon - h), (x + w, horizon + height // 10), color, -1)
+
+    # Road and dashed lane markings
+    road = np.array([[width * 0.42, horizon], [width * 0.58, horizon], [width, height], [0, height]], np.int32)
+    cv2.fillPoly(img, [road], (60, 60, 60))
+    for y in range(horizon + (t * 7) % 40, height, 40):
+        x = width // 2
+        cv2.line(img, (x, y), (x, min(height, y + 20)), (230, 230, 230), max(1, (y - horizon) // 40))
+
+    # Cars
+    for _ in range(rng.integers(0, 4)):
+        y = int(rng.integers(horizon + 20, height - 60))
+        w = 40 + (y - horizon) // 2
+        x = int(rng.integers(0, max(1, width - w)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(img, (x, y - w // 2), (x + w, y), color, -1)
+        cv2.rectangle(img, (x + w // 6, y - w // 2 - w // 5), (x + w * 5 // 6, y - w // 2), (40, 40, 40), -1)
+
+    # Pedestrians: head and body, taller closer to the camera
+    persons = int(rng.integers(0, 5))
+    for _ in range(persons):
+        y = int(rng.integers(horizon + 30, height - 10))
+        h = 40 + (y - horizon) * 3 // 4
+        x = int(rng.integers(0, width - h // 3))
+        color = tuple(int(c) for c in rng.integers(20, 220, 3))
+        cv2.rectangle(img, (x, y - h * 4 // 5), (x + h // 4, y), color, -1)
+        cv2.circle(img, (x + h // 8, y - h * 9 // 10), max(2, h // 10), (140, 170, 200), -1)
+
+    noise = rng.integers(0, 12, (height, width, 1), dtype=np.uint8)
+    return cv2.add(img, np.repeat(noise, 3, axis=2)), persons
+
+def make_frames(out_dir, n=FRAMES, size=FRAME_SIZE, seed=SEED):
+    """Write n synthetic frames as frame_%04d.jpg (reused if already generated)."""
+    manifest = os.path.join(out_dir, "manifest.json")
+    params = {"n": n, "size": list(size), "seed": seed}
+    if os.path.exists(manifest):
+        with open(manifest, "r") as f:
+            if json.load(f)["params"] == params:
+                return out_dir
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    persons = {}
+    for i in range(n):
+        img, count = synth_frame(rng, *size)
+        name = f"frame_{i + 1:04d}.jpg"
+        cv2.imwrite(os.path.join(out_dir, name), img)
+        persons[name] = count
+    with open(manifest, "w") as f:
+        json.dump({"params": params, "persons": persons}, f)
+    return out_dir
+
+def make_video(path, n=VIDEO_FRAMES, size=FRAME_SIZE, fps=VIDEO_FPS, seed=SEED):
+    """Write an MJPG video of n synthetic frames (reused if already generated)."""
+    stamp = f"{path}.json"
+    params = {"n": n, "size": list(size), "fps": fps, "seed": seed}
+    if os.path.exists(path) and os.path.exists(stamp):
+        with open(stamp, "r") as f:
+            if json.load(f) == params:
+                return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, tuple(size))
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(0, 2 ** 31)
+    for t in range(n):
+        # Scene content changes every second, lane markings move every frame
+        img, _ = synth_frame(np.random.default_rng(scene + t // fps), *size, t=t)
+        writer.write(img)
+    writer.release()
+    with open(stamp, "w") as f:
+        json.dump(params, f)
+    return path
+
+def make_merged_csv(path, rows=CSV_ROWS, seed=SEED):
+    """Write a merged-results.csv with the columns analyze_results.py reads."""
+    import pandas as pd
+
+    stamp = f"{path}.json"
+    params = {"rows": rows, "seed": seed}
+    if os.path.exists(path) and os.path.exists(stamp):
+        with open(stamp, "r") as f:
+            if json.load(f) == params:
+                return path
+    rng = np.random.default_rng(seed)
+    true_count = rng.poisson(1.2, rows)
+    yolo_count = np.maximum(0, true_count + rng.integers(-1, 2, rows))
+    llava_count = np.maximum(0, true_count + rng.integers(-1, 2, rows))
+    dataset = np.array([f"part{i}" for i in range(1, 7)])[rng.integers(0, 6, rows)]
+    df = pd.DataFrame({
+        "frame": [f"frame_{i % 10000:04d}.jpg" for i in range(rows)],
+        "true_person_count": true_count,
+        "fake_person_count": rng.binomial(1, 0.1, rows),
+        "dataset_x": dataset,
+        "yolo_count": yolo_count,
+        "yolo_max_conf": np.where(yolo_count > 0, rng.uniform(0.4, 0.95, rows), 0.0),
+        "yolo_decision": np.where(yolo_count > 0, "person", "none"),
+        "dataset_y": dataset,
+        "llava_count": llava_count,
+        "llava_confidence": rng.uniform(0.5, 1.0, rows).round(2),
+        "llava_scene": "An urban street scene with pedestrians on the sidewalk.",
+    })
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    df.to_csv(path, index=False)
+    with open(stamp, "w") as f:
+        json.dump(params, f)
+    return path
+
+# ---------------------- Classes ----------------------
+class StubBox:
+    """One box with the attributes extract_detections reads from ultralytics."""
+    def __init__(self, xyxy, conf):
+        self.xyxy = np.array([xyxy], np.float32)
+        self.conf = np.array([conf], np.float32)
+
+
+class StubResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.speed = {}
+
+
+class StubDetector:
+    """
+    Deterministic stand-in for the YOLO model: 0-4 person boxes derived from
+    the image content, after an optional fixed latency. Isolates the cost of
+    everything around the model (decode, decision, drawing, writes).
+    """
+    def __init__(self, latency=STUB_DETECTOR_LATENCY):
+        self.latency = latency
+
+    def __call__(self, img, conf=0.25, classes=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        h, w = img.shape[:2]
+        rng = np.random.default_rng(int(img[::97, ::89].sum()))
+        boxes = []
+        for _ in range(rng.integers(0, 5)):
+            bh = int(rng.integers(h // 10, h // 2))
+            x1, y1 = int(rng.integers(0, w - bh // 3)), int(rng.integers(0, h - bh))
+            score = float(rng.uniform(0.3, 0.95))
+            if score >= conf:
+                boxes.append(StubBox([x1, y1, x1 + bh // 3, y1 + bh], score))
+        return [StubResult(boxes)]
+
+# ---------------------- Cases ----------------------
+def frame_paths(frames_dir):
+    return sorted(os.path.join(frames_dir, f) for f in os.listdir(frames_dir) if f.endswith(".jpg"))
+
+def timed(items, fn):
+    """Call fn on every item; return per-item latencies and the number of errors."""
+    latencies, errors = [], 0
+    for item in items:
+        start = time.perf_counter()
+        errors += bool(fn(item))
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+def case_process_frame(args, work_dir):
+    import run_yolo_detection as ryd
+
+    if args.detector == "stub":
+        ryd._model = StubDetector(args.stub_detector_latency)
+    frames = frame_paths(os.path.join(args.data_dir, "frames"))
+    out = os.path.join(work_dir, "yolo")
+    ryd.create_output_dirs(out)
+    ryd.process_frame(frames[0], out)  # Warm-up: model load and first inference
+
+    def process(path):
+        ryd.process_frame(path, out)
+        return False  # Frames without detections are a result, not an error
+    return timed(frames, process)
+
+def case_analyze_image(args, work_dir):
+    import llava_analysis
+    from ollama_stub import start_stub_server
+
+    server, url = start_stub_server(port=0, latency=args.stub_latency, jitter=args.stub_jitter,
+                                    error_rate=args.stub_error_rate, malformed_rate=args.stub_malformed_rate,
+                                    seed=args.seed)
+    llava_analysis.OLLAMA_URL = url
+    try:
+        frames = frame_paths(os.path.join(args.data_dir, "frames"))
+        return timed(frames, lambda p: "error" in llava_analysis.analyze_image(p))
+    finally:
+        server.shutdown()
+
+def case_extract_opencv(args, work_dir):
+    from frame_stream import opencv_frames
+
+    out = os.path.join(work_dir, "frames")
+    os.makedirs(out, exist_ok=True)
+    frames = opencv_frames(os.path.join(args.data_dir, "video.avi"), args.frame_interval)
+
+    def write(item):
+        name, img = item
+        return not cv2.imwrite(os.path.join(out, name), img)
+
+    # Decode time of each frame is included in the latency of the next write
+    latencies, errors, start = [], 0, time.perf_counter()
+    for item in frames:
+        errors += write(item)
+        now = time.perf_counter()
+        latencies.append(now - start)
+        start = now
+    return latencies, errors
+
+def case_extract_ffmpeg(args, work_dir):
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("skipped: ffmpeg not found")
+    from extract_frames import extract_frames
+
+    start = time.perf_counter()
+    n = extract_frames(os.path.join(args.data_dir, "video.avi"), os.path.join(work_dir, "frames"), args.frame_interval)
+    elapsed = time.perf_counter() - start
+    # One subprocess for the whole video: per-frame latency is the average
+    return [elapsed / max(n, 1)] * n, 0
+
+def case_analyze_results(args, work_dir):
+    from analyze_results import load_engine, run_analysis
+
+    csv_path = os.path.join(args.data_dir, "merged-results.csv")
+    latencies = []
+    for i in range(args.repeats):
+        start = time.perf_counter()
+        run_analysis(load_engine(csv_path), os.path.join(work_dir, f"conclusion_{i}"), summary_csv=None)
+        latencies.append(time.perf_counter() - start)
+    return latencies, 0
+
+CASE_FUNCTIONS = {
+    "process_frame": case_process_frame,
+    "analyze_image": case_analyze_image,
+    "extract_opencv": case_extract_opencv,
+    "extract_ffmpeg": case_extract_ffmpeg,
+    "analyze_results": case_analyze_results,
+}
+
+def run_case(args):
+    """Body of the child process: run one case and print its result as JSON."""
+    import tempfile
+
+    cv2.setNumThreads(args.threads)
+    baseline_rss = peak_rss_bytes()
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{args.case}_")
+    start = time.perf_counter()
+    try:
+        latencies, errors = CASE_FUNCTIONS[args.case](args, work_dir)
+        elapsed = time.perf_counter() - start
+        ordered = sorted(latencies)
+        unit_rows = args.csv_rows if args.case == "analyze_results" else 1
+        result = {
+            "status": "ok",
+            "items": len(latencies),
+            "seconds": elapsed,
+            "items_per_sec": len(latencies) * unit_rows / sum(latencies) if sum(latencies) else 0.0,
+            "latency_p50_ms": quantile(ordered, 0.50) * 1000,
+            "latency_p95_ms": quantile(ordered, 0.95) * 1000,
+            "latency_max_ms": (ordered[-1] if ordered else 0.0) * 1000,
+            "errors": errors,
+            "peak_rss_mb": peak_rss_bytes() / 1024 ** 2,
+            "baseline_rss_mb": baseline_rss / 1024 ** 2,
+        }
+    except Exception as e:
+        if str(e).startswith("skipped"):
+            result = {"status": "skipped", "error": str(e).split(": ", 1)[-1]}
+        else:
+            result = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(result))
+
+# ---------------------- Functions ----------------------
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC_DIR, stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=SRC_DIR)
+        return commit.decode().strip(), bool(dirty.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def case_argv(args):
+    """Options forwarded to the child process of each case."""
+    argv = []
+    for name in ("data_dir", "seed", "frame_interval", "csv_rows", "repeats", "threads", "detector",
+                 "stub_detector_latency", "stub_latency", "stub_jitter", "stub_error_rate", "stub_malformed_rate"):
+        argv += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    return argv
+
+def run_benchmarks(args):
+    make_frames(os.path.join(args.data_dir, "frames"), args.frames, (args.width, args.height), args.seed)
+    make_video(os.path.join(args.data_dir, "video.avi"), args.video_frames, (args.width, args.height),
+               VIDEO_FPS, args.seed)
+    make_merged_csv(os.path.join(args.data_dir, "merged-results.csv"), args.csv_rows, args.seed)
+
+    # CPU only, fixed thread counts
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="", OMP_NUM_THREADS=str(args.threads),
+               MKL_NUM_THREADS=str(args.threads), MPLBACKEND="Agg")
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("command", "output", "cases")},
+        "cases": {},
+    }
+    for case in args.cases:
+        print(f"Running {case}...", flush=True)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "case", case] + case_argv(args),
+                              capture_output=True, text=True, env=env, cwd=os.getcwd())
+        try:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            result = {"status": "failed", "error": proc.stderr.strip().splitlines()[-1:] or "no output"}
+        report["cases"][case] = result
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nResults written to {args.output}")
+
+def print_report(report):
+    print(f"\n=== Benchmark ({(report['commit'] or 'unknown')[:10]}{' dirty' if report['dirty'] else ''}) ===")
+    print(f"{'case':<18}{'items':>7}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'peak MB':>10}{'errors':>8}")
+    for case, r in report["cases"].items():
+        if r["status"] != "ok":
+            print(f"{case:<18}  {r['status']}: {r.get('error', '')}")
+            continue
+        print(f"{case:<18}{r['items']:>7}{r['items_per_sec']:>12.1f}{r['latency_p50_ms']:>10.1f}"
+              f"{r['latency_p95_ms']:>10.1f}{r['peak_rss_mb']:>10.0f}{r['errors']:>8}")
+
+def compare_reports(before_path, after_path):
+    """Relative change of throughput, p95 latency and peak RSS per case."""
+    with open(before_path, "r") as f:
+        before = json.load(f)
+    with open(after_path, "r") as f:
+        after = json.load(f)
+    if before["params"] != after["params"]:
+        print("Warning: the two runs used different parameters")
+    change = lambda a, b: f"{(b - a) / a:+.1%}" if a else "n/a"
+    print(f"{'case':<18}{'items/s':>12}{'p95':>10}{'peak RSS':>10}")
+    for case in after["cases"]:
+        a, b = before["cases"].get(case, {}), after["cases"][case]
+        if a.get("status") != "ok" or b["status"] != "ok":
+            print(f"{case:<18}  {a.get('status', 'missing')} -> {b['status']}")
+            continue
+        print(f"{case:<18}{change(a['items_per_sec'], b['items_per_sec']):>12}"
+              f"{change(a['latency_p95_ms'], b['latency_p95_ms']):>10}{change(a['peak_rss_mb'], b['peak_rss_mb']):>10}")
+
+def add_case_arguments(parser):
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--frame-interval", type=int, default=FRAME_INTERVAL)
+    parser.add_argument("--csv-rows", type=int, default=CSV_ROWS)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--threads", type=int, default=THREADS)
+    parser.add_argument("--detector", choices=["model", "stub"], default="model",
+                        help="Real YOLO model on CPU, or a deterministic fake detector")
+    parser.add_argument("--stub-detector-latency", type=float, default=STUB_DETECTOR_LATENCY)
+    parser.add_argument("--stub-latency", type=float, default=STUB_LATENCY)
+    parser.add_argument("--stub-jitter", type=float, default=STUB_JITTER)
+    parser.add_argument("--stub-error-rate", type=float, default=STUB_ERROR_RATE)
+    parser.add_argument("--stub-malformed-rate", type=float, default=STUB_MALFORMED_RATE)
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Generate the synthetic data and run the benchmark cases")
+    add_case_arguments(run)
+    run.add_argument("--cases", nargs="*", default=CASES, choices=CASES)
+    run.add_argument("--frames", type=int, default=FRAMES)
+    run.add_argument("--video-frames", type=int, default=VIDEO_FRAMES)
+    run.add_argument("--width", type=int, default=FRAME_SIZE[0])
+    run.add_argument("--height", type=int, default=FRAME_SIZE[1])
+    run.add_argument("--output", default=None, help="Result JSON (default: benchmarks/<commit>.json)")
+
+    case = sub.add_parser("case", help="Run a single case (used internally, one process per case)")
+    case.add_argument("case", choices=CASES)
+    add_case_arguments(case)
+
+    cmp = sub.add_parser("compare", help="Compare two result files")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        if args.output is None:
+            commit, _ = git_commit()
+            args.output = os.path.join(OUTPUT_DIR, f"{(commit or 'results')[:10]}.json")
+        run_benchmarks(args)
+    elif args.command == "case":
+        run_case(args)
+    else:
+        compare_reports(args.before, args.after)
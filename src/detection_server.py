@@ -0,0 +1,335 @@
+"""
+detection_server.py
+
+Long-lived local YOLO detection service. Every detection script otherwise
+imports ultralytics/torch and loads yolov8m.pt itself, which dominates the
+run time of small dataset jobs. The server loads the model once (any
+yolo_backends.py backend), warms it up, and serves frame batches to any
+number of local clients:
+- requests and replies are small length-prefixed JSON messages over a Unix
+  domain socket
+- frames travel through shared memory: the client writes a batch into a
+  SharedMemory block once, and the server runs the model on ndarray views
+  of that block, without copying or serializing pixels
+- model calls from concurrent clients are serialized, so one warm model
+  serves every job
+
+DetectionClient is callable like ultralytics.YOLO (same keyword arguments,
+results with .boxes[i].xyxy/.conf and .speed), so run_yolo_detection.py,
+yolo_pipeline.py, tracker.py and tiled_inference.py use it unchanged via
+--server.
+
+Usage:
+    python detection_server.py serve --backend torch &
+    python run_yolo_detection.py --server /tmp/pedestrian-detection.sock --frames-dir ...
+    python detection_server.py ping
+    python detection_server.py stop
+"""
+
+import os
+import json
+import time
+import atexit
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# ---------------------- Configuration ----------------------
+SOCKET_PATH = "/tmp/pedestrian-detection.sock"
+HEADER = struct.Struct("!I")   # Length prefix of every message
+MAX_MESSAGE = 64 * 1024 ** 2
+WARMUP_SHAPE = (640, 640, 3)
+
+# ---------------------- Functions ----------------------
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_message(sock):
+    (size,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if size > MAX_MESSAGE:
+        raise ValueError(f"Message of {size} bytes exceeds MAX_MESSAGE")
+    return json.loads(_recv_exact(sock, size))
+
+def attach_shared_memory(name):
+    """
+    Attach to a client's block. The client owns it: stop the resource
+    tracker from unlinking it when the server exits.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+def result_boxes(result):
+    """[x1, y1, x2, y2, confidence] of every box of an ultralytics result."""
+    return [[*map(float, box.xyxy[0].tolist()), float(box.conf[0])] for box in result.boxes]
+
+# ---------------------- Classes ----------------------
+class DetectionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server around one warm model; one thread per client connection."""
+    daemon_threads = True
+
+    def __init__(self, model, socket_path=SOCKET_PATH, info=None):
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                raise RuntimeError(f"A detection server is already listening on {socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(socket_path)  # Stale socket of a previous server
+            finally:
+                probe.close()
+        self.model = model
+        self.info = dict(info or {})
+        self.model_lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.frames = 0
+        self.busy_seconds = 0.0
+        super().__init__(socket_path, DetectionHandler)
+
+    def detect(self, images, kwargs):
+        with self.model_lock:
+            start = time.perf_counter()
+            results = self.model(images, **kwargs)
+            self.busy_seconds += time.perf_counter() - start
+            self.requests += 1
+            self.frames += len(images)
+        return results
+
+    def stats(self):
+        return dict(self.info, uptime=time.time() - self.started, requests=self.requests,
+                    frames=self.frames, busy_seconds=self.busy_seconds)
+
+
+class DetectionHandler(socketserver.BaseRequestHandler):
+    """Serves the requests of one client connection until it closes."""
+    def handle(self):
+        attached = {}  # Shared memory blocks of this client, by name
+        try:
+            while True:
+                try:
+                    request = recv_message(self.request)
+                except ConnectionError:
+                    break
+                try:
+                    reply = self.dispatch(request, attached)
+                except Exception as e:
+                    reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                send_message(self.request, reply)
+                if request.get("op") == "shutdown":
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    break
+        finally:
+            for shm in attached.values():
+                shm.close()
+
+    def dispatch(self, request, attached):
+        op = request.get("op")
+        if op == "ping":
+            return {"ok": True, **self.server.stats()}
+        if op == "shutdown":
+            return {"ok": True}
+        if op != "detect":
+            raise ValueError(f"Unknown op {op!r}")
+
+        name = request["shm"]
+        if name not in attached:
+            # A client that grew its buffer has released the previous block
+            for old in attached.values():
+                old.close()
+            attached.clear()
+            attached[name] = attach_shared_memory(name)
+        batch = np.ndarray(request["shape"], dtype=request["dtype"], buffer=attached[name].buf)
+        images = list(batch)  # Views into the shared block, no copies
+        try:
+            results = self.server.detect(images, request.get("kwargs", {}))
+            boxes = [result_boxes(r) for r in results]
+            speed = [getattr(r, "speed", None) for r in results]
+        finally:
+            del batch, images  # Release the views before the block can be closed
+        return {"ok": True, "boxes": boxes, "speed": speed}
+
+
+class RemoteBox:
+    """One box, with the .xyxy and .conf layout of ultralytics boxes."""
+    __slots__ = ("xyxy", "conf")
+
+    def __init__(self, values):
+        self.xyxy = np.asarray([values[:4]], dtype=np.float64)
+        self.conf = np.asarray([values[4]], dtype=np.float64)
+
+
+class RemoteResult:
+    """The parts of an ultralytics result the detection scripts read."""
+    def __init__(self, boxes, speed=None, orig_img=None):
+        self.boxes = [RemoteBox(b) for b in boxes]
+        self.speed = speed or {}
+        self.orig_img = orig_img
+
+    def plot(self, img=None):
+        """Boxes drawn on img (in place), or on a copy of the original frame."""
+        from annotation_renderer import draw_detections
+        img = self.orig_img.copy() if img is None else img
+        detections = [{"bbox": list(map(int, b.xyxy[0].tolist())), "confidence": float(b.conf[0])}
+                      for b in self.boxes]
+        return draw_detections(img, detections, (0, 255, 0))
+
+
+class SharedFrames:
+    """Client-side shared memory block holding one frame batch, grown on demand."""
+    def __init__(self):
+        self.shm = None
+
+    def view(self, shape, dtype=np.uint8):
+        """Writable ndarray of shape in shared memory (valid until the next call)."""
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.shm is None or self.shm.size < size:
+            self.close()
+            # Headroom so slowly growing batches do not reallocate every time
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size + size // 4, 1))
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class DetectionClient:
+    """
+    Connection to a DetectionServer. Calling it like an ultralytics model
+    (model(img_or_list, conf=..., classes=[0], ...)) returns RemoteResults.
+    """
+    def __init__(self, socket_path=SOCKET_PATH, timeout=None):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.frames = SharedFrames()
+        self._lock = threading.Lock()
+        self._info = None
+        atexit.register(self.close)  # Unlink the shared memory block on exit
+
+    @property
+    def info(self):
+        """Model and backend of the server (fetched once)."""
+        if self._info is None:
+            self._info = self.ping()
+        return self._info
+
+    def request(self, message):
+        with self._lock:
+            send_message(self.sock, message)
+            reply = recv_message(self.sock)
+        if not reply.get("ok"):
+            raise RuntimeError(f"Detection server: {reply.get('error')}")
+        return reply
+
+    def ping(self):
+        return self.request({"op": "ping"})
+
+    def shutdown(self):
+        return self.request({"op": "shutdown"})
+
+    def _detect_batch(self, images, kwargs):
+        """One request for images of identical shape."""
+        with self._lock:
+            batch = self.frames.view((len(images),) + images[0].shape, images[0].dtype)
+            for i, img in enumerate(images):
+                batch[i] = img
+            message = {"op": "detect", "shm": self.frames.shm.name, "shape": list(batch.shape),
+                       "dtype": batch.dtype.str, "kwargs": kwargs}
+            del batch
+            send_message(self.sock, message)
+            reply = recv_message(self.sock)
+        if not reply.get("ok"):
+            raise RuntimeError(f"Detection server: {reply.get('error')}")
+        return [RemoteResult(b, s, img) for b, s, img in zip(reply["boxes"], reply["speed"], images)]
+
+    def detect(self, images, **kwargs):
+        """Detections of a list of frames; frames of different sizes are sent as separate batches."""
+        results = []
+        start = 0
+        while start < len(images):
+            end = start + 1
+            while end < len(images) and images[end].shape == images[start].shape and images[end].dtype == images[start].dtype:
+                end += 1
+            results += self._detect_batch(images[start:end], kwargs)
+            start = end
+        return results
+
+    def __call__(self, source, **kwargs):
+        return self.detect(source if isinstance(source, list) else [source], **kwargs)
+
+    def close(self):
+        self.sock.close()
+        self.frames.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent local YOLO detection server")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="Load the model and serve until stopped")
+    serve.add_argument("--backend", default="torch",
+                       choices=["torch", "onnx", "onnx-int8", "openvino", "openvino-int8"])
+    serve.add_argument("--no-warmup", action="store_true")
+    sub.add_parser("ping", help="Show the server's model and counters")
+    sub.add_parser("stop", help="Shut the server down")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        import run_yolo_detection as ryd
+        ryd.BACKEND = args.backend
+        start = time.perf_counter()
+        model = ryd.load_model()
+        if not args.no_warmup:
+            model(np.zeros(WARMUP_SHAPE, dtype=np.uint8), conf=ryd.CONF_LOW, classes=[0], verbose=False)
+        print(f"Model {ryd.MODEL_PATH} ({args.backend}) ready in {time.perf_counter() - start:.1f}s, "
+              f"listening on {args.socket}")
+        server = DetectionServer(model, args.socket, {"model": ryd.MODEL_PATH, "backend": args.backend})
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+            stats = server.stats()
+            print(f"Served {stats['frames']} frames in {stats['requests']} requests")
+    else:
+        with DetectionClient(args.socket, timeout=10) as client:
+            reply = client.ping() if args.command == "ping" else client.shutdown()
+        for key, value in reply.items():
+            if key != "ok":
+                print(f"{key:<14} {value:.1f}" if isinstance(value, float) else f"{key:<14} {value}")
+        if args.command == "stop":
+            print("Server stopped")
@@ -0,0 +1,363 @@
+"""
+disagreement_index.py
+
+Queryable index of the frames where YOLO, LLaVA and the ground truth
+disagree (e.g. the false positives in images/), instead of scanning
+merged-results.csv by hand.
+
+One row per (dataset, frame) with the stage outputs the features need:
+- counts and confidences: yolo_count, yolo_max_conf, yolo_decision,
+  llava_count, llava_confidence, true_person_count, fake_person_count
+- derived features: yolo_gt_delta, llava_gt_delta, yolo_llava_delta (signed
+  count differences), conf_gap (yolo_max_conf - llava_confidence) and
+  disagreement (sum of the absolute count deltas)
+- keyword hits kw_<name> in llava_scene and rejected_items (mannequin,
+  reflection, poster, ...); scene sentences that deny the object ("there
+  are no mannequins") do not count
+
+The index is built incrementally: only rows appended to merged-results.csv
+and part files added to the results store since the last build are read,
+and are upserted by key. A merged CSV that was rewritten instead of
+appended to is detected by its recorded identity and the index is rebuilt. It is kept as one Parquet file of compact columns
+that loads in a fraction of a second; top-K and filter queries are then
+vectorized pandas operations (milliseconds on millions of frames), and the
+matching frames can be exported as a list for relabeling or re-analysis
+(frame first, as orchestrator.py and image_selection.py read selections).
+
+Usage:
+    python disagreement_index.py build --merged-csv results/merged-results.csv
+    python disagreement_index.py query --preset yolo_fp --keyword mannequin --top 50 --output relabel.csv
+    python disagreement_index.py query --where "abs(yolo_llava_delta) >= 2 and conf_gap > 0.3" --sort disagreement
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from result_cache import file_identity, is_unchanged_or_appended
+
+# ---------------------- Configuration ----------------------
+INDEX_DIR = "/home/serine/datos/newdataset/DISAGREEMENT-INDEX"
+INDEX_FILE = "index.parquet"
+STATE_FILE = "state.json"
+
+KEY = ["dataset", "frame"]
+# Keyword group -> patterns searched in llava_scene and rejected_items
+KEYWORDS = {
+    "mannequin": r"mannequin|statue|sculpture|dummy",
+    "reflection": r"reflect|mirror",
+    "poster": r"poster|billboard|advertis|banner|mural",
+    "vehicle_part": r"vehicle part|car part",
+}
+NEGATION = re.compile(r"\b(no|not|without|neither|nor|none)\b")
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+# Columns each source stage provides
+STAGE_COLUMNS = {
+    "ground_truth": ["true_person_count", "fake_person_count"],
+    "yolo": ["yolo_count", "yolo_max_conf", "yolo_decision"],
+    "llava": ["llava_count", "llava_confidence"] + [f"kw_{k}" for k in KEYWORDS],
+}
+NUMERIC = ["true_person_count", "fake_person_count", "yolo_count", "yolo_max_conf",
+           "llava_count", "llava_confidence"]
+
+# Named filters for --preset (DataFrame.query expressions)
+PRESETS = {
+    "yolo_fp": "true_person_count == 0 and yolo_count > 0",
+    "yolo_fn": "true_person_count > 0 and yolo_count == 0",
+    "llava_fp": "true_person_count == 0 and llava_count > 0",
+    "llava_fn": "true_person_count > 0 and llava_count == 0",
+    "models_disagree": "yolo_llava_delta != 0",
+    "both_wrong": "yolo_gt_delta != 0 and llava_gt_delta != 0",
+    "fake_persons": "fake_person_count > 0",
+    "confident_yolo_llava_zero": "yolo_max_conf >= 0.6 and llava_count == 0",
+}
+
+# ---------------------- Functions ----------------------
+def keyword_hits(scene, rejected_items):
+    """
+    Keyword groups found in a LLaVA answer: anywhere in rejected_items, and
+    in the scene sentences that do not negate them.
+    """
+    hits = {f"kw_{k}": False for k in KEYWORDS}
+    texts = []
+    if isinstance(rejected_items, str) and rejected_items not in ("", "[]"):
+        texts.append(rejected_items.lower())
+    if isinstance(scene, str):
+        texts += [s for s in SENTENCE.split(scene.lower()) if not NEGATION.search(s)]
+    text = " ".join(texts)
+    for name, pattern in KEYWORDS.items():
+        hits[f"kw_{name}"] = re.search(pattern, text) is not None
+    return hits
+
+def key_strings(df):
+    """One string per (dataset, frame) key, for fast lookups."""
+    return (df["dataset"].astype(str) + "/" + df["frame"].astype(str)).to_numpy()
+
+def llava_features(df):
+    """llava_count, llava_confidence and keyword columns of LLaVA rows."""
+    scenes = df["llava_scene"] if "llava_scene" in df else pd.Series(None, index=df.index)
+    rejected = df["rejected_items"] if "rejected_items" in df else pd.Series(None, index=df.index)
+    hits = pd.DataFrame([keyword_hits(s, r) for s, r in zip(scenes, rejected)], index=df.index,
+                        columns=[f"kw_{k}" for k in KEYWORDS])
+    return pd.concat([df[KEY + ["llava_count", "llava_confidence"]], hits], axis=1)
+
+# ---------------------- Classes ----------------------
+class DisagreementIndex:
+    """
+    Per-frame disagreement features, upserted from the stage outputs and
+    persisted in index_dir.
+    """
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.reset()
+
+    def reset(self):
+        """Empty the index, so every source is read again from the start."""
+        self.df = pd.DataFrame(columns=KEY)
+        self._keys = None     # (dataset, frame) -> row, built on the first upsert
+        self.rows_seen = {}   # merged CSV path -> rows already indexed
+        self.sources = {}     # merged CSV path -> result_cache.file_identity when it was read
+        self.store_parts = {} # "<store>:<stage>" -> part files already indexed
+
+    # ---------------------- Building ----------------------
+    def upsert(self, rows, columns):
+        """Set columns of the (dataset, frame) keys in rows, adding new keys."""
+        if rows.empty:
+            return 0
+        rows = rows.drop_duplicates(KEY, keep="last")
+        if self._keys is None:
+            self._keys = pd.Index(key_strings(self.df))
+        keys = key_strings(rows)
+        positions = self._keys.get_indexer(keys)
+        is_new = positions < 0
+        if is_new.any():
+            positions[is_new] = np.arange(len(self.df), len(self.df) + is_new.sum())
+            added = rows.loc[is_new, KEY]
+            self.df = pd.concat([self.df.astype({"dataset": object}), added], ignore_index=True)
+            self._keys = self._keys.append(pd.Index(keys[is_new]))
+        for col in columns:
+            if col not in self.df:
+                self.df[col] = np.nan
+            values = self.df[col].to_numpy(copy=True)
+            update = rows[col].to_numpy()
+            if values.dtype != update.dtype:
+                numeric = values.dtype.kind in "biuf" and update.dtype.kind in "biuf"
+                values = values.astype(np.result_type(values.dtype, update.dtype, np.float32) if numeric else object)
+            values[positions] = update
+            self.df[col] = values
+        return len(rows)
+
+    def derive(self):
+        """Normalize column types and recompute the derived features."""
+        df = self.df
+        df["dataset"] = df["dataset"].astype("category")
+        for col in NUMERIC:
+            if col not in df:
+                df[col] = np.nan
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+        # As in ResultsStore.merged: no YOLO row means no detection
+        df["yolo_count"] = df["yolo_count"].fillna(0)
+        decision = df["yolo_decision"].astype(object) if "yolo_decision" in df else pd.Series(None, index=df.index, dtype=object)
+        df["yolo_decision"] = decision.fillna("none").astype("category")
+        for name in KEYWORDS:
+            col = f"kw_{name}"
+            df[col] = df[col].fillna(False).astype(bool) if col in df else False
+        df["yolo_gt_delta"] = df["yolo_count"] - df["true_person_count"]
+        df["llava_gt_delta"] = df["llava_count"] - df["true_person_count"]
+        df["yolo_llava_delta"] = df["yolo_count"] - df["llava_count"]
+        df["conf_gap"] = df["yolo_max_conf"] - df["llava_confidence"]
+        deltas = df[["yolo_gt_delta", "llava_gt_delta", "yolo_llava_delta"]].abs()
+        df["disagreement"] = deltas.sum(axis=1, min_count=1).astype("float32")
+
+    def rewritten(self, path):
+        """True if path was indexed before and is no longer an append of what was read."""
+        return bool(self.rows_seen.get(path)) and not is_unchanged_or_appended(path, self.sources.get(path))
+
+    def update_csv(self, path, chunksize=200_000):
+        """
+        Index the rows of a merged-results.csv appended since the last build.
+        Rows of a rewritten file cannot be told apart from the other sources'
+        ones, so the index is reset and rebuilt from this file.
+        """
+        if self.rewritten(path):
+            print(f"{path} was rewritten since the last build, re-indexing")
+            self.reset()
+        seen = self.rows_seen.get(path, 0)
+        identity = file_identity(path)
+        new_rows = 0
+        reader = pd.read_csv(path, skiprows=range(1, seen + 1), chunksize=chunksize)
+        for chunk in reader:
+            # The CSV joins the LLaVA results (dataset_y) to the ground truth and
+            # YOLO rows (dataset_x) on the frame name only, so a frame name found
+            # in several datasets pairs every dataset with every other one: key
+            # each side by its own dataset column
+            left = chunk.rename(columns={"dataset_x": "dataset"})
+            self.upsert(left, STAGE_COLUMNS["ground_truth"] + STAGE_COLUMNS["yolo"][:2])
+            self.upsert(left[left["yolo_decision"].notna()], ["yolo_decision"])
+            right = chunk.rename(columns={"dataset_y": "dataset"})
+            self.upsert(llava_features(right[right["dataset"].notna()]), STAGE_COLUMNS["llava"])
+            new_rows += len(chunk)
+        self.rows_seen[path] = seen + new_rows
+        self.sources[path] = identity
+        return new_rows
+
+    def update_store(self, store_dir):
+        """Index the part files added to a results_store.py directory since the last build."""
+        from results_store import ResultsStore
+        store = ResultsStore(store_dir)
+        wanted = {
+            "ground_truth": STAGE_COLUMNS["ground_truth"],
+            "yolo": STAGE_COLUMNS["yolo"],
+            "llava": ["llava_count", "llava_confidence", "llava_scene", "rejected_items"],
+        }
+        new_rows = 0
+        for stage, columns in wanted.items():
+            key = f"{os.path.abspath(store_dir)}:{stage}"
+            done = set(self.store_parts.get(key, []))
+            parts = store._parts(stage)
+            new_parts = [p for p in parts if os.path.basename(p) not in done]
+            if not new_parts:
+                continue
+            df = pq.ParquetDataset(new_parts).read(columns=KEY + columns + ["_written"]).to_pandas()
+            df = df.sort_values("_written", kind="stable")
+            if stage == "llava":
+                df = llava_features(df)
+            new_rows += self.upsert(df, STAGE_COLUMNS[stage])
+            # Compaction replaces the part files: keep only the names still present
+            self.store_parts[key] = sorted(os.path.basename(p) for p in parts)
+        return new_rows
+
+    # ---------------------- Queries ----------------------
+    def query(self, where=None, presets=(), datasets=None, keywords=(), decisions=None, sort=None,
+              top=None, ascending=False):
+        """
+        Frames matching every filter, optionally the top K by a column
+        (largest first, or by absolute value with sort="abs:<column>").
+        """
+        df = self.df
+        mask = np.ones(len(df), dtype=bool)
+        if datasets:
+            mask &= df["dataset"].isin(datasets).to_numpy()
+        for name in keywords:
+            mask &= df[f"kw_{name}"].to_numpy()
+        if decisions:
+            mask &= df["yolo_decision"].isin(decisions).to_numpy()
+        for expr in [PRESETS[p] for p in presets] + ([where] if where else []):
+            mask &= df.eval(expr).to_numpy(dtype=bool)
+        rows = np.flatnonzero(mask)
+        if sort:
+            values = df[sort[4:] if sort.startswith("abs:") else sort].to_numpy(dtype=np.float64)[rows]
+            if sort.startswith("abs:"):
+                values = np.abs(values)
+            # Missing values rank last either way
+            values = np.where(np.isnan(values), np.inf, values if ascending else -values)
+            if top and top < len(rows):
+                part = np.argpartition(values, top)[:top]
+                rows, values = rows[part], values[part]
+            rows = rows[np.argsort(values, kind="stable")]
+        if top:
+            rows = rows[:top]
+        return df.iloc[rows]
+
+    def counts(self):
+        """Number of frames per preset and keyword."""
+        rows = {name: int(self.df.eval(expr).sum()) for name, expr in PRESETS.items()}
+        rows.update({f"kw_{name}": int(self.df[f"kw_{name}"].sum()) for name in KEYWORDS})
+        return pd.Series(rows, name="frames")
+
+    def export(self, df, path, sort=None):
+        """Write matching frames as a list, frame first (plus dataset and the sort column)."""
+        out = df
+        columns = ["frame", "dataset"]
+        if sort:
+            column = sort[4:] if sort.startswith("abs:") else sort
+            columns += [column] if column not in columns else []
+        out[columns].to_csv(path, index=False, header=False)
+        return len(out)
+
+    # ---------------------- Persistence ----------------------
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        path = os.path.join(self.index_dir, INDEX_FILE)
+        tmp = f"{path}.tmp"
+        self.df.to_parquet(tmp, index=False, compression="zstd")
+        os.replace(tmp, path)
+        state_path = os.path.join(self.index_dir, STATE_FILE)
+        with open(f"{state_path}.tmp", "w") as f:
+            json.dump({"rows_seen": self.rows_seen, "sources": self.sources, "store_parts": self.store_parts}, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    @classmethod
+    def load(cls, index_dir=INDEX_DIR):
+        """Open a saved index, or return an empty one if index_dir has none."""
+        index = cls(index_dir)
+        path = os.path.join(index_dir, INDEX_FILE)
+        if not os.path.exists(path):
+            return index
+        index.df = pd.read_parquet(path)
+        with open(os.path.join(index_dir, STATE_FILE), "r") as f:
+            state = json.load(f)
+        index.rows_seen = state["rows_seen"]
+        index.sources = state.get("sources", {})  # Older states: the CSVs are re-indexed
+        index.store_parts = state["store_parts"]
+        return index
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and query YOLO/LLaVA/ground-truth disagreements")
+    parser.add_argument("--index", default=INDEX_DIR, help="Index directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Index the results added since the last build")
+    build.add_argument("--merged-csv", action="append", default=[], help="merged-results.csv (repeatable)")
+    build.add_argument("--store", action="append", default=[], help="results_store.py directory (repeatable)")
+    build.add_argument("--rebuild", action="store_true", help="Start from an empty index")
+
+    query = sub.add_parser("query", help="Filter, rank and export frames")
+    query.add_argument("--preset", action="append", default=[], choices=sorted(PRESETS))
+    query.add_argument("--where", default=None, help='Extra filter, e.g. "conf_gap > 0.3 and llava_count == 0"')
+    query.add_argument("--dataset", action="append", default=None)
+    query.add_argument("--keyword", action="append", default=[], choices=sorted(KEYWORDS))
+    query.add_argument("--decision", action="append", default=None, choices=["person", "ambiguous", "none"])
+    query.add_argument("--sort", default="disagreement", help='Column to rank by, or "abs:<column>"')
+    query.add_argument("--ascending", action="store_true")
+    query.add_argument("--top", type=int, default=None)
+    query.add_argument("--output", default=None, help="Write the matching frame list to this file")
+    query.add_argument("--show", type=int, default=20, help="Rows to print")
+
+    sub.add_parser("stats", help="Frames per preset and keyword")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = DisagreementIndex(args.index) if getattr(args, "rebuild", False) else DisagreementIndex.load(args.index)
+    loaded = time.perf_counter()
+
+    if args.command == "build":
+        # Reset before reading anything, so the other sources are re-read in this build
+        if any(index.rewritten(path) for path in args.merged_csv):
+            print("A merged CSV was rewritten since the last build, re-indexing everything")
+            index.reset()
+        new_rows = sum(index.update_csv(path) for path in args.merged_csv)
+        new_rows += sum(index.update_store(store) for store in args.store)
+        index.derive()
+        index.save()
+        print(f"Indexed {new_rows} new rows, {len(index.df)} frames in {time.perf_counter() - start:.1f}s")
+    elif args.command == "query":
+        result = index.query(args.where, args.preset, args.dataset, args.keyword, args.decision,
+                             args.sort, args.top, args.ascending)
+        elapsed = time.perf_counter() - loaded
+        with pd.option_context("display.width", 200, "display.max_columns", 20):
+            print(result.head(args.show).set_index(KEY))
+        print(f"\n{len(result)} of {len(index.df)} frames ({elapsed * 1000:.1f} ms, index loaded in "
+              f"{(loaded - start) * 1000:.0f} ms)")
+        if args.output:
+            print(f"Wrote {index.export(result, args.output, args.sort)} frames to {args.output}")
+    else:
+        print(index.counts().to_string())
@@ -0,0 +1,284 @@
+"""
+evaluation.py
+
+Incremental, vectorized evaluation engine behind analyze_results.py.
+Keeps running counts per dataset and per model instead of recomputing
+everything from the full merged-results.csv on every run:
+- confusion counts (TP/FP/FN/TN) for a whole grid of thresholds at once,
+  e.g. "person predicted when count >= k" for k = 1..5
+- count-level errors: MAE, exact-match, over-count and under-count
+- frames and real/non-real persons per dataset_x, the same figures as
+  data/dataset_person_summary.csv
+New rows are folded in with update(); with a state file, only the rows
+appended to the CSV since the last run are read. A CSV that was rewritten
+instead of appended to (e.g. a regenerated merged-results.csv) is detected
+by its recorded identity and the counts are rebuilt from scratch.
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from result_cache import file_identity, is_unchanged_or_appended
+
+# ---------------------- Configuration ----------------------
+# Model name -> (predicted count column, score column, thresholds on the score)
+MODELS = {
+    "YOLO": ("yolo_count", "yolo_count", [1, 2, 3, 4, 5]),
+    "LLAVA": ("llava_count", "llava_count", [1, 2, 3, 4, 5]),
+}
+GT_COLUMN = "true_person_count"
+FAKE_COLUMN = "fake_person_count"
+DATASET_COLUMN = "dataset_x"
+JOINT = ("yolo_count", "llava_count")  # Pair of counts tallied for the YOLO vs LLaVA heatmap
+
+# ---------------------- Classes ----------------------
+class ModelCounts:
+    """
+    Running counts of one model on one dataset. All arrays are indexed by
+    threshold, so one update evaluates every threshold in a single pass.
+    """
+    FIELDS = ("tp", "fp", "fn", "tn")
+
+    def __init__(self, thresholds):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        for name in self.FIELDS:
+            setattr(self, name, np.zeros(len(self.thresholds), dtype=np.int64))
+        self.frames = 0
+        self.abs_error = 0
+        self.signed_error = 0
+        self.exact = 0
+        self.over = 0
+        self.under = 0
+
+    def update(self, gt_count, pred_count, score):
+        """Fold in aligned arrays of ground-truth counts, predicted counts and scores."""
+        gt = gt_count > 0
+        pred = score[:, None] >= self.thresholds[None, :]
+        self.tp += np.count_nonzero(pred & gt[:, None], axis=0)
+        self.fp += np.count_nonzero(pred & ~gt[:, None], axis=0)
+        self.fn += np.count_nonzero(~pred & gt[:, None], axis=0)
+        self.tn += np.count_nonzero(~pred & ~gt[:, None], axis=0)
+
+        diff = pred_count - gt_count
+        self.frames += len(diff)
+        self.abs_error += int(np.abs(diff).sum())
+        self.signed_error += int(diff.sum())
+        self.exact += int(np.count_nonzero(diff == 0))
+        self.over += int(np.count_nonzero(diff > 0))
+        self.under += int(np.count_nonzero(diff < 0))
+
+    def merge(self, other):
+        for name in self.FIELDS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in ("frames", "abs_error", "signed_error", "exact", "over", "under"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def confusion_matrix(self, index=0):
+        """2x2 matrix [[TN, FP], [FN, TP]] at thresholds[index], as sklearn returns it."""
+        return np.array([[self.tn[index], self.fp[index]], [self.fn[index], self.tp[index]]])
+
+    def threshold_metrics(self):
+        """Accuracy, Precision, Recall and F1-Score for every threshold."""
+        tp, fp, fn, tn = (getattr(self, name).astype(float) for name in self.FIELDS)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+            recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+            accuracy = (tp + tn) / max(self.frames, 1)
+        return pd.DataFrame({
+            "threshold": self.thresholds,
+            "Accuracy": accuracy, "Precision": precision, "Recall": recall, "F1-Score": f1,
+            "TP": self.tp, "FP": self.fp, "FN": self.fn, "TN": self.tn,
+        })
+
+    def count_metrics(self):
+        n = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "MAE": self.abs_error / n,
+            "mean_error": self.signed_error / n,
+            "exact_match": self.exact / n,
+            "over_count": self.over / n,
+            "under_count": self.under / n,
+        }
+
+    def to_dict(self):
+        state = {name: getattr(self, name).tolist() for name in self.FIELDS}
+        state["thresholds"] = self.thresholds.tolist()
+        for name in ("frames", "abs_error", "signed_error", "exact", "over", "under"):
+            state[name] = getattr(self, name)
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        counts = cls(state["thresholds"])
+        for name in cls.FIELDS:
+            setattr(counts, name, np.asarray(state[name], dtype=np.int64))
+        for name in ("frames", "abs_error", "signed_error", "exact", "over", "under"):
+            setattr(counts, name, state[name])
+        return counts
+
+
+class EvaluationEngine:
+    """
+    Per-dataset, per-model running evaluation. update() accepts any batch of
+    merged rows; reports aggregate over all datasets or break them down.
+    """
+    def __init__(self, models=MODELS):
+        self.models = models
+        self.reset()
+
+    def reset(self):
+        """Forget every folded-in row."""
+        self.counts = {}    # (dataset, model) -> ModelCounts
+        self.persons = {}   # dataset -> [frames, real persons, non-real persons]
+        self.rows_seen = {} # source path -> rows already folded in
+        self.sources = {}   # source path -> result_cache.file_identity when it was read
+        self.joint = {}     # "yolo_count,llava_count" -> frames
+
+    def columns(self):
+        """Columns update() needs; everything else (e.g. llava_scene) is never loaded."""
+        cols = {DATASET_COLUMN, GT_COLUMN, FAKE_COLUMN, *JOINT}
+        for count_col, score_col, _ in self.models.values():
+            cols.update((count_col, score_col))
+        return sorted(cols)
+
+    def update(self, df):
+        joint = df[list(JOINT)].dropna().to_numpy(dtype=np.int64)
+        pairs, n = np.unique(joint, axis=0, return_counts=True)
+        for (a, b), count in zip(pairs, n):
+            key = f"{a},{b}"
+            self.joint[key] = self.joint.get(key, 0) + int(count)
+
+        for dataset, group in df.groupby(DATASET_COLUMN, sort=False):
+            gt = group[GT_COLUMN].to_numpy(dtype=np.int64)
+            persons = self.persons.setdefault(dataset, [0, 0, 0])
+            persons[0] += len(group)
+            persons[1] += int(gt.sum())
+            persons[2] += int(group[FAKE_COLUMN].sum())
+            for model, (count_col, score_col, thresholds) in self.models.items():
+                key = (dataset, model)
+                if key not in self.counts:
+                    self.counts[key] = ModelCounts(thresholds)
+                # Frames the model failed on (null count) are not scored as 0
+                valid = group[count_col].notna().to_numpy()
+                self.counts[key].update(gt[valid], group[count_col].to_numpy()[valid].astype(np.int64),
+                                        group[score_col].to_numpy()[valid].astype(float))
+
+    def update_csv(self, path, chunksize=100_000):
+        """
+        Fold in the rows of a merged-results.csv that were appended since the
+        last call for this path. Returns the number of new rows.
+        If the file was rewritten since, the counts cannot be corrected row
+        by row: the engine is reset (other sources are re-read in full on
+        their next update_csv) and the file is read from the start.
+        """
+        seen = self.rows_seen.get(path, 0)
+        if seen and not is_unchanged_or_appended(path, self.sources.get(path)):
+            print(f"{path} was rewritten since the last run, rebuilding the evaluation")
+            self.reset()
+            seen = 0
+        identity = file_identity(path)
+        new_rows = 0
+        reader = pd.read_csv(path, usecols=self.columns(), skiprows=range(1, seen + 1), chunksize=chunksize)
+        for chunk in reader:
+            self.update(chunk)
+            new_rows += len(chunk)
+        self.rows_seen[path] = seen + new_rows
+        self.sources[path] = identity
+        return new_rows
+
+    def total(self, model):
+        """ModelCounts of one model summed over all datasets."""
+        thresholds = self.models[model][2]
+        total = ModelCounts(thresholds)
+        for (_, m), counts in self.counts.items():
+            if m == model:
+                total.merge(counts)
+        return total
+
+    def summary(self, index=0):
+        """Accuracy/Precision/Recall/F1 per model at thresholds[index] (summary_metrics.csv)."""
+        rows = {}
+        for model in self.models:
+            metrics = self.total(model).threshold_metrics().iloc[index]
+            rows[model] = metrics[["Accuracy", "Precision", "Recall", "F1-Score"]].astype(float).to_dict()
+        return pd.DataFrame.from_dict(rows, orient="index")
+
+    def threshold_table(self):
+        """Metrics for every model, threshold and dataset (plus an "all" row)."""
+        tables = []
+        for (dataset, model), counts in self.counts.items():
+            tables.append(counts.threshold_metrics().assign(dataset=dataset, model=model))
+        for model in self.models:
+            tables.append(self.total(model).threshold_metrics().assign(dataset="all", model=model))
+        df = pd.concat(tables, ignore_index=True)
+        return df[["dataset", "model"] + [c for c in df.columns if c not in ("dataset", "model")]]
+
+    def count_table(self):
+        """MAE, exact-match and over/under-count rates per dataset and model."""
+        rows = [{"dataset": d, "model": m, **c.count_metrics()} for (d, m), c in self.counts.items()]
+        rows += [{"dataset": "all", "model": m, **self.total(m).count_metrics()} for m in self.models]
+        return pd.DataFrame(rows)
+
+    def joint_table(self):
+        """Frames per (yolo_count, llava_count) pair, as a pivot table."""
+        rows = [(*map(int, key.split(",")), n) for key, n in self.joint.items()]
+        df = pd.DataFrame(rows, columns=[*JOINT, "frames"])
+        return df.pivot_table(index=JOINT[0], columns=JOINT[1], values="frames", aggfunc="sum", fill_value=0)
+
+    def dataset_summary(self):
+        """Frames and persons per dataset_x, laid out like dataset_person_summary.csv."""
+        return pd.DataFrame(
+            [[d, *v] for d, v in self.persons.items()],
+            columns=[DATASET_COLUMN, "Frames", "Real_Persons", "Non_Real_Persons"],
+        )
+
+    def save(self, path):
+        state = {
+            "persons": self.persons,
+            "rows_seen": self.rows_seen,
+            "sources": self.sources,
+            "joint": self.joint,
+            "counts": [{"dataset": d, "model": m, **c.to_dict()} for (d, m), c in self.counts.items()],
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, models=MODELS):
+        """Restore a saved engine, or return a fresh one if path does not exist."""
+        engine = cls(models)
+        if not os.path.exists(path):
+            return engine
+        with open(path, "r") as f:
+            state = json.load(f)
+        engine.persons = state["persons"]
+        engine.rows_seen = state["rows_seen"]
+        engine.sources = state.get("sources", {})  # Older states: sources are re-read in full
+        engine.joint = state["joint"]
+        for entry in state["counts"]:
+            counts = ModelCounts.from_dict(entry)
+            if entry["model"] in models and np.array_equal(counts.thresholds, np.asarray(models[entry["model"]][2], float)):
+                engine.counts[(entry["dataset"], entry["model"])] = counts
+            else:
+                # Threshold grid changed: the saved counts cannot be reused
+                return cls(models)
+        return engine
+
+# ---------------------- Functions ----------------------
+def compare_summary(engine, summary_csv):
+    """
+    Join the engine's per-dataset figures with dataset_person_summary.csv;
+    the *_diff columns are zero when both agree.
+    """
+    expected = pd.read_csv(summary_csv)
+    df = expected.merge(engine.dataset_summary(), on=DATASET_COLUMN, how="outer", suffixes=("", "_eval"))
+    for col in ("Frames", "Real_Persons", "Non_Real_Persons"):
+        df[f"{col}_diff"] = df[f"{col}_eval"] - df[col]
+    return df
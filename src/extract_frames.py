@@ -7,6 +7,7 @@ Outputs frames as JPG images into a specified folder.
 """
 
 import subprocess
+import argparse
 import json
 import os
 
@@ -15,35 +16,56 @@ VIDEO_PATH = "/home/serine/datos/Week30_2018-10-04/2018-10-04-11-28-13_Dataset_y
 OUTPUT_DIR = "frames_extracted"
 FRAME_INTERVAL = 10  # Extract one frame every N frames
 
-# Ensure the output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# ---------------------- Frame Extraction ----------------------
-try:
-    # Get detailed information about the video file
-    cmd = f'ffprobe -v error -show_entries format=duration -show_streams -of json "{VIDEO_PATH}"'
+# ---------------------- Functions ----------------------
+def probe_video(video_path=VIDEO_PATH):
+    """
+    Get detailed information about the video file with ffprobe.
+    """
+    cmd = f'ffprobe -v error -show_entries format=duration -show_streams -of json "{video_path}"'
     result = subprocess.check_output(cmd, shell=True)
-    info = json.loads(result)
-    print("Video file information:")
-    print(json.dumps(info, indent=2))
-    
-    # Extract frames every FRAME_INTERVAL frames
-    cmd = f'ffmpeg -i "{VIDEO_PATH}" -vf "select=not(mod(n\\,{FRAME_INTERVAL}))" -vsync vfr "{OUTPUT_DIR}/frame_%04d.jpg"'
-    print(f"Extracting one frame every {FRAME_INTERVAL} frames...")
-    subprocess.call(cmd, shell=True)
-    
-    # Verify the number of frames extracted
-    frames = [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.jpg')]
-    print(f"Number of frames extracted: {len(frames)}")
-    
-except Exception as e:
-    print(f"Error during extraction: {e}")
-    
-    # Fallback: try a basic extraction if the above fails
-    print("Attempting alternative extraction method...")
-    cmd = f'ffmpeg -i "{VIDEO_PATH}" "{OUTPUT_DIR}/frame_%04d.jpg"'
-    subprocess.call(cmd, shell=True)
-    
-    # Verify again
-    frames = [f for f in os.listdir(OUTPUT_DIR) if f.endswith('.jpg')]
-    print(f"Number of frames extracted with alternative method: {len(frames)}")
+    return json.loads(result)
+
+def extract_frames(video_path=VIDEO_PATH, output_dir=OUTPUT_DIR, frame_interval=FRAME_INTERVAL):
+    """
+    Extract one frame every frame_interval frames as frame_%04d.jpg.
+    Falls back to extracting every frame if probing or selection fails.
+    Returns the number of frames in output_dir.
+    """
+    # Ensure the output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        info = probe_video(video_path)
+        print("Video file information:")
+        print(json.dumps(info, indent=2))
+
+        # Extract frames every frame_interval frames
+        cmd = f'ffmpeg -i "{video_path}" -vf "select=not(mod(n\\,{frame_interval}))" -vsync vfr "{output_dir}/frame_%04d.jpg"'
+        print(f"Extracting one frame every {frame_interval} frames...")
+        subprocess.call(cmd, shell=True)
+
+        # Verify the number of frames extracted
+        frames = [f for f in os.listdir(output_dir) if f.endswith('.jpg')]
+        print(f"Number of frames extracted: {len(frames)}")
+
+    except Exception as e:
+        print(f"Error during extraction: {e}")
+
+        # Fallback: try a basic extraction if the above fails
+        print("Attempting alternative extraction method...")
+        cmd = f'ffmpeg -i "{video_path}" "{output_dir}/frame_%04d.jpg"'
+        subprocess.call(cmd, shell=True)
+
+        # Verify again
+        frames = [f for f in os.listdir(output_dir) if f.endswith('.jpg')]
+        print(f"Number of frames extracted with alternative method: {len(frames)}")
+    return len(frames)
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract video frames with ffmpeg")
+    parser.add_argument("--video", default=VIDEO_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--frame-interval", type=int, default=FRAME_INTERVAL)
+    args = parser.parse_args()
+    extract_frames(args.video, args.output_dir, args.frame_interval)
@@ -0,0 +1,211 @@
+"""
+frame_sampler.py
+
+Adaptive, content-based frame sampling to replace the fixed FRAME_INTERVAL.
+Every decoded frame is reduced to a tiny grayscale thumbnail and compared
+with the last kept frame using three cheap signals:
+- frame-difference energy (mean absolute pixel difference)
+- perceptual difference hash (Hamming distance of a 64-bit dHash)
+- histogram distance (Bhattacharyya distance of gray-level histograms)
+A frame is kept when any signal exceeds its threshold (scene change or
+motion), or when MAX_GAP frames passed without keeping one. Near-identical
+frames, e.g. at red lights, are dropped before they reach YOLO and LLaVA.
+
+Modes:
+- extract:  write the kept frames of a video as JPEGs (like extract_frames.py)
+- validate: replay the sampler over an already extracted dataset folder and
+            compare retained frames/persons with dataset_person_summary.csv
+"""
+
+import os
+import csv
+import time
+import argparse
+
+import cv2
+import numpy as np
+import pandas as pd
+
+# ---------------------- Configuration ----------------------
+THUMB_SIZE = (64, 36)     # Thumbnail (width, height) used for all signals
+DIFF_THRESHOLD = 0.04     # Mean absolute difference, as a fraction of 255
+HASH_THRESHOLD = 10       # dHash bits that must differ
+HIST_THRESHOLD = 0.15     # Bhattacharyya distance of 32-bin histograms
+MIN_GAP = 2               # Never keep two frames closer than this
+MAX_GAP = 150             # Always keep a frame after this many dropped ones
+
+SUMMARY_CSV = "data/dataset_person_summary.csv"
+MERGED_CSV = "results/merged-results.csv"
+
+# ---------------------- Classes ----------------------
+class AdaptiveSampler:
+    """
+    Decides frame by frame whether a frame differs enough from the last kept
+    frame to be worth processing, and counts what it saved.
+    """
+    def __init__(self, diff_threshold=DIFF_THRESHOLD, hash_threshold=HASH_THRESHOLD,
+                 hist_threshold=HIST_THRESHOLD, min_gap=MIN_GAP, max_gap=MAX_GAP):
+        self.diff_threshold = diff_threshold
+        self.hash_threshold = hash_threshold
+        self.hist_threshold = hist_threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.last = None
+        self.gap = 0
+        self.seen = 0
+        self.kept = 0
+        self.reasons = {}
+        self.busy = 0.0
+
+    @staticmethod
+    def signature(frame):
+        """Thumbnail, dHash bits and normalized histogram of a BGR frame."""
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        small = cv2.resize(thumb, (9, 8), interpolation=cv2.INTER_AREA)
+        dhash = (small[:, 1:] > small[:, :-1]).ravel()
+        hist = cv2.calcHist([thumb], [0], None, [32], [0, 256])
+        cv2.normalize(hist, hist)
+        return thumb, dhash, hist
+
+    def check(self, frame):
+        """
+        Return the reason to keep the frame ("first", "diff", "hash", "hist",
+        "max_gap"), or None to drop it.
+        """
+        start = time.perf_counter()
+        self.seen += 1
+        sig = self.signature(frame)
+        reason = None
+
+        if self.last is None:
+            reason = "first"
+        elif self.gap + 1 >= self.min_gap:
+            thumb, dhash, hist = sig
+            last_thumb, last_hash, last_hist = self.last
+            if cv2.absdiff(thumb, last_thumb).mean() / 255 > self.diff_threshold:
+                reason = "diff"
+            elif np.count_nonzero(dhash != last_hash) > self.hash_threshold:
+                reason = "hash"
+            elif cv2.compareHist(hist, last_hist, cv2.HISTCMP_BHATTACHARYYA) > self.hist_threshold:
+                reason = "hist"
+            elif self.gap + 1 >= self.max_gap:
+                reason = "max_gap"
+
+        if reason is None:
+            self.gap += 1
+        else:
+            self.last = sig
+            self.gap = 0
+            self.kept += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        self.busy += time.perf_counter() - start
+        return reason
+
+    def filter(self, frames):
+        """Yield the (frame_name, image) pairs of an iterable that are kept."""
+        for name, frame in frames:
+            if self.check(frame) is not None:
+                yield name, frame
+
+    def report(self, video_fps=None):
+        saved = self.seen - self.kept
+        line = (f"Sampler: kept {self.kept}/{self.seen} frames, saved {saved} "
+                f"({saved / max(self.seen, 1):.1%}), reasons {self.reasons}, "
+                f"{self.seen / max(self.busy, 1e-9):.0f} frames/s")
+        if video_fps:
+            line += f" ({self.seen / max(self.busy, 1e-9) / video_fps:.0f}x real time at {video_fps:.0f} fps)"
+        return line
+
+# ---------------------- Functions ----------------------
+def extract_adaptive(video_path, output_dir, sampler=None):
+    """
+    Decode every frame of a video, keep the ones the sampler selects and
+    write them as frame_%04d.jpg named after their source frame number.
+    A sampling_log.csv records why each frame was kept.
+    """
+    sampler = sampler or AdaptiveSampler()
+    os.makedirs(output_dir, exist_ok=True)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or None
+
+    with open(os.path.join(output_dir, "sampling_log.csv"), "w", newline="") as f:
+        log = csv.writer(f)
+        log.writerow(["frame", "reason"])
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            index += 1
+            reason = sampler.check(frame)
+            if reason is not None:
+                name = f"frame_{index:04d}.jpg"
+                cv2.imwrite(os.path.join(output_dir, name), frame)
+                log.writerow([name, reason])
+    cap.release()
+    print(sampler.report(video_fps))
+    return sampler
+
+def validate_dataset(frames_dir, dataset, summary_csv=SUMMARY_CSV, merged_csv=MERGED_CSV, sampler=None):
+    """
+    Replay the sampler over the ordered frames of an extracted dataset and
+    compare what it retains with the dataset's row in
+    dataset_person_summary.csv (Frames, Real_Persons) and with the
+    per-frame ground truth of merged-results.csv.
+    """
+    sampler = sampler or AdaptiveSampler()
+    frames = sorted(f for f in os.listdir(frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    kept = set()
+    for name in frames:
+        img = cv2.imread(os.path.join(frames_dir, name), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if img is not None and sampler.check(img) is not None:
+            kept.add(name)
+
+    summary = pd.read_csv(summary_csv).set_index("dataset_x").loc[dataset]
+    gt = pd.read_csv(merged_csv, usecols=["frame", "dataset_x", "true_person_count"])
+    gt = gt[gt["dataset_x"] == dataset].drop_duplicates("frame")
+    labelled = gt[gt["frame"].isin(frames)]
+    retained = labelled[labelled["frame"].isin(kept)]
+
+    report = {
+        "dataset": dataset,
+        "frames_in_folder": len(frames),
+        "frames_kept": len(kept),
+        "summary_frames": int(summary["Frames"]),
+        "labelled_frames_kept": f"{len(retained)}/{len(labelled)}",
+        "summary_real_persons": int(summary["Real_Persons"]),
+        "labelled_persons_kept": f"{int(retained['true_person_count'].sum())}/{int(labelled['true_person_count'].sum())}",
+    }
+    print(sampler.report())
+    for k, v in report.items():
+        print(f"{k:<24} {v}")
+    return report
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Adaptive scene-change frame sampling")
+    parser.add_argument("--diff-threshold", type=float, default=DIFF_THRESHOLD)
+    parser.add_argument("--hash-threshold", type=int, default=HASH_THRESHOLD)
+    parser.add_argument("--hist-threshold", type=float, default=HIST_THRESHOLD)
+    parser.add_argument("--max-gap", type=int, default=MAX_GAP)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ex = sub.add_parser("extract", help="Extract only the frames that change")
+    ex.add_argument("--video", required=True)
+    ex.add_argument("--output-dir", default="frames_extracted")
+
+    va = sub.add_parser("validate", help="Check retained frames/persons against the dataset summary")
+    va.add_argument("--frames-dir", required=True)
+    va.add_argument("--dataset", required=True, help="dataset_x name, e.g. part1")
+    va.add_argument("--summary-csv", default=SUMMARY_CSV)
+    va.add_argument("--merged-csv", default=MERGED_CSV)
+    args = parser.parse_args()
+
+    sampler = AdaptiveSampler(args.diff_threshold, args.hash_threshold, args.hist_threshold, max_gap=args.max_gap)
+    if args.command == "extract":
+        extract_adaptive(args.video, args.output_dir, sampler)
+    else:
+        validate_dataset(args.frames_dir, args.dataset, args.summary_csv, args.merged_csv, sampler)
@@ -0,0 +1,157 @@
+"""
+frame_stream.py
+
+Streams decoded frames straight from a video into the YOLO pipeline,
+skipping the JPEG round-trip of extract_frames.py + run_yolo_detection.py
+(encode, disk write, read, decode for every frame).
+Two sources are available:
+- ffmpeg: raw BGR frames read from an ffmpeg pipe, with the same
+  select=not(mod(n,FRAME_INTERVAL)) filter as extract_frames.py
+- opencv: cv2.VideoCapture, skipping unselected frames with grab()
+Frames are named frame_%04d.jpg exactly like extract_frames.py. JPEGs are
+only written for frames that end up in detected_persons/ambiguous (their
+raw copy goes to <output_dir>/frames for the LLaVA stage).
+Raw .h264 elementary streams are supported by both sources. With
+--adaptive, every frame is decoded and frame_sampler.AdaptiveSampler keeps
+only scene changes instead of one frame every FRAME_INTERVAL.
+"""
+
+import os
+import argparse
+import tempfile
+import subprocess
+
+import cv2
+import numpy as np
+
+from extract_frames import VIDEO_PATH, FRAME_INTERVAL, probe_video
+from run_yolo_detection import OUTPUT_DIR, create_output_dirs
+from yolo_pipeline import run_pipeline, print_stage_report, BATCH_SIZE, QUEUE_SIZE, WRITE_WORKERS
+
+# ---------------------- Configuration ----------------------
+SOURCE = "ffmpeg"  # "ffmpeg" or "opencv"
+
+# ---------------------- Functions ----------------------
+def frame_name(index):
+    """Name of the index-th selected frame (1-based), as ffmpeg's frame_%04d.jpg."""
+    return f"frame_{index:04d}.jpg"
+
+def video_size(video_path):
+    """(width, height) of the first video stream."""
+    for stream in probe_video(video_path).get("streams", []):
+        if stream.get("codec_type") == "video":
+            return int(stream["width"]), int(stream["height"])
+    raise ValueError(f"No video stream found in {video_path}")
+
+def ffmpeg_frames(video_path=VIDEO_PATH, frame_interval=FRAME_INTERVAL):
+    """
+    Yield (frame_name, BGR image) for every frame_interval-th frame, decoded
+    by ffmpeg and read from a rawvideo pipe.
+    """
+    width, height = video_size(video_path)
+    frame_bytes = width * height * 3
+    cmd = [
+        "ffmpeg", "-v", "error", "-i", video_path,
+        "-vf", f"select=not(mod(n\\,{frame_interval}))", "-vsync", "vfr",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1",
+    ]
+    # stderr goes to a file: a full stderr pipe would block ffmpeg while we read stdout
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, bufsize=frame_bytes * 2)
+        ended = False
+        try:
+            index = 0
+            while True:
+                data = proc.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                index += 1
+                yield frame_name(index), np.frombuffer(data, np.uint8).reshape(height, width, 3)
+            ended = True
+        finally:
+            proc.stdout.close()
+            if not ended:
+                proc.terminate()  # The consumer stopped early: its exit status is meaningless
+            proc.wait()
+        # A decode error also ends the stream: don't pass a truncated video off as complete
+        if proc.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(f"ffmpeg failed on {video_path} (exit code {proc.returncode}): {message}")
+
+def opencv_frames(video_path=VIDEO_PATH, frame_interval=FRAME_INTERVAL):
+    """
+    Yield (frame_name, BGR image) for every frame_interval-th frame using
+    cv2.VideoCapture; skipped frames are grabbed but never converted.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video_path}")
+    try:
+        n, index = 0, 0
+        while True:
+            if n % frame_interval == 0:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                index += 1
+                yield frame_name(index), frame
+            elif not cap.grab():
+                break
+            n += 1
+    finally:
+        cap.release()
+
+def stream_frames(video_path=VIDEO_PATH, frame_interval=FRAME_INTERVAL, source=SOURCE):
+    """Frame iterator for the chosen source."""
+    if source == "ffmpeg":
+        return ffmpeg_frames(video_path, frame_interval)
+    if source == "opencv":
+        return opencv_frames(video_path, frame_interval)
+    raise ValueError(f"Unknown frame source: {source}")
+
+def stream_detect(video_path=VIDEO_PATH, output_dir=OUTPUT_DIR, frame_interval=FRAME_INTERVAL,
+                  source=SOURCE, sampler=None, **pipeline_kwargs):
+    """
+    Run YOLO detection directly on the streamed frames of a video.
+    With a sampler (frame_sampler.AdaptiveSampler), only the frames it
+    keeps are detected.
+    Returns (results, stats) like yolo_pipeline.run_pipeline.
+    """
+    create_output_dirs(output_dir)
+    frames = stream_frames(video_path, frame_interval, source)
+    if sampler is not None:
+        frames = sampler.filter(frames)
+    return run_pipeline(
+        output_dir=output_dir,
+        source=frames,
+        raw_frames_dir=os.path.join(output_dir, "frames"),
+        **pipeline_kwargs,
+    )
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream video frames straight into YOLOv8 detection")
+    parser.add_argument("--video", default=VIDEO_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--frame-interval", type=int, default=FRAME_INTERVAL)
+    parser.add_argument("--source", choices=["ffmpeg", "opencv"], default=SOURCE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--write-workers", type=int, default=WRITE_WORKERS)
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Decode every frame and keep only scene changes (ignores --frame-interval)")
+    args = parser.parse_args()
+
+    sampler = None
+    if args.adaptive:
+        from frame_sampler import AdaptiveSampler
+        sampler = AdaptiveSampler()
+    results, stats = stream_detect(args.video, args.output_dir, 1 if args.adaptive else args.frame_interval,
+                                   args.source, sampler, batch_size=args.batch_size,
+                                   queue_size=args.queue_size, write_workers=args.write_workers)
+    print_stage_report(stats)
+    if sampler is not None:
+        print(sampler.report())
+    print(f"\n{len(results)} of {stats['inference'].frames} sampled frames had detections. "
+          f"Results saved to: {args.output_dir}")
@@ -3,89 +3,348 @@ image_selection.py
 
 GUI tool for manually selecting frames with people from extracted video frames.
 Selected frames are copied to a separate folder for further processing.
+
+Browsing stays responsive on folders of thousands of full-resolution frames:
+- a background prefetch cache decodes and resizes the next and previous
+  PREFETCH frames to display size, with LRU eviction under CACHE_MB
+- selected frames are hard-linked (or copied) by a background thread, so
+  the UI never waits on the disk
+- with --order yolo, frames are reviewed by decreasing YOLO confidence
+  (likely positives first), from metadata JSON files or a results store
+- every selection is appended to selection_log.csv in the selected folder
+  and the current position is saved, so a session resumes where it stopped
+
+Keys: Right/d = next, Left/a = previous, Space/s = select, q = quit.
 """
 
 import os
 import cv2
+import json
+import time
+import queue
 import shutil
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import *
 from PIL import Image, ImageTk
 
 # ---------------------- Configuration ----------------------
 FRAMES_DIR = "frames_extracted_part1"          # Folder containing all extracted frames
 SELECTED_DIR = "frames_extracted_part1/part2"  # Folder for selected frames
-os.makedirs(SELECTED_DIR, exist_ok=True)
 
-# Get sorted list of image files
-image_files = sorted([f for f in os.listdir(FRAMES_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
+MAX_HEIGHT = 600     # Display height of the frames
+PREFETCH = 8         # Frames decoded ahead (and behind) of the current one
+CACHE_MB = 256       # Memory cap of the decoded-frame cache
+DECODE_WORKERS = 2
+COPY_MODE = "hardlink"  # "hardlink" (falls back to copy across filesystems) or "copy"
+LOG_NAME = "selection_log.csv"     # frame,yolo_score,timestamp per selected frame
+SESSION_NAME = ".selection_session.json"
+
+# ---------------------- Classes ----------------------
+class FrameCache:
+    """
+    Display-sized RGB frames decoded in background threads. Entries are
+    evicted least recently used first once they exceed max_bytes; frames
+    outside the prefetch window when their turn comes are not decoded.
+    """
+    def __init__(self, paths, max_height=MAX_HEIGHT, window=PREFETCH, max_bytes=CACHE_MB * 1024 ** 2,
+                 workers=DECODE_WORKERS):
+        self.paths = paths
+        self.max_height = max_height
+        self.window = window
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # index -> RGB ndarray
+        self.pending = {}             # index -> Future
+        self.size = 0
+        self.center = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _decode(self, index):
+        img = cv2.imread(self.paths[index])
+        if img is None:
+            return None
+        # Resize before the colour conversion: far fewer pixels to convert
+        if img.shape[0] > self.max_height:
+            scale = self.max_height / img.shape[0]
+            img = cv2.resize(img, (int(img.shape[1] * scale), self.max_height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    def _load(self, index):
+        if abs(index - self.center) > self.window:
+            return None  # The user moved on before this frame's turn
+        img = self._decode(index)
+        if img is not None:
+            self._put(index, img)
+        return img
+
+    def _put(self, index, img):
+        with self._lock:
+            self.pending.pop(index, None)
+            if index in self.entries:
+                return
+            self.entries[index] = img
+            self.size += img.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def get(self, index):
+        """Display frame of index: from the cache, a running prefetch, or decoded now."""
+        with self._lock:
+            img = self.entries.get(index)
+            if img is not None:
+                self.entries.move_to_end(index)
+                self.hits += 1
+                return img
+            self.misses += 1
+            future = self.pending.get(index)
+        if future is not None:
+            img = future.result()
+            if img is not None:
+                return img
+        img = self._decode(index)
+        if img is not None:
+            self._put(index, img)
+        return img
+
+    def prefetch(self, center):
+        """Queue the frames around center, nearest (and forward) first."""
+        self.center = center
+        order = []
+        for step in range(1, self.window + 1):
+            order += [center + step, center - step]
+        with self._lock:
+            for index in order:
+                if 0 <= index < len(self.paths) and index not in self.entries and index not in self.pending:
+                    self.pending[index] = self._pool.submit(self._load, index)
+            # Drop queued work that fell out of the window
+            for index in [i for i in self.pending if abs(i - center) > self.window]:
+                if self.pending[index].cancel():
+                    del self.pending[index]
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class BackgroundCopier:
+    """Hard-links or copies selected frames in a background thread."""
+    def __init__(self, mode=COPY_MODE):
+        self.mode = mode
+        self.queue = queue.Queue()
+        self.errors = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, src, dst):
+        self.queue.put((src, dst))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            src, dst = item
+            try:
+                if not os.path.exists(dst):
+                    if self.mode == "hardlink":
+                        try:
+                            os.link(src, dst)
+                        except OSError:
+                            shutil.copy2(src, dst)  # Different filesystem
+                    else:
+                        shutil.copy2(src, dst)
+            except OSError as e:
+                self.errors.append(f"{src}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """Finish the queued copies."""
+        self.queue.put(None)
+        self._thread.join()
+
+
+class SelectionSession:
+    """
+    Review order, position and selected frames, persisted in the selected
+    folder: an append-only selection log and the current frame name.
+    """
+    def __init__(self, frames_dir, selected_dir, image_files, scores=None):
+        self.frames_dir = frames_dir
+        self.selected_dir = selected_dir
+        self.image_files = image_files
+        self.scores = scores or {}
+        self.log_path = os.path.join(selected_dir, LOG_NAME)
+        self.session_path = os.path.join(selected_dir, SESSION_NAME)
+        self.selected = set()
+        self.current_index = 0
 
-# ---------------------- GUI Setup ----------------------
-root = Tk()
-root.title("Image Selection with People")
-root.geometry("1200x800")
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "r") as f:
+                self.selected = {line.split(",")[0] for line in f if line.strip()}
+        if os.path.exists(self.session_path):
+            with open(self.session_path, "r") as f:
+                current = json.load(f).get("current")
+            if current in self.image_files:
+                self.current_index = self.image_files.index(current)
 
-# Global variables
-current_index = 0
-selected_images = []
+    def missing_copies(self):
+        """Selected frames whose copy was not completed (e.g. the tool was killed)."""
+        return [f for f in sorted(self.selected) if not os.path.exists(os.path.join(self.selected_dir, f))]
+
+    def select(self, img_name):
+        if img_name in self.selected:
+            return False
+        self.selected.add(img_name)
+        score = self.scores.get(img_name)
+        with open(self.log_path, "a") as f:
+            f.write(f"{img_name},{'' if score is None else f'{score:.4f}'},{time.time():.0f}\n")
+        return True
+
+    def save(self):
+        tmp = f"{self.session_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"current": self.image_files[self.current_index] if self.image_files else None}, f)
+        os.replace(tmp, self.session_path)
 
 # ---------------------- Functions ----------------------
-def show_current_image():
-    """Display the current image in the GUI with progress info."""
-    global current_index, img_label, file_label, progress_label
+def yolo_scores(yolo_metadata=None, store_dir=None, dataset=None):
+    """Frame name -> YOLO max confidence, from metadata JSON files or a results store."""
+    from llava_routing import load_yolo_metadata, load_store_metadata
 
-    if 0 <= current_index < len(image_files):
-        img_path = os.path.join(FRAMES_DIR, image_files[current_index])
-        img = cv2.cvtColor(cv2.imread(img_path), cv2.COLOR_BGR2RGB)
+    if store_dir is not None:
+        metadata = load_store_metadata(store_dir, dataset)
+    else:
+        metadata = load_yolo_metadata(yolo_metadata)
+    return {frame: data.get("max_confidence", 0.0) for frame, data in metadata.items()}
 
-        # Resize for display if too large
-        max_height = 600
-        if img.shape[0] > max_height:
-            scale = max_height / img.shape[0]
-            img = cv2.resize(img, (int(img.shape[1]*scale), max_height))
+def review_order(image_files, scores=None):
+    """Frames by decreasing YOLO score (frames without a score last), else by name."""
+    if not scores:
+        return image_files
+    return sorted(image_files, key=lambda f: (-scores.get(f, -1.0), f))
 
-        img_tk = ImageTk.PhotoImage(Image.fromarray(img))
-        img_label.config(image=img_tk)
-        img_label.image = img_tk
+def show_current_image():
+    """Display the current image in the GUI with progress info."""
+    index = session.current_index
+    if 0 <= index < len(session.image_files):
+        img = cache.get(index)
+        if img is not None:
+            img_tk = ImageTk.PhotoImage(Image.fromarray(img))
+            img_label.config(image=img_tk)
+            img_label.image = img_tk
+        cache.prefetch(index)
 
-        file_label.config(text=f"File: {image_files[current_index]}")
-        progress_label.config(text=f"Image {current_index + 1}/{len(image_files)} | Selected: {len(selected_images)}")
+        img_name = session.image_files[index]
+        score = session.scores.get(img_name)
+        file_label.config(text=f"File: {img_name}" + (f" | YOLO: {score:.2f}" if score is not None else "")
+                          + (" | selected" if img_name in session.selected else ""))
+        update_progress()
+
+def update_progress():
+    progress_label.config(text=f"Image {session.current_index + 1}/{len(session.image_files)} "
+                               f"| Selected: {len(session.selected)}")
 
 def next_image():
     """Move to the next image."""
-    global current_index
-    if current_index < len(image_files) - 1:
-        current_index += 1
+    if session.current_index < len(session.image_files) - 1:
+        session.current_index += 1
+        session.save()
         show_current_image()
 
 def prev_image():
     """Move to the previous image."""
-    global current_index
-    if current_index > 0:
-        current_index -= 1
+    if session.current_index > 0:
+        session.current_index -= 1
+        session.save()
         show_current_image()
 
 def select_image():
-    """Select the current image and copy it to the selected folder."""
-    global current_index, selected_images
+    """Select the current image; it is linked/copied to the selected folder in the background."""
+    img_name = session.image_files[session.current_index]
+    if session.select(img_name):
+        copier.submit(os.path.join(session.frames_dir, img_name), os.path.join(session.selected_dir, img_name))
+        update_progress()
+    next_image()
+
+def close():
+    session.save()
+    cache.close()
+    root.destroy()
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manually select frames with people")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--selected-dir", default=SELECTED_DIR)
+    parser.add_argument("--order", choices=["name", "yolo"], default="name",
+                        help="Review order; yolo shows likely positives first")
+    parser.add_argument("--yolo-metadata", default=None, help="YOLO metadata folder (for --order yolo)")
+    parser.add_argument("--store", default=None, help="results_store.py directory (for --order yolo)")
+    parser.add_argument("--dataset", default=None, help="Dataset of the frames in --store")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH)
+    parser.add_argument("--cache-mb", type=int, default=CACHE_MB)
+    parser.add_argument("--copy-mode", choices=["hardlink", "copy"], default=COPY_MODE)
+    args = parser.parse_args()
+    if args.order == "yolo" and not (args.yolo_metadata or (args.store and args.dataset)):
+        parser.error("--order yolo requires --yolo-metadata or --store and --dataset")
+
+    os.makedirs(args.selected_dir, exist_ok=True)
+
+    # Get sorted list of image files
+    image_files = sorted([f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))])
+    scores = yolo_scores(args.yolo_metadata, args.store, args.dataset) if args.order == "yolo" else None
+    session = SelectionSession(args.frames_dir, args.selected_dir, review_order(image_files, scores), scores)
+    cache = FrameCache([os.path.join(args.frames_dir, f) for f in session.image_files],
+                       window=args.prefetch, max_bytes=args.cache_mb * 1024 ** 2)
+    copier = BackgroundCopier(args.copy_mode)
+    for img_name in session.missing_copies():
+        copier.submit(os.path.join(args.frames_dir, img_name), os.path.join(args.selected_dir, img_name))
+
+    # ---------------------- GUI Setup ----------------------
+    root = Tk()
+    root.title("Image Selection with People")
+    root.geometry("1200x800")
+
+    # ---------------------- Widgets ----------------------
+    frame = Frame(root)
+    frame.pack(pady=20)
+
+    img_label = Label(frame)
+    img_label.pack()
+
+    file_label = Label(root, text="")
+    file_label.pack(pady=5)
 
-    img_name = image_files[current_index]
-    if img_name not in selected_images:
-        selected_images.append(img_name)
-        shutil.copy2(os.path.join(FRAMES_DIR, img_name), os.path.join(SELECTED_DIR, img_name))
-        progress_label.config(text=f"Image {current_index + 1}/{len(image_files)} | Selected: {len(selected_images)}")
-        next_image()
+    progress_label = Label(root, text="")
+    progress_label.pack(pady=5)
 
-# ---------------------- Widgets ----------------------
-frame = Frame(root)
-frame.pack(pady=20)
+    button_frame = Frame(root)
+    button_frame.pack(pady=10)
 
-img_label = Label(frame)
-img_label.pack()
+    Button(button_frame, text="<< Previous", command=prev_image, width=15).pack(side=LEFT, padx=10)
+    Button(button_frame, text="Select", command=select_image, width=15, bg="green", fg="white").pack(side=LEFT, padx=10)
+    Button(button_frame, text="Next >>", command=next_image, width=15).pack(side=LEFT, padx=10)
 
-file_label = Label(root, text="")
-file_label.pack(pady=5)
+    root.bind("<Right>", lambda e: next_image())
+    root.bind("<d>", lambda e: next_image())
+    root.bind("<Left>", lambda e: prev_image())
+    root.bind("<a>", lambda e: prev_image())
+    root.bind("<space>", lambda e: select_image())
+    root.bind("<s>", lambda e: select_image())
+    root.bind("<q>", lambda e: close())
+    root.protocol("WM_DELETE_WINDOW", close)
 
-progress_label = Label(root, text="")
-progress_label.pack(pady=5)
+    show_current_image()
+    root.mainloop()
 
-button_frame = Frame(r_
+    copier.close()
+    for error in copier.errors:
+        print(f"Copy failed: {error}")
+    print(f"Selected {len(session.selected)} frames -> {args.selected_dir} "
+          f"(cache: {cache.hits} hits, {cache.misses} misses)")
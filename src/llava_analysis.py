@@ -7,36 +7,39 @@ Also supports approximate visualization of detection results on frames.
 """
 
 import os
+import io
 import json
+import hashlib
 import requests
 import base64
+import argparse
+from collections import OrderedDict
 from tqdm import tqdm
 from PIL import Image
 import time
 
+import profiling
+from result_cache import ResultCache, file_digest, make_key
+from llava_schema import LlavaResponseError, MalformedJSONError, SchemaError, parse_answer
+
 # ---------------------- Configuration ----------------------
 FRAMES_DIR = "/home/serine/datos/newdataset/Frames-extracted/week30"
 OUTPUT_DIR = "/home/serine/datos/newdataset/LLAVA-RESULTS/week30"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 OLLAMA_URL = "http://localhost:11434/api/generate"
 MODEL = "llava:latest"
 TIMEOUT = 60  # Increased timeout for complex scenes
 MAX_RETRIES = 3
-
-
-# ---------------------- Functions ----------------------
-def analyze_image(image_path):
-    """Enhanced pedestrian detection with urban scene understanding"""
-    try:
-        # Verify that the image is valid
-        with Image.open(image_path) as img:
-            img.verify()
-        
-        with open(image_path, "rb") as img_file:
-            b64_image = base64.b64encode(img_file.read()).decode("utf-8")
-
-        prompt = """Analyze this urban scene carefully and count all visible pedestrians.
+OPTIONS = {
+    "temperature": 0.3,  # Balanced creativity/factuality
+    "num_ctx": 4096      # Larger context window
+}
+USE_CACHE = True  # Skip frames whose image, model, prompt and options are unchanged
+KEEP_ALIVE = "30m"  # Keep the model, and its cached prompt prefix, loaded between requests
+PAYLOAD_CACHE_BYTES = 256 * 1024 ** 2  # In-memory base64 image payloads kept for re-analysis
+VISUALIZATION_DIR = "/home/serine/datos/newdataset/LLAVA-VISUALIZATION/week30"
+
+PROMPT = """Analyze this urban scene carefully and count all visible pedestrians.
         Provide detailed information about each detected person and rejected objects.
 
         INSTRUCTIONS:
@@ -75,139 +78,280 @@ def analyze_image(image_path):
             "scene_understanding": "brief_description"
         }"""
 
-        response = requests.post(
-            OLLAMA_URL,
-            json={
-                "model": MODEL,
-                "prompt": prompt,
-                "images": [b64_image],
-                "format": "json",
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,  # Balanced creativity/factuality
-                    "num_ctx": 4096      # Larger context window
-                }
-            },
-            timeout=TIMEOUT
-        )
-        
-        result = json.loads(response.json().get("response", "{}"))
-        
-        # Validate and clean the response
-        if not isinstance(result, dict):
-            raise ValueError("Invalid response format")
-            
-        # Ensure human_count exists and is numeric
-        result["human_count"] = int(result.get("human_count", 0))
-        
-        # Ensure confidence is within bounds
-        result["confidence"] = max(0.0, min(1.0, float(result.get("confidence", 0.0))))
-        
-        return result
-        
-    except Exception as e:
-        return {
-            "human_count": 0,
-            "confidence": 0.0,
-            "error": str(e),
-            "pedestrians": [],
-            "rejected_items": []
-        }
+# Multi-prompt mode: the image is uploaded once with the first prompt, the
+# following prompts continue from the returned context (image embedding and
+# earlier answers) without re-sending it. Each prompt fills some fields of
+# the PROMPT response format; the merged answer has the same schema.
+MULTI_PROMPTS = [
+    (("human_count", "confidence", "pedestrians"),
+     """Analyze this urban scene carefully and count all visible pedestrians
+        (walking, standing, partially visible, near vehicles, in crosswalks,
+        in shadows or behind glass, at any distance). Do not count mannequins,
+        statues, posters, reflections or vehicle parts.
 
-# ---------------------- Main processing ----------------------
-for frame in tqdm(sorted(os.listdir(FRAMES_DIR))):
-    if not frame.lower().endswith(('.png', '.jpg', '.jpeg')):
-        continue
-        
-    frame_path = os.path.join(FRAMES_DIR, frame)
-    output_path = os.path.join(OUTPUT_DIR, f"{os.path.splitext(frame)[0]}.json")
-    
-    # Retry mechanism
-    for attempt in range(MAX_RETRIES):
-        try:
-            result = analyze_image(frame_path)
-            with open(output_path, "w") as f:
-                json.dump(result, f, indent=2)
-            break
-        except Exception as e:
-            if attempt == MAX_RETRIES - 1:
-                error_result = {
-                    "human_count": 0,
-                    "confidence": 0.0,
-                    "error": f"Failed after {MAX_RETRIES} attempts: {str(e)}",
-                    "pedestrians": [],
-                    "rejected_items": []
+        RESPONSE FORMAT (JSON):
+        {
+            "human_count": integer,
+            "confidence": 0-1,
+            "pedestrians": [
+                {
+                    "description": "string (e.g., 'adult walking left')",
+                    "approximate_age": "child/adult/senior",
+                    "position": "left/center/right",
+                    "activity": "walking/standing/waiting/etc",
+                    "visibility": "clear/partial/occluded"
                 }
-                with open(output_path, "w") as f:
-                    json.dump(error_result, f, indent=2)
-            time.sleep(2)  # Wait before retrying
+            ]
+        }"""),
+    (("rejected_items",),
+     """In the same image, list the human-like objects you did not count
+        (mannequins/statues, posters with human images, reflections, vehicle parts).
 
+        RESPONSE FORMAT (JSON):
+        {"rejected_items": [{"type": "string", "reason": "string", "confidence": 0-1}]}"""),
+    (("scene_understanding",),
+     """Describe the same scene briefly.
 
+        RESPONSE FORMAT (JSON):
+        {"scene_understanding": "brief_description"}"""),
+]
+
+
+# ---------------------- Classes ----------------------
+class ImagePayloadCache:
+    """
+    In-memory LRU of verified base64 image payloads keyed by the SHA-256 of
+    the file, so re-analysing a frame (or an identical frame) skips the PIL
+    verification and base64 encoding.
+    """
+    def __init__(self, max_bytes=PAYLOAD_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, image_path):
+        with open(image_path, "rb") as img_file:
+            data = img_file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        b64_image = self.entries.get(digest)
+        if b64_image is not None:
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return b64_image
+
+        self.misses += 1
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        b64_image = base64.b64encode(data).decode("utf-8")
+        self.entries[digest] = b64_image
+        self.size += len(b64_image)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        return b64_image
 
+# ---------------------- Functions ----------------------
+def encode_image(image_path):
+    """Verify the image and return its base64-encoded content."""
+    # Verify that the image is valid
+    with Image.open(image_path) as img:
+        img.verify()
+    
+    with open(image_path, "rb") as img_file:
+        return base64.b64encode(img_file.read()).decode("utf-8")
+
+def build_payload(b64_image, prompt=PROMPT, context=None, stream=False):
+    """
+    Request body for the Ollama /api/generate endpoint. With a context from
+    a previous response, the image may be omitted (b64_image=None): the
+    model continues from the already processed image and prompt.
+    """
+    payload = {
+        "model": MODEL,
+        "prompt": prompt,
+        "format": "json",
+        "stream": stream,
+        "keep_alive": KEEP_ALIVE,
+        "options": OPTIONS
+    }
+    if b64_image is not None:
+        payload["images"] = [b64_image]
+    if context is not None:
+        payload["context"] = context
+    return payload
+
+def generation_stats(body):
+    """
+    Timing and token counts reported by Ollama for one response:
+    time to first token (model load + prompt evaluation), prompt tokens
+    actually evaluated (a cached prefix is not counted) and output tokens.
+    """
+    return {
+        "ttft": (body.get("load_duration", 0) + body.get("prompt_eval_duration", 0)) / 1e9,
+        "prompt_tokens": body.get("prompt_eval_count", 0),
+        "output_tokens": body.get("eval_count", 0),
+    }
+
+def merge_answers(answers):
+    """
+    Combine the answers of MULTI_PROMPTS (list of response bodies) into one
+    body whose "response" follows the PROMPT format.
+    """
+    merged = {}
+    for (fields, _), body in zip(MULTI_PROMPTS, answers):
+        try:
+            answer = json.loads(body.get("response", ""))
+        except ValueError as e:
+            raise MalformedJSONError(f"Invalid JSON: {e}") from e
+        if not isinstance(answer, dict):
+            raise SchemaError("Answer is not a JSON object")
+        merged.update({field: answer[field] for field in fields if field in answer})
+    return {"response": json.dumps(merged)}
+
+def parse_response(body):
+    """
+    Validate and clean the model output contained in an Ollama response body.
+    Raises a llava_schema.LlavaResponseError subclass if it does not follow
+    the documented format (instead of defaulting human_count to 0).
+    """
+    return parse_answer(body.get("response", ""))
+
+def error_type_of(exc):
+    """Error class recorded for a failed frame."""
+    if isinstance(exc, LlavaResponseError) or hasattr(exc, "error_type"):
+        return exc.error_type
+    if isinstance(exc, requests.Timeout):
+        return "timeout"
+    if isinstance(exc, requests.HTTPError):
+        return "http_error"
+    return "request_failed"
+
+def error_result(message, error_type="request_failed"):
+    """
+    Result recorded for a frame that could not be analyzed. Counts are None,
+    not 0, so failures cannot be mistaken for empty scenes.
+    """
+    return {
+        "human_count": None,
+        "confidence": None,
+        "error": message,
+        "error_type": error_type,
+        "pedestrians": [],
+        "rejected_items": []
+    }
 
-    for frame_name in tqdm(frames):
-        frame_path = os.path.join(frames_dir, frame_name)
-        result_path = os.path.join(results_dir, f"{os.path.splitext(frame_name)[0]}.json")
-        
-        frame = cv2.imread(frame_path)
-        height, width = frame.shape[:2]
+def analyze_image(image_path):
+    """Enhanced pedestrian detection with urban scene understanding"""
+    prof = profiling.PROFILER
+    try:
+        with prof.stage("encode"):
+            payload = build_payload(encode_image(image_path))
+        with prof.stage("http"):
+            response = requests.post(
+                OLLAMA_URL,
+                json=payload,
+                timeout=TIMEOUT
+            )
+            response.raise_for_status()  # An Ollama error page is not an empty answer
+            body = response.json()
+        if prof.enabled:
+            # Server-side share of the HTTP time, as reported by Ollama
+            prof.add("llava_prompt_eval", body.get("prompt_eval_duration", 0) / 1e9)
+            prof.add("llava_generate", body.get("eval_duration", 0) / 1e9)
+        with prof.stage("parse"):
+            return parse_response(body)
         
-        if os.path.exists(result_path):
-            with open(result_path, 'r') as f:
-                result = json.load(f)
-            
-            # Display human count and confidence
-            count_text = f"Humans: {result.get('human_count', 0)} (Confidence: {result.get('confidence', 0):.2f})"
-            cv2.putText(frame, count_text, (20, 40), font, font_scale, text_color, font_thickness)
+    except Exception as e:
+        return error_result(str(e), error_type_of(e))
+
+def cache_key(image_path, multi_prompt=False, stream=False):
+    """
+    Cache key of a frame: image content, model, prompt(s) and generation options.
+    Streamed answers stop after the required fields, so they are keyed apart.
+    """
+    prompt = [p for _, p in MULTI_PROMPTS] if multi_prompt else PROMPT
+    params = {"prompt": prompt, "options": OPTIONS}
+    if stream:
+        params["stop_when_complete"] = True
+    return make_key(file_digest(image_path), MODEL, params)
+
+def process_frames(frames_dir=FRAMES_DIR, output_dir=OUTPUT_DIR, cache=None, frames=None):
+    """
+    Analyze every frame in frames_dir (or only the given frame names) and
+    write one JSON result per frame.
+    Frames with a valid cached result are not sent to LLaVA again.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prof = profiling.PROFILER
+    for frame in tqdm(sorted(frames if frames is not None else os.listdir(frames_dir))):
+        if not frame.lower().endswith(('.png', '.jpg', '.jpeg')):
+            continue
             
-            # Draw approximate boxes based on position descriptions
-            for i, pedestrian in enumerate(result.get('pedestrians', [])):
-                # Create approximate box based on position description
-                if 'position' in pedestrian:
-                    if pedestrian['position'] == 'left':
-                        x1, x2 = 0, width//3
-                    elif pedestrian['position'] == 'right':
-                        x1, x2 = 2*width//3, width
-                    else:  # center
-                        x1, x2 = width//3, 2*width//3
-                    
-                    # Vertical position is arbitrary since we don't have that data
-                    y1, y2 = height//2, height
-                    
-                    # Draw box
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), box_color, 2)
-                    
-                    # Add description
-                    desc = f"{pedestrian.get('approximate_age', 'person')} {pedestrian.get('activity', '')}"
-                    cv2.putText(frame, desc, (x1, y1-10), font, font_scale*0.6, text_color, 1)
-        
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        frame_path = os.path.join(frames_dir, frame)
+        output_path = os.path.join(output_dir, f"{os.path.splitext(frame)[0]}.json")
 
+        with prof.stage("cache_lookup"):
+            key = cache_key(frame_path) if cache is not None else None
+            cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            with open(output_path, "w") as f:
+                json.dump(cached, f, indent=2)
+            prof.end_frame(frame, cached=True)
+            continue
+        
+        # Retry mechanism
+        for attempt in range(MAX_RETRIES):
+            try:
+                result = analyze_image(frame_path)
+                with prof.stage("json_write"):
+                    with open(output_path, "w") as f:
+                        json.dump(result, f, indent=2)
+                # Only successful analyses are worth reusing
+                if cache is not None and "error" not in result:
+                    cache.put(key, result, {"frame": frame})
+                break
+            except Exception as e:
+                if attempt == MAX_RETRIES - 1:
+                    with open(output_path, "w") as f:
+                        json.dump(error_result(f"Failed after {MAX_RETRIES} attempts: {str(e)}"), f, indent=2)
+                time.sleep(2)  # Wait before retrying
+        prof.end_frame(frame, attempts=attempt + 1)
+
+def visualize_results(frames_dir=FRAMES_DIR, results_dir=OUTPUT_DIR, output_dir=VISUALIZATION_DIR, scale=1.0):
+    """
+    Draw approximate LLaVA detections (count and left/center/right boxes)
+    on each frame and save the annotated copies (see annotation_renderer.py).
+    """
+    from annotation_renderer import render_batch
+    render_batch(frames_dir, output_dir, llava_dir=results_dir, mode="llava", scale=scale)
 
+# ---------------------- Main processing ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLaVA pedestrian analysis of extracted frames")
+    parser.add_argument("--visualize", action="store_true",
+                        help="Also save frames annotated with the approximate LLaVA detections")
+    parser.add_argument("--yolo-metadata", default=None,
+                        help="YOLO metadata folder; only frames YOLO is unsure about are analyzed")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    prof = profiling.from_args(args)
+
+    frames = None
+    if args.yolo_metadata:
+        from llava_routing import load_yolo_metadata, select_frames
+        routed, kept = select_frames(sorted(os.listdir(FRAMES_DIR)), load_yolo_metadata(args.yolo_metadata))
+        frames = list(routed)
+        print(f"Routing {len(routed)} frames to LLaVA, keeping the YOLO result for {len(kept)}")
+
+    cache = ResultCache("llava") if USE_CACHE else None
+    with profiling.run_profiled(args.profile, args.profile_output):
+        process_frames(cache=cache, frames=frames)
+    if cache is not None:
+        cache.print_stats()
+    prof.print_report()
+    prof.close(args.metrics_file, job="llava_analysis")
+
+    if args.visualize:
+        visualize_results()
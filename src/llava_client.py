@@ -0,0 +1,466 @@
+"""
+llava_client.py
+
+Concurrent asyncio client for the Ollama /api/generate endpoint.
+Replaces the one-blocking-request-per-frame loop of llava_analysis.py with:
+- a pooled aiohttp session (keep-alive connections reused across frames)
+- AIMD adaptive concurrency: the in-flight limit grows additively while
+  latency stays under target and halves on timeouts, server errors or
+  latency spikes
+- exponential backoff with full jitter between retries
+- a throughput report with requests/sec and p50/p95/p99 latency, time to
+  first token and prompt/output tokens per frame
+- with --stream, answers are parsed token by token (llava_schema.py):
+  off-schema output is aborted and retried early, and generation stops
+  as soon as the required fields are complete
+- failures recorded with a distinct error_type instead of a zero count
+- keep_alive on every request, an in-memory cache of image payloads keyed
+  by hash and, with --multi-prompt, several prompts (count, rejected items,
+  scene) asked about one uploaded image through Ollama context reuse
+
+Writes the same per-frame JSON results as llava_analysis.py and shares its
+prompt, payload format, validation and result cache. With --store, results
+go to the columnar results_store.py instead.
+"""
+
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+
+import aiohttp
+from tqdm import tqdm
+
+from llava_analysis import (
+    FRAMES_DIR, OUTPUT_DIR, OLLAMA_URL, TIMEOUT, MAX_RETRIES, USE_CACHE, MULTI_PROMPTS,
+    ImagePayloadCache, build_payload, parse_response, error_result, error_type_of, cache_key,
+    generation_stats, merge_answers,
+)
+from llava_schema import LlavaResponseError, StreamingResponseParser
+from result_cache import ResultCache
+
+# ---------------------- Configuration ----------------------
+INITIAL_CONCURRENCY = 2
+MAX_CONCURRENCY = 16
+LATENCY_TARGET = 20.0   # Seconds; slower responses shrink the in-flight limit
+BACKOFF_BASE = 0.5      # First retry waits up to this many seconds
+BACKOFF_CAP = 30.0      # Upper bound of a single backoff
+
+# ---------------------- Classes ----------------------
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight requests.
+
+    Each successful request under the latency target adds 1/limit, so the
+    limit grows by about one per round trip. A timeout, error or slow
+    response multiplies it by `decrease`, at most once per latency window
+    so a single burst of failures does not collapse it to the minimum.
+    """
+    def __init__(self, initial=INITIAL_CONCURRENCY, min_limit=1, max_limit=MAX_CONCURRENCY,
+                 latency_target=LATENCY_TARGET, decrease=0.5):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, ok):
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                if now - self._last_decrease > self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+class RequestStats:
+    """
+    Latencies of completed requests plus retry/failure counters, time to
+    first token and token counts reported by Ollama.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.unreported = 0     # Frames whose prompt token count never arrived (stopped streams)
+        self.frames = 0
+        self.retries = 0
+        self.failures = 0
+        self.errors = {}        # error_type -> failed frames
+        self.aborted = 0        # Streams aborted because the output went off-schema
+        self.stopped_early = 0  # Streams stopped once the required fields were complete
+        self.start = time.perf_counter()
+
+    def fail(self, error_type):
+        self.failures += 1
+        self.errors[error_type] = self.errors.get(error_type, 0) + 1
+
+    def record(self, stats):
+        """Add the generation_stats() of one response (prompt_tokens None when not reported)."""
+        self.ttfts.append(stats["ttft"])
+        if stats["prompt_tokens"] is None:
+            self.unreported += 1
+        else:
+            self.prompt_tokens += stats["prompt_tokens"]
+        self.output_tokens += stats["output_tokens"]
+
+    def percentile(self, q, values=None):
+        """Nearest-rank percentile of the recorded latencies (or of values)."""
+        ordered = sorted(self.latencies if values is None else values)
+        if not ordered:
+            return 0.0
+        return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "requests": len(self.latencies),
+            "requests_per_sec": len(self.latencies) / elapsed if elapsed > 0 else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "ttft_p50": self.percentile(50, self.ttfts),
+            "ttft_p95": self.percentile(95, self.ttfts),
+            # None when no frame reported its prompt tokens (every stream stopped early)
+            "prompt_tokens_per_frame": (self.prompt_tokens / max(self.frames - self.unreported, 1)
+                                        if self.frames > self.unreported or not self.frames else None),
+            "unreported_prompt_tokens": self.unreported,
+            "output_tokens_per_frame": self.output_tokens / max(self.frames, 1),
+            "retries": self.retries,
+            "failures": self.failures,
+            "errors": dict(self.errors),
+            "aborted": self.aborted,
+            "stopped_early": self.stopped_early,
+        }
+
+
+class RetryableError(Exception):
+    """Timeout, connection problem or 5xx answer worth retrying."""
+    def __init__(self, message, error_type="request_failed"):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class AsyncLlavaClient:
+    """
+    Pooled, adaptively limited LLaVA client. Use as an async context manager:
+
+        async with AsyncLlavaClient() as client:
+            result = await client.analyze("frame_0001.jpg")
+    """
+    def __init__(self, url=OLLAMA_URL, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 latency_target=LATENCY_TARGET, payload_cache=None):
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.limiter = AIMDLimiter(initial_concurrency, max_limit=max_concurrency,
+                                   latency_target=latency_target)
+        self.stats = RequestStats()
+        self.payloads = payload_cache or ImagePayloadCache()
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self.stats.start = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _post(self, payload):
+        """One HTTP round trip under the adaptive limit."""
+        await self.limiter.acquire()
+        start = time.perf_counter()
+        ok = False
+        try:
+            async with self.session.post(self.url, json=payload) as response:
+                if response.status >= 500:
+                    raise RetryableError(f"HTTP {response.status}", "http_error")
+                response.raise_for_status()
+                body = await response.json(content_type=None)
+            ok = True
+            self.stats.record(generation_stats(body))
+            return body
+        except asyncio.TimeoutError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}", "timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+        finally:
+            latency = time.perf_counter() - start
+            if ok:
+                self.stats.latencies.append(latency)
+            await self.limiter.release(latency, ok)
+
+    async def _post_stream(self, payload):
+        """
+        One streamed round trip under the adaptive limit. Tokens are fed to
+        a StreamingResponseParser; the response is closed (which stops the
+        generation) as soon as the parser raises or is complete.
+        Returns the validated answer.
+        """
+        await self.limiter.acquire()
+        start = time.perf_counter()
+        ok = False
+        parser = StreamingResponseParser()
+        # Ollama only reports prompt tokens in the final message, which a
+        # stream stopped early never receives
+        stats = {"ttft": 0.0, "prompt_tokens": None, "output_tokens": 0}
+        try:
+            async with self.session.post(self.url, json=payload) as response:
+                if response.status >= 500:
+                    raise RetryableError(f"HTTP {response.status}", "http_error")
+                response.raise_for_status()
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    if "error" in message:
+                        raise RetryableError(f"Ollama: {message['error']}")
+                    token = message.get("response", "")
+                    if token:
+                        if not stats["output_tokens"]:
+                            stats["ttft"] = time.perf_counter() - start
+                        stats["output_tokens"] += 1
+                        try:
+                            parser.feed(token)
+                        except LlavaResponseError:
+                            self.stats.aborted += 1
+                            raise
+                    if message.get("done"):
+                        stats["prompt_tokens"] = message.get("prompt_eval_count", 0)
+                        break
+                    if parser.complete:
+                        self.stats.stopped_early += 1
+                        break
+                response.close()
+            result = parser.finish()
+            ok = True
+            self.stats.record(stats)
+            return result
+        except asyncio.TimeoutError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}", "timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise RetryableError(f"{type(e).__name__}: {e}") from e
+        finally:
+            latency = time.perf_counter() - start
+            if ok:
+                self.stats.latencies.append(latency)
+            # An off-schema answer is the model's fault, not a sign of overload
+            await self.limiter.release(latency, ok or parser.length > 0)
+
+    async def generate(self, payload):
+        """
+        POST payload with retries and return the Ollama response body.
+        Raises RetryableError once every attempt has failed.
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return await self._post(payload)
+            except RetryableError as e:
+                if attempt == self.max_retries - 1:
+                    raise RetryableError(f"Failed after {self.max_retries} attempts: {e}") from e
+                self.stats.retries += 1
+                # Full jitter: uniform wait in [0, min(cap, base * 2^attempt)]
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+    async def analyze(self, image_path):
+        """
+        Analyze one frame with retries; always returns a result dict
+        (an error result after the last failed attempt).
+        """
+        self.stats.frames += 1
+        try:
+            b64_image = await asyncio.to_thread(self.payloads.encode, image_path)
+            return parse_response(await self.generate(build_payload(b64_image)))
+        except Exception as e:
+            self.stats.fail(error_type_of(e))
+            return error_result(str(e), error_type_of(e))
+
+    async def analyze_stream(self, image_path):
+        """
+        Analyze one frame with a streamed answer. Transport errors are
+        retried with backoff; off-schema answers are aborted as soon as they
+        are detected and retried at once. Always returns a result dict.
+        """
+        self.stats.frames += 1
+        try:
+            b64_image = await asyncio.to_thread(self.payloads.encode, image_path)
+            payload = build_payload(b64_image, stream=True)
+            for attempt in range(self.max_retries):
+                try:
+                    return await self._post_stream(payload)
+                except (RetryableError, LlavaResponseError) as e:
+                    if attempt == self.max_retries - 1:
+                        raise
+                    self.stats.retries += 1
+                    if isinstance(e, RetryableError):
+                        await asyncio.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+        except Exception as e:
+            self.stats.fail(error_type_of(e))
+            return error_result(f"Failed after {self.max_retries} attempts: {e}", error_type_of(e))
+
+    async def analyze_multi(self, image_path, prompts=MULTI_PROMPTS):
+        """
+        Ask every prompt of MULTI_PROMPTS about one frame. The image is only
+        sent with the first prompt; the next ones continue from the context
+        Ollama returned, so the image is neither re-uploaded nor re-encoded.
+        """
+        self.stats.frames += 1
+        try:
+            b64_image = await asyncio.to_thread(self.payloads.encode, image_path)
+            answers = []
+            context = None
+            for _, prompt in prompts:
+                body = await self.generate(build_payload(b64_image if context is None else None, prompt, context))
+                answers.append(body)
+                # Servers that return no context get the image again
+                context = body.get("context")
+            return parse_response(merge_answers(answers))
+        except Exception as e:
+            self.stats.fail(error_type_of(e))
+            return error_result(str(e), error_type_of(e))
+
+# ---------------------- Functions ----------------------
+async def analyze_frames(frame_paths, output_dir=OUTPUT_DIR, client=None, cache=None, store_writer=None,
+                         multi_prompt=False, stream=False):
+    """
+    Analyze frame_paths concurrently and write one JSON result per frame,
+    or one row per frame to store_writer (a results_store.StageWriter for
+    the "llava" stage). With multi_prompt, each frame is analyzed with
+    MULTI_PROMPTS over one upload instead of the single PROMPT; with
+    stream, answers are parsed and validated while they are generated.
+    Returns the client's request statistics report.
+    """
+    if store_writer is not None:
+        from results_store import llava_row
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+    client = client or AsyncLlavaClient()
+    progress = tqdm(total=len(frame_paths), desc="LLaVA frames")
+
+    async def handle(frame_path):
+        frame = os.path.basename(frame_path)
+        output_path = os.path.join(output_dir, f"{os.path.splitext(frame)[0]}.json")
+        key = cache_key(frame_path, multi_prompt, stream and not multi_prompt) if cache is not None else None
+        result = cache.get(key) if cache is not None else None
+        if result is None:
+            if multi_prompt:
+                result = await client.analyze_multi(frame_path)
+            elif stream:
+                result = await client.analyze_stream(frame_path)
+            else:
+                result = await client.analyze(frame_path)
+            if cache is not None and "error" not in result:
+                cache.put(key, result, {"frame": frame})
+        if store_writer is not None:
+            store_writer.write(llava_row(store_writer.dataset, frame, result))
+        else:
+            with open(output_path, "w") as f:
+                json.dump(result, f, indent=2)
+        progress.update(1)
+
+    # A fixed pool of workers bounds how many encoded images sit in memory;
+    # the AIMD limiter decides how many of them actually hit the server
+    pending = asyncio.Queue()
+    for p in frame_paths:
+        pending.put_nowait(p)
+
+    async def worker():
+        while not pending.empty():
+            await handle(pending.get_nowait())
+
+    async with client:
+        await asyncio.gather(*(worker() for _ in range(client.max_concurrency)))
+    progress.close()
+    if store_writer is not None:
+        store_writer.flush()
+    return client.stats.report()
+
+def print_report(report, limiter=None):
+    """Print throughput and latency percentiles."""
+    print("\n=== LLaVA client ===")
+    print(f"Requests: {report['requests']} ({report['requests_per_sec']:.2f} req/s), "
+          f"retries: {report['retries']}, failures: {report['failures']}")
+    print(f"Latency p50/p95/p99: {report['p50']:.2f} / {report['p95']:.2f} / {report['p99']:.2f} s")
+    print(f"Time to first token p50/p95: {report['ttft_p50']:.2f} / {report['ttft_p95']:.2f} s")
+    prompt_tokens = report["prompt_tokens_per_frame"]
+    print(f"Tokens per frame: {'n/a' if prompt_tokens is None else f'{prompt_tokens:.0f}'} prompt, "
+          f"{report['output_tokens_per_frame']:.0f} output")
+    if report["unreported_prompt_tokens"]:
+        print(f"  (prompt tokens averaged over the frames that reported them; "
+              f"{report['unreported_prompt_tokens']} stopped streams did not)")
+    if report["errors"]:
+        print(f"Failed frames by error type: {report['errors']}")
+    if report["aborted"] or report["stopped_early"]:
+        print(f"Streams aborted off-schema: {report['aborted']}, stopped once complete: {report['stopped_early']}")
+    if limiter is not None:
+        print(f"Final in-flight limit: {limiter.limit:.1f}")
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent LLaVA analysis of extracted frames")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--url", default=OLLAMA_URL, help="Ollama /api/generate URL (or a local ollama_stub.py)")
+    parser.add_argument("--concurrency", type=int, default=INITIAL_CONCURRENCY, help="Initial in-flight requests")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--latency-target", type=float, default=LATENCY_TARGET)
+    parser.add_argument("--yolo-metadata", default=None,
+                        help="YOLO metadata folder; only frames YOLO is unsure about are analyzed")
+    parser.add_argument("--store", default=None, help="Write results to this results_store.py directory")
+    parser.add_argument("--dataset", default=None, help="Dataset name of the frames (required with --store)")
+    parser.add_argument("--multi-prompt", action="store_true",
+                        help="Ask count, rejected-items and scene prompts about one uploaded image")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream answers, abort off-schema output early and stop once complete")
+    parser.add_argument("--route-from-store", action="store_true",
+                        help="Like --yolo-metadata, reading the YOLO results of --dataset from --store")
+    args = parser.parse_args()
+    if args.store and not args.dataset:
+        parser.error("--store requires --dataset")
+    if args.route_from_store and not args.store:
+        parser.error("--route-from-store requires --store and --dataset")
+
+    frames = sorted(f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    if args.yolo_metadata or args.route_from_store:
+        from llava_routing import load_yolo_metadata, load_store_metadata, select_frames
+        if args.route_from_store:
+            metadata = load_store_metadata(args.store, args.dataset)
+        else:
+            metadata = load_yolo_metadata(args.yolo_metadata)
+        routed, kept = select_frames(frames, metadata)
+        frames = sorted(routed)
+        print(f"Routing {len(routed)} frames to LLaVA, keeping the YOLO result for {len(kept)}")
+    client = AsyncLlavaClient(args.url, initial_concurrency=args.concurrency,
+                              max_concurrency=args.max_concurrency, latency_target=args.latency_target)
+    cache = ResultCache("llava") if USE_CACHE else None
+    store_writer = None
+    if args.store:
+        from results_store import ResultsStore
+        store_writer = ResultsStore(args.store).writer("llava", dataset=args.dataset)
+    report = asyncio.run(analyze_frames([os.path.join(args.frames_dir, f) for f in frames],
+                                        args.output_dir, client, cache, store_writer,
+                                        args.multi_prompt, args.stream))
+    print_report(report, client.limiter)
+    print(f"Image payload cache: {client.payloads.hits} hits, {client.payloads.misses} misses")
+    if cache is not None:
+        cache.print_stats()
@@ -0,0 +1,177 @@
+"""
+llava_routing.py
+
+YOLO-gated routing for the LLaVA stage: only frames where YOLOv8 is unsure
+are sent to the vision-language model. A frame is routed when
+- its YOLO decision is "ambiguous",
+- its max_confidence falls inside the uncertainty band [band_low, band_high), or
+- it shows a disagreement signal: confident boxes mixed with boxes inside
+  the band, so the person count itself is uncertain.
+All other frames keep the YOLO decision and count.
+
+The evaluate mode replays routing over merged-results.csv for a grid of
+bands and reports, for each one, the VLM call reduction and the accuracy
+and count error of the combined YOLO+LLaVA result against ground truth.
+"""
+
+import os
+import json
+import argparse
+
+import pandas as pd
+
+# ---------------------- Configuration ----------------------
+YOLO_METADATA_DIR = "/home/serine/datos/newdataset/YOLO-RESULTS/week30/metadata"
+MERGED_CSV = "merged-results.csv"
+OUTPUT_CSV = "routing_bands.csv"
+
+BAND_LOW = 0.4    # Route frames whose max_confidence is in [BAND_LOW, BAND_HIGH)
+BAND_HIGH = 0.7
+ROUTE_MIXED = True   # Route frames mixing confident and in-band boxes
+ROUTE_NONE = False   # Route frames where YOLO found nothing (no metadata file)
+
+# ---------------------- Functions ----------------------
+def load_yolo_metadata(metadata_dir=YOLO_METADATA_DIR):
+    """
+    Load the per-frame YOLO metadata JSON files, keyed by frame name.
+    """
+    metadata = {}
+    for name in os.listdir(metadata_dir):
+        if name.endswith(".json"):
+            with open(os.path.join(metadata_dir, name), "r") as f:
+                frame_data = json.load(f)
+            metadata[frame_data["frame"]] = frame_data
+    return metadata
+
+def load_store_metadata(store_dir, dataset):
+    """
+    Same as load_yolo_metadata, from the yolo table of a results_store.py
+    directory (frames whose decision is "none" are left out, as they have
+    no metadata file).
+    """
+    from results_store import ResultsStore
+    df = ResultsStore(store_dir).read("yolo", datasets=[dataset])
+    metadata = {}
+    for r in df[df["yolo_decision"] != "none"].itertuples(index=False):
+        metadata[r.frame] = {
+            "frame": r.frame,
+            "detections": json.loads(r.detections) if r.detections else [],
+            "human_count": int(r.yolo_count),
+            "decision": r.yolo_decision,
+            "max_confidence": float(r.yolo_max_conf),
+        }
+    return metadata
+
+def route_reason(frame_data, band_low=BAND_LOW, band_high=BAND_HIGH,
+                 route_mixed=ROUTE_MIXED, route_none=ROUTE_NONE):
+    """
+    Return why a frame should go to LLaVA ("ambiguous", "band", "mixed",
+    "no_detection"), or None when the YOLO result can be kept.
+    """
+    if frame_data is None:
+        return "no_detection" if route_none else None
+    if frame_data["decision"] == "ambiguous":
+        return "ambiguous"
+    if band_low <= frame_data["max_confidence"] < band_high:
+        return "band"
+    if route_mixed:
+        confs = [d["confidence"] for d in frame_data.get("detections", [])]
+        if any(c >= band_high for c in confs) and any(band_low <= c < band_high for c in confs):
+            return "mixed"
+    return None
+
+def select_frames(frame_names, metadata, **band_kwargs):
+    """
+    Split frame_names into (routed, kept) according to the YOLO metadata.
+    routed maps frame name -> reason.
+    """
+    routed, kept = {}, []
+    for frame in frame_names:
+        reason = route_reason(metadata.get(frame), **band_kwargs)
+        if reason is None:
+            kept.append(frame)
+        else:
+            routed[frame] = reason
+    return routed, kept
+
+def evaluate_band(df, band_low, band_high):
+    """
+    Replay routing on merged results: routed frames take the LLaVA count,
+    the rest keep the YOLO count. The CSV has no per-box confidences, so
+    only the decision and max_confidence signals are used here.
+    """
+    routed = (df["yolo_decision"] == "ambiguous") | df["yolo_max_conf"].between(band_low, band_high, inclusive="left")
+    count = df["yolo_count"].where(~routed, df["llava_count"])
+    gt = df["true_person_count"]
+    return {
+        "band_low": band_low,
+        "band_high": band_high,
+        "vlm_calls": int(routed.sum()),
+        "vlm_call_reduction": 1.0 - routed.mean(),
+        "accuracy": ((count > 0) == (gt > 0)).mean(),
+        "count_mae": (count - gt).abs().mean(),
+        "count_exact": (count == gt).mean(),
+    }
+
+def evaluate_bands(df, lows, highs):
+    """
+    Evaluate every (low, high) band plus the YOLO-only and LLaVA-on-all
+    baselines. Returns a DataFrame sorted by accuracy.
+    """
+    gt = df["true_person_count"]
+    rows = []
+    for name, count, calls in (("yolo_only", df["yolo_count"], 0), ("llava_all", df["llava_count"], len(df))):
+        rows.append({
+            "band_low": name, "band_high": name, "vlm_calls": calls,
+            "vlm_call_reduction": 1.0 - calls / len(df),
+            "accuracy": ((count > 0) == (gt > 0)).mean(),
+            "count_mae": (count - gt).abs().mean(),
+            "count_exact": (count == gt).mean(),
+        })
+    for low in lows:
+        for high in highs:
+            if high > low:
+                rows.append(evaluate_band(df, low, high))
+
+    table = pd.DataFrame(rows)
+    llava_accuracy = table.loc[table["band_low"] == "llava_all", "accuracy"].iloc[0]
+    table["accuracy_vs_llava_all"] = table["accuracy"] - llava_accuracy
+    return table.sort_values(["accuracy", "vlm_call_reduction"], ascending=False)
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route only uncertain YOLO frames to LLaVA")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ev = sub.add_parser("evaluate", help="Pick a band using merged-results.csv ground truth")
+    ev.add_argument("--merged-csv", default=MERGED_CSV)
+    ev.add_argument("--output", default=OUTPUT_CSV)
+
+    rt = sub.add_parser("route", help="List the frames of a folder that should go to LLaVA")
+    rt.add_argument("--frames-dir", required=True)
+    rt.add_argument("--yolo-metadata", default=YOLO_METADATA_DIR)
+    rt.add_argument("--band-low", type=float, default=BAND_LOW)
+    rt.add_argument("--band-high", type=float, default=BAND_HIGH)
+    rt.add_argument("--route-none", action="store_true")
+    rt.add_argument("--output", default="routed_frames.txt")
+    args = parser.parse_args()
+
+    if args.command == "evaluate":
+        df = pd.read_csv(args.merged_csv, usecols=["true_person_count", "yolo_count", "yolo_max_conf",
+                                                   "yolo_decision", "llava_count"])
+        grid = [round(0.4 + 0.05 * i, 2) for i in range(12)]
+        table = evaluate_bands(df, grid, grid)
+        table.to_csv(args.output, index=False)
+        print(table.head(15).to_string(index=False))
+        print(f"\nFull table saved to: {args.output}")
+    else:
+        frames = sorted(f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+        routed, kept = select_frames(frames, load_yolo_metadata(args.yolo_metadata),
+                                     band_low=args.band_low, band_high=args.band_high,
+                                     route_none=args.route_none)
+        with open(args.output, "w") as f:
+            f.write("\n".join(sorted(routed)) + "\n")
+        reasons = pd.Series(list(routed.values()), dtype=object).value_counts().to_dict()
+        print(f"Routed {len(routed)}/{len(frames)} frames to LLaVA "
+              f"({1 - len(routed) / max(len(frames), 1):.1%} fewer VLM calls): {reasons}")
+        print(f"Frame list saved to: {args.output}")
@@ -0,0 +1,256 @@
+"""
+llava_schema.py
+
+Schema validation and incremental (streaming) parsing of LLaVA answers.
+
+The documented answer (llava_analysis.PROMPT) is a JSON object with
+human_count, confidence, pedestrians[], rejected_items[] and
+scene_understanding. StreamingResponseParser consumes the generated text
+token by token and:
+- raises as soon as the output leaves that schema (prose instead of JSON,
+  an unknown key, a value of the wrong type, a runaway answer), so the
+  request can be aborted and retried without waiting for the full generation
+- reports `complete` once every required field has been parsed, so
+  generation can be stopped before the optional trailing fields
+
+Every failure is a LlavaResponseError subclass with its own `error_type`,
+recorded in the result instead of a silent human_count of 0.
+"""
+
+import json
+
+# ---------------------- Configuration ----------------------
+REQUIRED_FIELDS = ("human_count", "pedestrians", "rejected_items")
+OPTIONAL_FIELDS = ("confidence", "scene_understanding")
+MAX_RESPONSE_CHARS = 20000  # Longer answers are treated as runaway generations
+
+# First character a field value may start with
+VALUE_STARTS = {
+    "human_count": set("0123456789"),
+    "confidence": set("-0123456789."),
+    "pedestrians": {"["},
+    "rejected_items": {"["},
+    "scene_understanding": {'"'},
+}
+
+# ---------------------- Errors ----------------------
+class LlavaResponseError(ValueError):
+    """Base class of invalid LLaVA answers."""
+    error_type = "invalid_response"
+
+
+class EmptyResponseError(LlavaResponseError):
+    """The model produced no output."""
+    error_type = "empty_response"
+
+
+class MalformedJSONError(LlavaResponseError):
+    """The output is not JSON (e.g. prose, or broken syntax)."""
+    error_type = "malformed_json"
+
+
+class SchemaError(LlavaResponseError):
+    """Valid JSON, but an unknown key, a missing field or a wrong value type."""
+    error_type = "schema_violation"
+
+
+class TruncatedResponseError(LlavaResponseError):
+    """The output ended before the required fields were complete."""
+    error_type = "truncated"
+
+
+class RunawayResponseError(LlavaResponseError):
+    """The output exceeded MAX_RESPONSE_CHARS without completing."""
+    error_type = "runaway_generation"
+
+# ---------------------- Functions ----------------------
+def validate_field(key, value):
+    """Check and normalise one field of the answer; raise SchemaError if invalid."""
+    if key == "human_count":
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 or value != int(value):
+            raise SchemaError(f"human_count must be a non-negative integer, got {value!r}")
+        return int(value)
+    if key == "confidence":
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise SchemaError(f"confidence must be a number, got {value!r}")
+        return max(0.0, min(1.0, float(value)))
+    if key in ("pedestrians", "rejected_items"):
+        if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+            raise SchemaError(f"{key} must be a list of objects")
+        return value
+    if key == "scene_understanding":
+        if not isinstance(value, str):
+            raise SchemaError("scene_understanding must be a string")
+        return value
+    raise SchemaError(f"Unknown field {key!r}")
+
+def validate_answer(answer):
+    """
+    Validate a complete answer object and return it with normalised fields.
+    Missing required fields raise SchemaError.
+    """
+    if not isinstance(answer, dict):
+        raise SchemaError("Answer is not a JSON object")
+    result = {key: validate_field(key, value) for key, value in answer.items()}
+    missing = [key for key in REQUIRED_FIELDS if key not in result]
+    if missing:
+        raise SchemaError(f"Missing required fields: {', '.join(missing)}")
+    result.setdefault("confidence", 0.0)
+    return result
+
+def parse_answer(text):
+    """Parse and validate a complete (non-streamed) answer text."""
+    if not text or not text.strip():
+        raise EmptyResponseError("Empty response")
+    try:
+        answer = json.loads(text)
+    except ValueError as e:
+        raise MalformedJSONError(f"Invalid JSON: {e}") from e
+    return validate_answer(answer)
+
+# ---------------------- Classes ----------------------
+class StreamingResponseParser:
+    """
+    Incremental parser of the top-level answer object. Nested values are
+    only scanned for brackets and strings until they close, then decoded
+    and validated with validate_field.
+    """
+    def __init__(self, required=REQUIRED_FIELDS, allowed=REQUIRED_FIELDS + OPTIONAL_FIELDS,
+                 max_chars=MAX_RESPONSE_CHARS):
+        self.required = set(required)
+        self.allowed = set(allowed)
+        self.max_chars = max_chars
+        self.fields = {}
+        self.text = []
+        self.length = 0
+        self.state = "start"   # start, key, in_key, colon, value, after_value, done
+        self.key_chars = []
+        self.key = None
+        self.value_chars = []
+        self.depth = 0         # Bracket depth inside the current value
+        self.in_string = False
+        self.escape = False
+        self.scalar = False
+
+    @property
+    def complete(self):
+        """True once every required field has been parsed and validated."""
+        return self.required.issubset(self.fields)
+
+    def feed(self, chunk):
+        """Consume the next piece of generated text."""
+        self.text.append(chunk)
+        self.length += len(chunk)
+        for ch in chunk:
+            self._step(ch)
+        if self.length > self.max_chars and self.state != "done":
+            raise RunawayResponseError(f"No complete answer after {self.length} characters")
+
+    def finish(self):
+        """
+        Validated answer once the stream ended (or was stopped because it was
+        complete). Raises if required fields are missing.
+        """
+        if self.state == "value" and self.scalar and self.depth == 0:
+            self._end_value()  # Scalar value at the very end of a cut stream
+        if not self.complete:
+            if self.length == 0 or not "".join(self.text).strip():
+                raise EmptyResponseError("Empty response")
+            missing = sorted(self.required - set(self.fields))
+            if self.state == "done":  # The object was closed without them
+                raise SchemaError(f"Missing required fields: {', '.join(missing)}")
+            raise TruncatedResponseError(f"Stream ended without {', '.join(missing)}")
+        result = dict(self.fields)
+        result.setdefault("confidence", 0.0)
+        return result
+
+    def _step(self, ch):
+        state = self.state
+        if state == "value":
+            self._value_char(ch)
+        elif state == "in_key":
+            if self.escape:
+                self.escape = False
+                self.key_chars.append(ch)
+            elif ch == "\\":
+                self.escape = True
+                self.key_chars.append(ch)
+            elif ch == '"':
+                self.key = json.loads('"' + "".join(self.key_chars) + '"')
+                if self.key not in self.allowed:
+                    raise SchemaError(f"Unknown field {self.key!r}")
+                self.state = "colon"
+            else:
+                self.key_chars.append(ch)
+        elif ch.isspace():
+            return
+        elif state == "start":
+            if ch != "{":
+                raise MalformedJSONError(f"Answer does not start with a JSON object (got {ch!r})")
+            self.state = "key"
+        elif state == "key":
+            if ch == '"':
+                self.key_chars = []
+                self.state = "in_key"
+            elif ch == "}" and not self.fields:
+                self.state = "done"
+            else:
+                raise MalformedJSONError(f"Expected a field name, got {ch!r}")
+        elif state == "colon":
+            if ch != ":":
+                raise MalformedJSONError(f"Expected ':' after {self.key!r}, got {ch!r}")
+            self.state = "value_start"
+        elif state == "value_start":
+            if ch not in VALUE_STARTS[self.key]:
+                raise SchemaError(f"Unexpected value for {self.key!r} starting with {ch!r}")
+            self.value_chars = []
+            self.depth = 0
+            self.scalar = ch not in "[{\""
+            self.state = "value"
+            self._value_char(ch)
+        elif state == "after_value":
+            if ch == ",":
+                self.state = "key"
+            elif ch == "}":
+                self.state = "done"
+            else:
+                raise MalformedJSONError(f"Expected ',' or '}}' after {self.key!r}, got {ch!r}")
+        elif state == "done":
+            raise MalformedJSONError("Output continues after the answer object")
+
+    def _value_char(self, ch):
+        if self.scalar:
+            if ch in ",}" or ch.isspace():
+                self._end_value()
+                self._step(ch)
+                return
+            self.value_chars.append(ch)
+            return
+
+        self.value_chars.append(ch)
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.depth == 0:
+                    self._end_value()
+        elif ch == '"':
+            self.in_string = True
+        elif ch in "[{":
+            self.depth += 1
+        elif ch in "]}":
+            self.depth -= 1
+            if self.depth == 0:
+                self._end_value()
+
+    def _end_value(self):
+        raw = "".join(self.value_chars)
+        try:
+            value = json.loads(raw)
+        except ValueError as e:
+            raise MalformedJSONError(f"Invalid value for {self.key!r}: {e}") from e
+        self.fields[self.key] = validate_field(self.key, value)
+        self.state = "after_value"
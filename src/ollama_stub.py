@@ -0,0 +1,266 @@
+"""
+ollama_stub.py
+
+Local stand-in for the Ollama /api/generate endpoint, used to test and
+benchmark the LLaVA clients without a GPU or network access.
+Responses follow the documented LLaVA JSON format. Latency, error rate and
+server capacity are configurable. Every outcome is derived from the seed,
+the image payload and how many times that image was already requested, so
+runs are reproducible regardless of request ordering.
+When more requests are in flight than `capacity`, latency grows
+proportionally, which mimics an overloaded Ollama instance.
+Responses carry a context and Ollama-style timings and token counts: an
+image costs IMAGE_TOKENS prompt tokens, and a request continuing from a
+context only pays for its new prompt, like a real prefix-cache hit.
+Streaming requests get Ollama's newline-delimited chunks, one per ~4
+characters, and generation stops when the client disconnects. A
+configurable fraction of answers can be malformed (prose, unknown key,
+wrong type, truncated) to exercise schema validation.
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ---------------------- Configuration ----------------------
+HOST = "127.0.0.1"
+PORT = 11435
+LATENCY = 0.5       # Base seconds per request
+JITTER = 0.1        # Extra uniform random latency in seconds
+ERROR_RATE = 0.0    # Fraction of requests answered with HTTP 500
+MALFORMED_RATE = 0.0  # Fraction of answers that do not follow the JSON schema
+MALFORMED_KINDS = ("prose", "unknown_key", "wrong_type", "truncated")
+CAPACITY = 4        # Requests served at base latency before slowing down
+SEED = 0
+IMAGE_TOKENS = 576  # Prompt tokens of one LLaVA image embedding
+TOKEN_SECONDS = 0.0005  # Simulated prompt evaluation time per token
+
+# ---------------------- Classes ----------------------
+class StubState:
+    """
+    Shared, thread-safe configuration and counters of the stub server.
+    """
+    def __init__(self, latency=LATENCY, jitter=JITTER, error_rate=ERROR_RATE,
+                 capacity=CAPACITY, seed=SEED, malformed_rate=MALFORMED_RATE):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.capacity = capacity
+        self.seed = seed
+        self.seen = {}  # image digest -> number of requests so far
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0  # Streams closed by the client before the end
+
+    def start_request(self, request):
+        """
+        Register a request and draw its latency, failure, malformed-answer
+        kind (None for a valid answer) and pedestrian count.
+        """
+        if request.get("images") or not request.get("context"):
+            digest = image_digest(request.get("images", []))
+        else:
+            # Follow-up prompt: the image is identified by the returned context
+            digest = f"{request['context'][0]:016x}"
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            attempt = self.seen.get(digest, 0)
+            self.seen[digest] = attempt + 1
+            load = max(1.0, self.in_flight / self.capacity)
+
+        rng = random.Random(f"{self.seed}:{digest}:{attempt}")
+        delay = (self.latency + rng.uniform(0, self.jitter)) * load
+        fail = rng.random() < self.error_rate
+        malformed = rng.choice(MALFORMED_KINDS) if rng.random() < self.malformed_rate else None
+        # The answer only depends on the image, not on the attempt
+        count = random.Random(f"{self.seed}:{digest}").randint(0, 6)
+        if fail:
+            with self.lock:
+                self.errors += 1
+        return delay, fail, malformed, count
+
+    def end_request(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def image_digest(images):
+    """Short hex digest identifying the images of a request."""
+    return hashlib.sha256("".join(images).encode("utf-8")).hexdigest()[:16]
+
+
+def fake_tile_answer(n, count):
+    """Per-tile answer for roi_mosaic.py requests: the first `count` tiles are pedestrians."""
+    return {
+        "tiles": [
+            {"tile": i + 1, "is_pedestrian": i < count,
+             "type": "adult walking" if i < count else "mannequin", "confidence": 0.8}
+            for i in range(n)
+        ]
+    }
+
+
+def fake_llava_answer(count):
+    """A well-formed LLaVA answer reporting `count` pedestrians."""
+    positions = ["left", "center", "right"]
+    return {
+        "human_count": count,
+        "confidence": 0.9,
+        "pedestrians": [
+            {
+                "description": "adult walking",
+                "approximate_age": "adult",
+                "position": positions[i % 3],
+                "activity": "walking",
+                "visibility": "clear"
+            }
+            for i in range(count)
+        ],
+        "rejected_items": [],
+        "scene_understanding": f"Synthetic urban scene with {count} pedestrians."
+    }
+
+
+def fake_malformed_answer(count, kind):
+    """An answer breaking the schema in the given way (see MALFORMED_KINDS)."""
+    if kind == "prose":
+        return f"The image shows {count} pedestrians crossing the street near parked cars."
+    if kind == "unknown_key":
+        return json.dumps({"people": count, "human_count": count})
+    if kind == "wrong_type":
+        return json.dumps({"human_count": f"{count} people", "pedestrians": []})
+    return json.dumps(fake_llava_answer(count))[:40]
+
+
+class OllamaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like Ollama
+    state = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/api/generate":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self._send(400, {"error": "invalid JSON body"})
+            return
+
+        delay, fail, malformed, count = self.state.start_request(request)
+        prompt_tokens = len(request.get("prompt", "").split()) + IMAGE_TOKENS * len(request.get("images", []))
+        from roi_mosaic import tile_count  # Imported on first use: cv2 is not needed otherwise
+        tiles = tile_count(request.get("prompt"))
+        if malformed:
+            response = fake_malformed_answer(count, malformed)
+        else:
+            answer = fake_tile_answer(tiles, count) if tiles else fake_llava_answer(count)
+            response = json.dumps(answer)
+        tokens = re.findall(r".{1,4}", response, re.S)  # ~4 characters per generated token
+        context = request.get("context") or [int(image_digest(request.get("images", [])), 16)]
+        final = {
+            "model": request.get("model", "llava:latest"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": response,
+            "done": True,
+            "context": context + [len(context)] * (prompt_tokens + len(tokens)),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_tokens * TOKEN_SECONDS * 1e9),
+            "load_duration": 0,
+            "eval_count": len(tokens),
+            "eval_duration": int(delay * 1e9),
+            "total_duration": int((delay + prompt_tokens * TOKEN_SECONDS) * 1e9),
+        }
+        try:
+            time.sleep(prompt_tokens * TOKEN_SECONDS)
+            if fail:
+                time.sleep(delay)
+                self._send(500, {"error": "stub: simulated server error"})
+            elif request.get("stream", True):
+                self._stream(tokens, delay / max(len(tokens), 1), final)
+            else:
+                time.sleep(delay)
+                self._send(200, final)
+        finally:
+            self.state.end_request()
+
+    def _stream(self, tokens, token_delay, final):
+        """
+        Newline-delimited JSON chunks like Ollama's streaming mode. Stops
+        generating when the client closes the connection.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        messages = [{"model": final["model"], "response": t, "done": False} for t in tokens]
+        messages.append({**final, "response": ""})
+        try:
+            for message in messages:
+                if not message["done"]:
+                    time.sleep(token_delay)
+                data = (json.dumps(message) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            with self.state.lock:
+                self.state.cancelled += 1
+            self.close_connection = True
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+# ---------------------- Functions ----------------------
+def start_stub_server(host=HOST, port=PORT, **state_kwargs):
+    """
+    Start the stub in a background thread.
+    Returns (server, url); call server.shutdown() to stop it.
+    Use port=0 to pick a free port.
+    """
+    handler = type("Handler", (OllamaStubHandler,), {"state": StubState(**state_kwargs)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/generate"
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama /api/generate server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--jitter", type=float, default=JITTER)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE)
+    parser.add_argument("--malformed-rate", type=float, default=MALFORMED_RATE)
+    parser.add_argument("--capacity", type=int, default=CAPACITY)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    server, url = start_stub_server(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                                    error_rate=args.error_rate, capacity=args.capacity, seed=args.seed,
+                                    malformed_rate=args.malformed_rate)
+    print(f"Ollama stub listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
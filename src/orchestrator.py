@@ -0,0 +1,383 @@
+"""
+orchestrator.py
+
+Single entry point for the whole pipeline. Each dataset goes through
+    extract -> (select) -> yolo -> llava
+and all datasets feed one ground_truth -> analyze step, plus the "mine" step
+that updates the disagreement index. The stages form a dependency graph: a
+stage starts as soon as its dependencies are done, so YOLO and LLaVA run
+side by side on the same frames and several datasets are processed in
+parallel (per-kind limits keep e.g. one YOLO job per GPU).
+
+Every stage runs the existing script as a subprocess with paths from the
+config, and records a stamp of its parameters and inputs (file count, size
+and latest mtime). On the next run, a stage whose stamp still matches and
+whose outputs exist is skipped.
+
+Config is a JSON file merged over DEFAULT_CONFIG, plus --set overrides:
+
+    {
+      "work_dir": "pipeline_runs",
+      "datasets": {
+        "week30": {"video": "/data/week30.h264"},
+        "part1":  {"frames_dir": "frames_extracted_part1", "selection": "part1_selected.txt"}
+      },
+      "llava": {"url": "http://localhost:11434/api/generate", "route": true},
+      "ground_truth_csv": "results/merged-results.csv"
+    }
+
+A dataset either has a video (extracted into <work_dir>/<dataset>/frames)
+or an existing frames_dir. "selection" is optional: a directory of
+manually selected frames, or a text file listing one frame name per line.
+
+The analyze metrics cover the frames that have ground truth and a LLaVA
+result (ResultsStore.merged). With llava.route, LLaVA only sees the frames
+YOLO is unsure about, so the metrics cover that routed subset and not the
+frames whose YOLO result was kept; a warning is printed for that setup.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# ---------------------- Configuration ----------------------
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {
+    "work_dir": "pipeline_runs",
+    "datasets": {},
+    "extract": {"frame_interval": 10, "adaptive": False},
+    "yolo": {"batch_size": 8, "raw_boxes": False, "server": None},  # server: detection_server.py socket
+    "llava": {
+        "enabled": True,
+        "url": "http://localhost:11434/api/generate",
+        "max_concurrency": 8,
+        "stream": False,
+        "route": False,  # Only send frames YOLO is unsure about (LLaVA then waits for YOLO,
+                         # and analyze only covers the routed frames)
+    },
+    "ground_truth_csv": None,  # merged-results.csv-style file with true/fake person counts
+    "analyze": {"enabled": True, "summary_csv": "data/dataset_person_summary.csv"},
+    "mine": {"enabled": True},  # Disagreement index (disagreement_index.py) over the store
+    "max_parallel": 4,
+    "limits": {"extract": 2, "select": 2, "yolo": 1, "llava": 1, "ground_truth": 1, "analyze": 1, "mine": 1},
+}
+
+# ---------------------- Classes ----------------------
+class Stage:
+    """
+    One node of the pipeline graph: either a list of commands or a Python
+    callable, with the paths it reads and writes.
+    """
+    def __init__(self, name, kind, deps=(), commands=None, func=None, inputs=(), outputs=(), params=None):
+        self.name = name
+        self.kind = kind
+        self.deps = list(deps)
+        self.commands = commands or []
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params if params is not None else self.commands
+        self.status = "pending"
+        self.seconds = 0.0
+        self.error = None
+
+    def signature(self):
+        return {"params": self.params, "inputs": {p: path_signature(p) for p in self.inputs}}
+
+    def up_to_date(self, stamp_dir):
+        stamp = os.path.join(stamp_dir, f"{self.name}.json")
+        if not os.path.exists(stamp):
+            return False
+        with open(stamp, "r") as f:
+            saved = json.load(f)
+        # Outputs deleted since the last run make the stage stale; a stage may
+        # legitimately produce nothing (e.g. every frame routed away from LLaVA)
+        if any(existed and not os.path.exists(p) for p, existed in saved.pop("outputs", {}).items()):
+            return False
+        return saved == json.loads(json.dumps(self.signature()))
+
+    def run(self, stamp_dir, log_dir):
+        signature = self.signature()  # Inputs as they were when the stage started
+        if self.func is not None:
+            self.func()
+        with open(os.path.join(log_dir, f"{self.name}.log"), "w") as log:
+            for cmd in self.commands:
+                log.write("$ " + " ".join(cmd) + "\n")
+                log.flush()
+                subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, check=True, cwd=os.getcwd())
+        signature["outputs"] = {p: os.path.exists(p) for p in self.outputs}
+        with open(os.path.join(stamp_dir, f"{self.name}.json"), "w") as f:
+            json.dump(signature, f, indent=2)
+
+# ---------------------- Functions ----------------------
+def path_signature(path):
+    """(files, total bytes, latest mtime) of a file or directory tree; None if missing."""
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return [1, st.st_size, st.st_mtime_ns]
+    files = size = latest = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            st = os.stat(os.path.join(root, name))
+            files += 1
+            size += st.st_size
+            latest = max(latest, st.st_mtime_ns)
+    return [files, size, latest]
+
+def merge_config(base, override):
+    """Recursively merge override into a copy of base."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def apply_override(config, assignment):
+    """Apply one --set key.sub=value (value parsed as JSON when possible)."""
+    key, _, raw = assignment.partition("=")
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = raw
+    node = config
+    parts = key.split(".")
+    for part in parts[:-1]:
+        node = node.setdefault(part, {})
+    node[parts[-1]] = value
+
+def load_config(path=None, overrides=()):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path, "r") as f:
+            config = merge_config(config, json.load(f))
+    for assignment in overrides:
+        apply_override(config, assignment)
+    return config
+
+def script(name):
+    return [sys.executable, os.path.join(SRC_DIR, name)]
+
+def select_frames_from_list(frames_dir, selection_file, selected_dir):
+    """Hard-link (or copy) the frames listed in selection_file into selected_dir."""
+    os.makedirs(selected_dir, exist_ok=True)
+    with open(selection_file, "r") as f:
+        names = [line.strip().split(",")[0] for line in f if line.strip()]
+    for name in names:
+        src, dst = os.path.join(frames_dir, name), os.path.join(selected_dir, name)
+        if os.path.exists(dst) or not os.path.exists(src):
+            continue
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+def config_warnings(config):
+    """Settings that are valid but easy to misread the results of."""
+    warnings = []
+    if (config["llava"].get("enabled", True) and config["llava"].get("route")
+            and config["analyze"].get("enabled", True) and config.get("ground_truth_csv")):
+        warnings.append("llava.route is set: the analyze metrics only cover the frames routed to LLaVA, "
+                        "not the frames whose YOLO result was kept")
+    return warnings
+
+def build_stages(config, datasets=None):
+    """Create the stage graph for the configured (or the given) datasets."""
+    work = config["work_dir"]
+    store = os.path.join(work, "store")
+    stages = []
+    frame_stages = []  # Stages the analysis depends on
+
+    for dataset, ds in config["datasets"].items():
+        if datasets and dataset not in datasets:
+            continue
+        ds_dir = os.path.join(work, dataset)
+        deps = []
+
+        if ds.get("video"):
+            frames_dir = os.path.join(ds_dir, "frames")
+            ex = config["extract"]
+            if ex.get("adaptive"):
+                cmd = script("frame_sampler.py") + ["extract", "--video", ds["video"], "--output-dir", frames_dir]
+            else:
+                cmd = script("extract_frames.py") + ["--video", ds["video"], "--output-dir", frames_dir,
+                                                     "--frame-interval", str(ex["frame_interval"])]
+            stages.append(Stage(f"{dataset}.extract", "extract", commands=[cmd],
+                                inputs=[ds["video"]], outputs=[frames_dir]))
+            deps = [f"{dataset}.extract"]
+        else:
+            frames_dir = ds["frames_dir"]
+
+        selection = ds.get("selection")
+        if selection and os.path.isdir(selection):
+            frames_dir = selection
+        elif selection:
+            selected_dir = os.path.join(ds_dir, "selected")
+            source_dir = frames_dir
+            stages.append(Stage(
+                f"{dataset}.select", "select", deps,
+                func=lambda s=source_dir, f=selection, d=selected_dir: select_frames_from_list(s, f, d),
+                inputs=[source_dir, selection], outputs=[selected_dir], params=[selection, selected_dir],
+            ))
+            deps = [f"{dataset}.select"]
+            frames_dir = selected_dir
+
+        yolo = config["yolo"]
+        cmd = script("yolo_pipeline.py") + [
+            "--frames-dir", frames_dir, "--output-dir", os.path.join(ds_dir, "yolo"),
+            "--batch-size", str(yolo["batch_size"]), "--store", store, "--dataset", dataset,
+        ] + (["--raw-boxes"] if yolo.get("raw_boxes") else [])
+        cmd += ["--server", yolo["server"]] if yolo.get("server") else []
+        stages.append(Stage(f"{dataset}.yolo", "yolo", deps, commands=[cmd],
+                            inputs=[frames_dir], outputs=[os.path.join(ds_dir, "yolo")]))
+        frame_stages.append(f"{dataset}.yolo")
+
+        llava = config["llava"]
+        if llava.get("enabled", True):
+            cmd = script("llava_client.py") + [
+                "--frames-dir", frames_dir, "--output-dir", os.path.join(ds_dir, "llava"),
+                "--url", llava["url"], "--max-concurrency", str(llava["max_concurrency"]),
+                "--store", store, "--dataset", dataset,
+            ]
+            cmd += ["--stream"] if llava.get("stream") else []
+            llava_deps = list(deps)
+            llava_inputs = [frames_dir]
+            if llava.get("route"):
+                # Routing needs this dataset's YOLO results first
+                cmd += ["--route-from-store"]
+                llava_deps.append(f"{dataset}.yolo")
+                llava_inputs.append(os.path.join(ds_dir, "yolo"))
+            stages.append(Stage(f"{dataset}.llava", "llava", llava_deps, commands=[cmd],
+                                inputs=llava_inputs, outputs=[os.path.join(ds_dir, "llava")]))
+            frame_stages.append(f"{dataset}.llava")
+
+    analyze_deps = list(frame_stages)
+    if config.get("ground_truth_csv"):
+        gt = config["ground_truth_csv"]
+        cmd = script("results_store.py") + ["--store", store, "import-csv", "--merged-csv", gt]
+        stages.append(Stage("ground_truth", "ground_truth", commands=[cmd], inputs=[gt],
+                            outputs=[os.path.join(store, "ground_truth")]))
+        analyze_deps.append("ground_truth")
+
+    if config["analyze"].get("enabled", True) and config.get("ground_truth_csv"):
+        conclusion = os.path.join(work, "conclusion")
+        merged_csv = os.path.join(work, "merged-results.csv")
+        commands = [
+            script("results_store.py") + ["--store", store, "export", "merged", merged_csv],
+            script("analyze_results.py") + ["--store", store, "--output-dir", conclusion,
+                                            "--summary-csv", config["analyze"]["summary_csv"]],
+        ]
+        stages.append(Stage("analyze", "analyze", analyze_deps, commands=commands,
+                            inputs=[os.path.join(store, s) for s in ("yolo", "llava", "ground_truth")],
+                            outputs=[conclusion, merged_csv]))
+
+    if config["mine"].get("enabled", True) and frame_stages:
+        index_dir = os.path.join(work, "disagreements")
+        cmd = script("disagreement_index.py") + ["--index", index_dir, "build", "--store", store]
+        stages.append(Stage("mine", "mine", analyze_deps, commands=[cmd],
+                            inputs=[os.path.join(store, s) for s in ("yolo", "llava", "ground_truth")],
+                            outputs=[index_dir]))
+    return stages
+
+def run_dag(stages, work_dir, max_parallel=4, limits=None, force=False, dry_run=False):
+    """
+    Run stages as their dependencies complete, at most max_parallel at a
+    time and at most limits[kind] of each kind. A failed stage fails
+    everything downstream of it; other branches keep running.
+    """
+    limits = limits or {}
+    stamp_dir = os.path.join(work_dir, ".stamps")
+    log_dir = os.path.join(work_dir, "logs")
+    os.makedirs(stamp_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+
+    by_name = {s.name: s for s in stages}
+    pending = list(stages)
+    running = {}  # future -> stage
+    kinds = {}    # kind -> running count
+
+    def execute(stage):
+        start = time.perf_counter()
+        upstream_changes = any(by_name[d].status == "would run" for d in stage.deps if d in by_name)
+        try:
+            if not force and not upstream_changes and stage.up_to_date(stamp_dir):
+                return "skipped"
+            if dry_run:
+                return "would run"
+            stage.run(stamp_dir, log_dir)
+            return "done"
+        finally:
+            stage.seconds = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        while pending or running:
+            for stage in list(pending):
+                dep_status = [by_name[d].status for d in stage.deps if d in by_name]
+                if any(s in ("failed", "blocked") for s in dep_status):
+                    stage.status = "blocked"
+                    pending.remove(stage)
+                elif all(s in ("done", "skipped", "would run") for s in dep_status) \
+                        and len(running) < max_parallel and kinds.get(stage.kind, 0) < limits.get(stage.kind, max_parallel):
+                    stage.status = "running"
+                    kinds[stage.kind] = kinds.get(stage.kind, 0) + 1
+                    running[pool.submit(execute, stage)] = stage
+                    pending.remove(stage)
+                    print(f"[start] {stage.name}")
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                kinds[stage.kind] -= 1
+                try:
+                    stage.status = future.result()
+                except Exception as e:
+                    stage.status = "failed"
+                    stage.error = str(e)
+                print(f"[{stage.status}] {stage.name} ({stage.seconds:.1f} s)")
+    return stages
+
+def print_summary(stages):
+    print("\n=== Pipeline ===")
+    for s in stages:
+        line = f"{s.name:<28} {s.status:<10} {s.seconds:8.1f} s"
+        if s.error:
+            line += f"  {s.error}"
+        print(line)
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the extract -> YOLO -> LLaVA -> analyze pipeline")
+    parser.add_argument("--config", default=None, help="JSON config file (merged over the defaults)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a config value, e.g. --set llava.stream=true")
+    parser.add_argument("--video", default=None, help="Quick run: one dataset from this video")
+    parser.add_argument("--frames-dir", default=None, help="Quick run: one dataset from these frames")
+    parser.add_argument("--dataset", default="dataset", help="Dataset name of a quick run")
+    parser.add_argument("--datasets", nargs="*", default=None, help="Only run these configured datasets")
+    parser.add_argument("--force", action="store_true", help="Rerun stages even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only show which stages would run")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.set)
+    if args.video or args.frames_dir:
+        config["datasets"][args.dataset] = {"video": args.video} if args.video else {"frames_dir": args.frames_dir}
+    if not config["datasets"]:
+        parser.error("No datasets: give --config, --video or --frames-dir")
+
+    for warning in config_warnings(config):
+        print(f"Warning: {warning}", file=sys.stderr)
+    stages = build_stages(config, args.datasets)
+    run_dag(stages, config["work_dir"], config["max_parallel"], config["limits"], args.force, args.dry_run)
+    print_summary(stages)
+    sys.exit(1 if any(s.status in ("failed", "blocked") for s in stages) else 0)
@@ -0,0 +1,224 @@
+"""
+profiling.py
+
+Lightweight per-stage instrumentation of the hot paths (frame decode, YOLO
+preprocess/inference/postprocess, drawing, image and JSON writes, LLaVA
+encoding and HTTP time).
+
+    with PROFILER.stage("decode"):
+        img = cv2.imread(path)
+    PROFILER.end_frame(frame_name)
+
+Each frame's stage timings are collected together with the process
+resident memory (current and peak). The results can be written as:
+- a JSON-lines log, one record per frame (--profile-log)
+- a Prometheus text-format file with per-stage summaries, for the
+  node_exporter textfile collector (--metrics-file)
+
+When profiling is disabled (the default), stage() returns one shared no-op
+context manager and end_frame() returns immediately, so the instrumented
+code pays only an attribute check per call.
+
+run_profiled() additionally wraps a whole run in cProfile (.prof output for
+snakeviz/pstats) or attaches py-spy to the current process, if installed.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import resource
+import subprocess
+from contextlib import contextmanager, nullcontext
+
+# ---------------------- Configuration ----------------------
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "pedestrian"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_NULL = nullcontext()
+
+# ---------------------- Functions ----------------------
+def rss_bytes():
+    """Current resident set size of the process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return peak_rss_bytes()
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of the process. VmHWM is preferred over
+    getrusage, whose maximum survives exec() and may be the parent's.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KiB
+
+def quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+# ---------------------- Classes ----------------------
+class StageProfiler:
+    """
+    Per-frame stage timings and memory. Stage durations of the current
+    frame accumulate until end_frame(); totals are kept per stage.
+    """
+    def __init__(self, enabled=False, log_path=None):
+        self.enabled = enabled
+        self.frame = {}
+        self.samples = {}   # stage -> list of seconds, one per frame that ran it
+        self.frames = 0
+        self.peak_rss = 0
+        self.start = time.perf_counter()
+        self._log = open(log_path, "w") if enabled and log_path else None
+
+    def stage(self, name):
+        """Context manager timing one stage of the current frame."""
+        if not self.enabled:
+            return _NULL
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """Add an externally measured duration (e.g. YOLO's own speed breakdown)."""
+        if self.enabled:
+            self.frame[name] = self.frame.get(name, 0.0) + seconds
+
+    def end_frame(self, frame=None, **fields):
+        """Close the current frame: record its stages, RSS and any extra fields."""
+        if not self.enabled:
+            return
+        rss = rss_bytes()
+        self.peak_rss = max(self.peak_rss, rss)
+        for name, seconds in self.frame.items():
+            self.samples.setdefault(name, []).append(seconds)
+        self.frames += 1
+        if self._log is not None:
+            record = {"frame": frame, "ts": time.time(), "rss_bytes": rss,
+                      "stages": {k: round(v, 6) for k, v in self.frame.items()}, **fields}
+            self._log.write(json.dumps(record) + "\n")
+        self.frame = {}
+
+    def summary(self):
+        """Per-stage count, total, mean and quantiles in seconds."""
+        rows = {}
+        for name, values in self.samples.items():
+            ordered = sorted(values)
+            rows[name] = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values),
+                          **{f"p{int(q * 100)}": quantile(ordered, q) for q in QUANTILES}}
+        return rows
+
+    def write_prometheus(self, path, job=None):
+        """Write the per-stage summaries in the Prometheus text exposition format."""
+        labels = f',job="{job}"' if job else ""
+        plain = f'{{job="{job}"}}' if job else ""
+        lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per frame in each pipeline stage.",
+                 f"# TYPE {METRIC_PREFIX}_stage_seconds summary"]
+        for name, row in self.summary().items():
+            for q in QUANTILES:
+                lines.append(f'{METRIC_PREFIX}_stage_seconds{{stage="{name}"{labels},quantile="{q}"}} '
+                             f'{row[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{name}"{labels}}} {row["total"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{name}"{labels}}} {row["count"]}')
+        lines += [
+            f"# TYPE {METRIC_PREFIX}_frames_total counter",
+            f"{METRIC_PREFIX}_frames_total{plain} {self.frames}",
+            f"# TYPE {METRIC_PREFIX}_resident_memory_peak_bytes gauge",
+            f"{METRIC_PREFIX}_resident_memory_peak_bytes{plain} {max(self.peak_rss, peak_rss_bytes())}",
+            f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+            f"{METRIC_PREFIX}_run_seconds{plain} {time.perf_counter() - self.start:.3f}",
+        ]
+        # Written atomically so a scraping collector never reads a partial file
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def print_report(self):
+        if not self.enabled or not self.samples:
+            return
+        elapsed = time.perf_counter() - self.start
+        print(f"\n=== Stage profile ({self.frames} frames, {elapsed:.1f} s, "
+              f"peak RSS {max(self.peak_rss, peak_rss_bytes()) / 1024 ** 2:.0f} MB) ===")
+        print(f"{'stage':<22}{'frames':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'share':>8}")
+        for name, row in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+            print(f"{name:<22}{row['count']:>8}{row['total']:>10.2f}{row['mean'] * 1000:>10.1f}"
+                  f"{row['p95'] * 1000:>10.1f}{row['total'] / elapsed:>8.1%}")
+
+    def close(self, metrics_file=None, job=None):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self.enabled and metrics_file:
+            self.write_prometheus(metrics_file, job)
+
+# Disabled by default; scripts replace it through configure()
+PROFILER = StageProfiler()
+
+def configure(enabled=True, log_path=None):
+    """Replace the module-level PROFILER used by the instrumented scripts."""
+    global PROFILER
+    PROFILER = StageProfiler(enabled, log_path)
+    return PROFILER
+
+def add_arguments(parser):
+    """Profiling options shared by the instrumented scripts."""
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile-stages", action="store_true", help="Time each stage per frame and print a summary")
+    group.add_argument("--profile-log", default=None, help="JSON-lines file of per-frame stage timings and RSS")
+    group.add_argument("--metrics-file", default=None, help="Prometheus text file with per-stage summaries")
+    group.add_argument("--profile", choices=["cprofile", "py-spy"], default=None,
+                       help="Also profile the whole run with cProfile or py-spy")
+    group.add_argument("--profile-output", default=None, help="Output of --profile (.prof or .svg)")
+
+def from_args(args):
+    """Configure PROFILER from add_arguments() options."""
+    return configure(bool(args.profile_stages or args.profile_log or args.metrics_file), args.profile_log)
+
+@contextmanager
+def run_profiled(mode=None, output=None):
+    """
+    Wrap a run in cProfile or py-spy. py-spy samples this process from the
+    outside (it may need ptrace permission), so it adds no overhead to the run.
+    """
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output or "profile.prof")
+            print(f"cProfile stats written to {output or 'profile.prof'}")
+    elif mode == "py-spy":
+        if shutil.which("py-spy") is None:
+            print("py-spy not found on PATH; running without it")
+            yield
+            return
+        proc = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()),
+                                 "--output", output or "profile.svg", "--nonblocking"])
+        try:
+            yield
+        finally:
+            proc.send_signal(signal.SIGINT)  # py-spy writes its output on Ctrl-C
+            proc.wait()
+    else:
+        yield
@@ -4,10 +4,27 @@ real_time_yolo.py
 Real-time pedestrian detection using YOLOv8m.
 Supports video files, webcam, or RTSP streams.
 Displays annotated frames with bounding boxes and labels.
+
+With --realtime, capture runs in its own thread that keeps only the latest
+frame, so inference always works on the freshest frame and latency stays
+bounded when the model is slower than the source. Supports a reduced input
+size, a frame-skip policy (or --track-every K, which propagates boxes with
+tracker.py between detections and keeps stable pedestrian IDs) and a
+headless output path, and reports end-to-end latency, achieved fps and
+dropped frames.
+
+ultralytics is imported only once the arguments are parsed; with --server
+the frames go to a running detection_server.py, which keeps the model warm
+between runs.
 """
 
+import time
+import argparse
+import threading
+
 import cv2
-from ultralytics import YOLO
+
+import profiling
 
 # ---------------------- Configuration ----------------------
 MODEL_PATH = "yolov8m.pt"  # Path to YOLOv8 model (replace with custom model if needed)
@@ -16,31 +33,249 @@ VIDEO_SOURCE = "/home/serine/datos/properdata/GX010212.MP4"
 # VIDEO_SOURCE = 0           # Webcam (device 0)
 # VIDEO_SOURCE = "rtsp://..." # IP camera (RTSP stream)
 
-# Load YOLOv8 model
-model = YOLO(MODEL_PATH)  # COCO-pretrained model (detects 'person' class)
+IMGSZ = 640        # Inference input size; lower (e.g. 416/320) trades accuracy for speed
+SKIP = 1           # Run inference on every SKIP-th processed frame, reuse boxes in between
+WINDOW_NAME = "YOLOv8 Real-Time Pedestrian Detection"
 
-# Open video capture
-cap = cv2.VideoCapture(VIDEO_SOURCE)
+# ---------------------- Classes ----------------------
+class LatestFrameReader:
+    """
+    Reads frames in a background thread and keeps only the most recent one.
+    Frames that are overwritten before being consumed are counted as dropped.
+    With pace=True, a video file is read at its native fps to emulate a live
+    camera (otherwise a file would be read as fast as it decodes).
+    """
+    def __init__(self, source, pace=False):
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video source: {source}")
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_period = 1.0 / fps if pace and fps > 0 else 0.0
+        self.source_fps = fps
+        self.captured = 0
+        self.dropped = 0
+        self.stopped = False
+        self._frame = None  # (frame_id, capture_time, frame)
+        self._consumed_id = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
 
-# ---------------------- Main Loop ----------------------
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        next_time = time.perf_counter()
+        try:
+            while not self.stopped:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                now = time.perf_counter()
+                with self._cond:
+                    self.captured += 1
+                    if self._frame is not None and self._frame[0] > self._consumed_id:
+                        self.dropped += 1
+                    self._frame = (self.captured, now, frame)
+                    self._cond.notify()
+                if self.frame_period:
+                    next_time += self.frame_period
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+        finally:
+            # Released here, never while this thread may still be inside cap.read()
+            self.cap.release()
+            with self._cond:
+                self.stopped = True
+                self._cond.notify()
+
+    def read(self):
+        """
+        Block until a frame newer than the last one returned is available.
+        Returns (frame_id, capture_time, frame), or None at end of stream.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.stopped or (self._frame and self._frame[0] > self._consumed_id))
+            if self._frame is None or self._frame[0] <= self._consumed_id:
+                return None
+            self._consumed_id = self._frame[0]
+            return self._frame
+
+    def stop(self):
+        """Ask the reader thread to exit; it releases the capture itself."""
+        self.stopped = True
+        if self._thread.ident is None:  # Never started
+            self.cap.release()
+        else:
+            self._thread.join(timeout=2)
+
+
+class LatencyStats:
+    """End-to-end latency samples and frame counters of a real-time run."""
+    def __init__(self):
+        self.latencies = []
+        self.inferences = 0
+        self.skipped = 0
+        self.start = time.perf_counter()
+
+    def report(self, reader):
+        elapsed = time.perf_counter() - self.start
+        ordered = sorted(self.latencies) or [0.0]
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return {
+            "frames_captured": reader.captured,
+            "frames_processed": len(self.latencies),
+            "frames_dropped": reader.dropped,
+            "frames_skipped": self.skipped,
+            "inferences": self.inferences,
+            "achieved_fps": len(self.latencies) / elapsed if elapsed > 0 else 0.0,
+            "source_fps": reader.source_fps,
+            "latency_p50_ms": pick(0.50) * 1000,
+            "latency_p95_ms": pick(0.95) * 1000,
+            "latency_max_ms": ordered[-1] * 1000,
+        }
+
+# ---------------------- Functions ----------------------
+def run_serial(model, source=VIDEO_SOURCE):
+    """
+    Original loop: read, detect, plot and display every frame in turn.
+    """
+    cap = cv2.VideoCapture(source)
+    prof = profiling.PROFILER
 
-    # Run YOLOv8 inference (detect only 'person' class)
-    results = model(frame, classes=[0])
+    while cap.isOpened():
+        with prof.stage("read"):
+            ret, frame = cap.read()
+        if not ret:
+            break
 
-    # Visualize results: draw bounding boxes + labels
-    annotated_frame = results[0].plot()
+        # Run YOLOv8 inference (detect only 'person' class)
+        with prof.stage("yolo"):
+            results = model(frame, classes=[0])
 
-    # Display the annotated frame
-    cv2.imshow("YOLOv8 Real-Time Pedestrian Detection", annotated_frame)
+        # Visualize results: draw bounding boxes + labels
+        with prof.stage("plot"):
+            annotated_frame = results[0].plot()
+
+        # Display the annotated frame
+        with prof.stage("display"):
+            cv2.imshow(WINDOW_NAME, annotated_frame)
+        prof.end_frame()
+
+        # Exit on 'q' key press
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    # Release resources
+    cap.release()
+    cv2.destroyAllWindows()
+
+def run_realtime(model, source=VIDEO_SOURCE, imgsz=IMGSZ, skip=SKIP, headless=False,
+                 output_path=None, pace=False, max_frames=None, track_every=None):
+    """
+    Latest-frame real-time loop. Returns the latency/fps report.
+    """
+    reader = LatestFrameReader(source, pace).start()
+    stats = LatencyStats()
+    prof = profiling.PROFILER
+    writer = None
+    last_result = None
+
+    tracked = None
+    if track_every:
+        from tracker import TrackedDetector, draw_tracks, yolo_detect_fn
+        # Same CONF_LOW/MIN_HEIGHT filter as the propagated boxes, so boxes do
+        # not appear on detector frames only
+        tracked = TrackedDetector(yolo_detect_fn(model, imgsz), track_every)
+
+    try:
+        while max_frames is None or len(stats.latencies) < max_frames:
+            with prof.stage("wait_frame"):
+                item = reader.read()
+            if item is None:
+                break
+            frame_id, captured_at, frame = item
+
+            if tracked is not None:
+                with prof.stage("detect_or_track"):
+                    detections, detected = tracked.process(frame)
+                stats.inferences += detected
+                stats.skipped += not detected
+                with prof.stage("draw"):
+                    annotated_frame = draw_tracks(frame.copy(), detections)
+            else:
+                if last_result is None or len(stats.latencies) % skip == 0:
+                    with prof.stage("yolo"):
+                        last_result = model(frame, classes=[0], imgsz=imgsz, verbose=False)[0]
+                    stats.inferences += 1
+                else:
+                    stats.skipped += 1
+                # Boxes of the last inference are drawn on the current frame
+                with prof.stage("draw"):
+                    annotated_frame = last_result.plot(img=frame)
+
+            if output_path is not None:
+                with prof.stage("video_write"):
+                    if writer is None:
+                        h, w = annotated_frame.shape[:2]
+                        fps = reader.source_fps if reader.source_fps > 0 else 25
+                        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+                    writer.write(annotated_frame)
+            stats.latencies.append(time.perf_counter() - captured_at)
+            prof.end_frame(frame_id, latency=stats.latencies[-1])
+
+            if not headless:
+                cv2.imshow(WINDOW_NAME, annotated_frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+    finally:
+        reader.stop()
+        if writer is not None:
+            writer.release()
+        if not headless:
+            cv2.destroyAllWindows()
+    return stats.report(reader)
+
+# ---------------------- Main Loop ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time YOLOv8 pedestrian detection")
+    parser.add_argument("--source", default=VIDEO_SOURCE, help="Video file, RTSP URL or webcam index")
+    parser.add_argument("--realtime", action="store_true", help="Latest-frame mode with frame dropping")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--skip", type=int, default=SKIP)
+    parser.add_argument("--headless", action="store_true", help="Do not open a display window")
+    parser.add_argument("--output", default=None, help="Write the annotated stream to this video file")
+    parser.add_argument("--pace", action="store_true", help="Read video files at their native fps")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--track-every", type=int, default=None,
+                        help="Detect every K frames and propagate tracked boxes in between")
+    parser.add_argument("--backend", default="torch",
+                        choices=["torch", "onnx", "onnx-int8", "openvino", "openvino-int8"],
+                        help="Inference backend (exported on first use, see yolo_backends.py)")
+    parser.add_argument("--server", default=None, help="Use the model of a running detection_server.py")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    prof = profiling.from_args(args)
+    source = int(args.source) if str(args.source).isdigit() else args.source
 
-    # Exit on 'q' key press
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+    # Load YOLOv8 model
+    if args.server:
+        from detection_server import DetectionClient
+        model = DetectionClient(args.server)
+    elif args.backend == "torch":
+        from ultralytics import YOLO
+        model = YOLO(MODEL_PATH)  # COCO-pretrained model (detects 'person' class)
+    else:
+        from yolo_backends import load_backend
+        model = load_backend(args.backend, MODEL_PATH)
 
-# Release resources
-cap.release()
-cv2.destroyAllWindows()
+    with profiling.run_profiled(args.profile, args.profile_output):
+        if args.realtime:
+            report = run_realtime(model, source, args.imgsz, max(1, args.skip), args.headless,
+                                  args.output, args.pace, args.max_frames, args.track_every)
+            print("\n=== Real-time stats ===")
+            for key, value in report.items():
+                print(f"{key:<18} {value:.1f}" if isinstance(value, float) else f"{key:<18} {value}")
+        else:
+            run_serial(model, source)
+    prof.print_report()
+    prof.close(args.metrics_file, job="real_time_yolo")
@@ -0,0 +1,186 @@
+"""
+result_cache.py
+
+Content-addressed on-disk cache shared by the YOLO and LLaVA stages.
+Entries are keyed by the SHA-256 of the image bytes together with the model
+identifier and every parameter that affects the result (thresholds, prompt,
+generation options), so a rerun after a crash or a parameter change only
+recomputes frames whose key changed. The cache is bounded in size with
+least-recently-used eviction and keeps hit/miss statistics.
+"""
+
+import os
+import json
+import time
+import hashlib
+
+# ---------------------- Configuration ----------------------
+CACHE_DIR = "/home/serine/datos/newdataset/CACHE"
+MAX_CACHE_BYTES = 2 * 1024**3   # 2 GB shared results volume budget
+EVICTION_TARGET = 0.9           # Evict down to this fraction of the budget
+IDENTITY_BLOCK = 64 * 1024      # Bytes hashed at each end of a file by file_identity
+
+# ---------------------- Functions ----------------------
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a file's content, read in chunks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_identity(path, size=None):
+    """
+    Identity of the first `size` bytes of a file (all of it by default): the
+    size, the file's mtime and the SHA-256 of the first and last
+    IDENTITY_BLOCK bytes of that range (header and leading rows of a CSV).
+    """
+    st = os.stat(path)
+    size = st.st_size if size is None else size
+    with open(path, "rb") as f:
+        head = f.read(min(size, IDENTITY_BLOCK))
+        f.seek(max(0, size - IDENTITY_BLOCK))
+        tail = f.read(min(size, IDENTITY_BLOCK))
+    return {"size": size, "mtime": st.st_mtime,
+            "head": hashlib.sha256(head).hexdigest(), "tail": hashlib.sha256(tail).hexdigest()}
+
+def is_unchanged_or_appended(path, identity):
+    """
+    True when the file still starts with the bytes `identity` describes
+    (untouched, or only appended to since); False if it was rewritten,
+    truncated or removed, or when there is no identity.
+    """
+    if not identity:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size == identity["size"] and st.st_mtime == identity["mtime"]:
+        return True
+    if st.st_size < identity["size"]:
+        return False
+    current = file_identity(path, identity["size"])
+    return current["head"] == identity["head"] and current["tail"] == identity["tail"]
+
+def make_key(image_digest, model, params):
+    """
+    Combine the image digest, model identifier and result-affecting
+    parameters into a single cache key.
+    """
+    payload = json.dumps({"image": image_digest, "model": model, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ---------------------- Classes ----------------------
+class ResultCache:
+    """
+    JSON result cache stored as <cache_dir>/<namespace>/<key[:2]>/<key>.json.
+
+    Reads refresh the entry's mtime, which is used as the LRU clock when the
+    total size exceeds max_bytes.
+    """
+    def __init__(self, namespace, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.root = os.path.join(cache_dir, namespace)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+        self.size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cache entry."""
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # Evicted by another process
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        """
+        Return the cached result for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                result = json.load(f)["result"]
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, key, result, info=None):
+        """
+        Store result under key and evict old entries if over budget.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created": time.time(), "info": info, "result": result})
+
+        try:
+            previous = os.path.getsize(path)  # Replaced entry, no longer counted
+        except OSError:
+            previous = 0
+
+        # Atomic replace so concurrent readers never see a partial entry
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        size = os.path.getsize(tmp)  # Bytes on disk, not characters
+        os.replace(tmp, path)
+        self.writes += 1
+        self.size += size - previous
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least-recently-used entries until the cache is below
+        EVICTION_TARGET of its budget.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+        for path, size, _ in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "size_mb": self.size / 1024**2,
+        }
+
+    def print_stats(self):
+        s = self.stats()
+        print(f"Cache [{os.path.basename(self.root)}]: {s['hits']} hits, {s['misses']} misses "
+              f"({s['hit_rate']:.1%} hit rate), {s['writes']} writes, {s['evictions']} evictions, "
+              f"{s['size_mb']:.1f} MB")
@@ -0,0 +1,319 @@
+"""
+results_store.py
+
+Columnar results store replacing the millions of small per-frame JSON files
+and the hand-merged CSVs. Each stage has one Parquet table keyed by
+(dataset, frame):
+- yolo:         yolo_count, yolo_max_conf, yolo_decision, detections
+- llava:        llava_count, llava_confidence, llava_scene, pedestrians,
+                rejected_items, error, error_type (failed frames have
+                null counts)
+- yolo_raw:     confidence, bbox (every box down to RAW_CONF, no height
+                filter; input of threshold_sweep.py)
+- ground_truth: true_person_count, fake_person_count
+Writers buffer rows and flush them periodically as new part files, so
+appends never rewrite existing data; readers project only the columns they
+need and keep the latest row per key. The exporter reproduces the current
+yolo-results.csv, llava-results.csv and merged-results.csv schemas.
+"""
+
+import os
+import json
+import time
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ---------------------- Configuration ----------------------
+STORE_DIR = "/home/serine/datos/newdataset/RESULTS-STORE"
+FLUSH_ROWS = 5000       # Flush a part file after this many buffered rows
+FLUSH_SECONDS = 60.0    # ... or after this many seconds
+
+KEY = ["dataset", "frame"]
+SCHEMAS = {
+    "yolo": pa.schema([
+        ("dataset", pa.string()), ("frame", pa.string()),
+        ("yolo_count", pa.int32()), ("yolo_max_conf", pa.float64()), ("yolo_decision", pa.string()),
+        ("detections", pa.string()), ("_written", pa.float64()),
+    ]),
+    "llava": pa.schema([
+        ("dataset", pa.string()), ("frame", pa.string()),
+        ("llava_count", pa.int32()), ("llava_confidence", pa.float64()), ("llava_scene", pa.string()),
+        ("pedestrians", pa.string()), ("rejected_items", pa.string()), ("error", pa.string()),
+        ("error_type", pa.string()), ("_written", pa.float64()),
+    ]),
+    "yolo_raw": pa.schema([
+        ("dataset", pa.string()), ("frame", pa.string()),
+        ("confidence", pa.list_(pa.float32())), ("bbox", pa.list_(pa.list_(pa.int32()))),
+        ("_written", pa.float64()),
+    ]),
+    "ground_truth": pa.schema([
+        ("dataset", pa.string()), ("frame", pa.string()),
+        ("true_person_count", pa.int32()), ("fake_person_count", pa.int32()), ("_written", pa.float64()),
+    ]),
+}
+
+# Column order of the CSV files in results/
+CSV_COLUMNS = {
+    "yolo": ["dataset", "frame", "yolo_count", "yolo_max_conf", "yolo_decision"],
+    "llava": ["dataset", "frame", "llava_count", "llava_confidence", "llava_scene"],
+    "merged": ["frame", "true_person_count", "fake_person_count", "dataset_x", "yolo_count",
+               "yolo_max_conf", "yolo_decision", "dataset_y", "llava_count", "llava_confidence", "llava_scene"],
+}
+
+# ---------------------- Row builders ----------------------
+def yolo_row(dataset, frame_data):
+    """Store row for a YOLO frame_data dict (see run_yolo_detection.build_frame_data)."""
+    return {
+        "dataset": dataset,
+        "frame": frame_data["frame"],
+        "yolo_count": frame_data["human_count"],
+        "yolo_max_conf": frame_data["max_confidence"],
+        "yolo_decision": frame_data["decision"],
+        "detections": json.dumps(frame_data["detections"]),
+    }
+
+def raw_boxes_row(dataset, frame, boxes):
+    """Store row for the raw boxes of a frame (see run_yolo_detection.extract_raw_boxes)."""
+    return {
+        "dataset": dataset,
+        "frame": frame,
+        "confidence": [b["confidence"] for b in boxes],
+        "bbox": [b["bbox"] for b in boxes],
+    }
+
+def llava_row(dataset, frame, result):
+    """Store row for a LLaVA result dict (see llava_analysis.analyze_image)."""
+    return {
+        "dataset": dataset,
+        "frame": frame,
+        "llava_count": result.get("human_count"),
+        "llava_confidence": result.get("confidence"),
+        "llava_scene": result.get("scene_understanding"),
+        "pedestrians": json.dumps(result.get("pedestrians", [])),
+        "rejected_items": json.dumps(result.get("rejected_items", [])),
+        "error": result.get("error"),
+        "error_type": result.get("error_type"),
+    }
+
+# ---------------------- Classes ----------------------
+class StageWriter:
+    """
+    Buffered, append-only writer for one stage table. Rows are flushed as a
+    new Parquet part file every FLUSH_ROWS rows or FLUSH_SECONDS seconds,
+    and on close(). Safe to use as a context manager. `dataset` is only
+    carried along for callers that build rows (yolo_row, llava_row).
+    """
+    def __init__(self, root, stage, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS, dataset=None):
+        self.dir = os.path.join(root, stage)
+        self.dataset = dataset
+        self.schema = SCHEMAS[stage]
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows = []
+        self.parts = 0
+        self.last_flush = time.monotonic()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def write(self, row):
+        row["_written"] = time.time()
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.rows:
+            return
+        table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        name = f"part-{time.time_ns()}-{os.getpid()}-{self.parts:05d}.parquet"
+        # Write then rename so readers never see a partial part file
+        tmp = os.path.join(self.dir, f".{name}.tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, os.path.join(self.dir, name))
+        self.parts += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultsStore:
+    """
+    Directory of stage tables, each made of append-only Parquet part files.
+    """
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def writer(self, stage, **kwargs):
+        return StageWriter(self.root, stage, **kwargs)
+
+    def _parts(self, stage):
+        stage_dir = os.path.join(self.root, stage)
+        if not os.path.isdir(stage_dir):
+            return []
+        return sorted(os.path.join(stage_dir, f) for f in os.listdir(stage_dir) if f.endswith(".parquet"))
+
+    def read(self, stage, columns=None, datasets=None):
+        """
+        Load a stage table with only the requested columns (plus the key),
+        keeping the most recently written row for each (dataset, frame).
+        """
+        parts = self._parts(stage)
+        if not parts:
+            return pd.DataFrame(columns=[f.name for f in SCHEMAS[stage] if f.name != "_written"])
+        wanted = None
+        if columns is not None:
+            wanted = list(dict.fromkeys(KEY + list(columns) + ["_written"]))
+        filters = [("dataset", "in", list(datasets))] if datasets else None
+        df = pq.ParquetDataset(parts, filters=filters).read(columns=wanted).to_pandas()
+        df = df.sort_values("_written", kind="stable").drop_duplicates(KEY, keep="last")
+        return df.drop(columns="_written").sort_values(KEY).reset_index(drop=True)
+
+    def compact(self, stage):
+        """Rewrite a stage as a single deduplicated part file."""
+        old_parts = self._parts(stage)
+        if len(old_parts) <= 1:
+            return
+        df = self.read(stage)
+        with self.writer(stage, flush_rows=len(df) + 1) as w:
+            for row in df.to_dict("records"):
+                w.write(row)
+        for path in old_parts:
+            os.remove(path)
+
+    def merged(self, columns=None):
+        """
+        Join ground truth, YOLO and LLaVA on (dataset, frame).
+        Frames without a YOLO row (no detection) get yolo_count 0.
+        """
+        gt = self.read("ground_truth", columns and [c for c in columns if c in SCHEMAS["ground_truth"].names])
+        yolo = self.read("yolo", columns and [c for c in columns if c in SCHEMAS["yolo"].names])
+        llava = self.read("llava", columns and [c for c in columns if c in SCHEMAS["llava"].names])
+        df = gt.merge(yolo, on=KEY, how="left").merge(llava, on=KEY, how="inner")
+        if "yolo_count" in df:
+            df["yolo_count"] = df["yolo_count"].fillna(0).astype(int)
+        if "yolo_decision" in df:
+            df["yolo_decision"] = df["yolo_decision"].fillna("none")
+        return df
+
+    def export_csv(self, kind, path):
+        """
+        Write yolo-results.csv, llava-results.csv or merged-results.csv with
+        the exact column layout of the existing files.
+        """
+        if kind == "yolo":
+            df = self.read("yolo", CSV_COLUMNS["yolo"])
+            df = df[df["yolo_decision"] != "none"]
+        elif kind == "llava":
+            df = self.read("llava", CSV_COLUMNS["llava"])
+        else:
+            df = self.merged()
+            df["dataset_x"] = df["dataset"]
+            df["dataset_y"] = df["dataset"]
+        df[CSV_COLUMNS[kind]].to_csv(path, index=False)
+        return len(df)
+
+    # ---------------------- Importers ----------------------
+    def import_yolo_metadata(self, metadata_dir, dataset):
+        """Load a YOLO metadata/ folder of per-frame JSON files."""
+        with self.writer("yolo") as w:
+            for name in sorted(os.listdir(metadata_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(metadata_dir, name), "r") as f:
+                        w.write(yolo_row(dataset, json.load(f)))
+            return w.parts
+
+    def frame_names(self, dataset):
+        """Frame name of every frame of dataset in the YOLO and ground-truth stages, keyed by stem."""
+        names = {}
+        for stage in ("ground_truth", "yolo"):
+            for frame in self.read(stage, [], [dataset])["frame"]:
+                names[os.path.splitext(frame)[0]] = frame
+        return names
+
+    def import_llava_results(self, results_dir, dataset):
+        """
+        Load a LLaVA OUTPUT_DIR of per-frame JSON files. The JSON files are
+        named after the frame without its extension: the frame name is taken
+        from the result, else from the YOLO/ground-truth rows of the same
+        frame, so the rows join; ".jpg" is only assumed for unknown frames.
+        """
+        known = self.frame_names(dataset)
+        with self.writer("llava") as w:
+            for name in sorted(os.listdir(results_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(results_dir, name), "r") as f:
+                        result = json.load(f)
+                    stem = os.path.splitext(name)[0]
+                    frame = result.get("frame") or known.get(stem, f"{stem}.jpg")
+                    w.write(llava_row(dataset, frame, result))
+            return w.parts
+
+    def import_csv(self, merged_csv=None, yolo_csv=None, llava_csv=None):
+        """Load the existing result CSVs (ground truth comes from merged-results.csv)."""
+        if merged_csv:
+            df = pd.read_csv(merged_csv, usecols=["frame", "dataset_x", "true_person_count", "fake_person_count"])
+            with self.writer("ground_truth") as w:
+                for r in df.drop_duplicates(["dataset_x", "frame"]).itertuples(index=False):
+                    w.write({"dataset": r.dataset_x, "frame": r.frame,
+                             "true_person_count": r.true_person_count, "fake_person_count": r.fake_person_count})
+        if yolo_csv:
+            df = pd.read_csv(yolo_csv)
+            with self.writer("yolo") as w:
+                for r in df.itertuples(index=False):
+                    w.write({"dataset": r.dataset, "frame": r.frame, "yolo_count": r.yolo_count,
+                             "yolo_max_conf": r.yolo_max_conf, "yolo_decision": r.yolo_decision,
+                             "detections": None})
+        if llava_csv:
+            df = pd.read_csv(llava_csv)
+            with self.writer("llava") as w:
+                for r in df.itertuples(index=False):
+                    w.write({"dataset": r.dataset, "frame": r.frame, "llava_count": r.llava_count,
+                             "llava_confidence": r.llava_confidence,
+                             "llava_scene": None if pd.isna(r.llava_scene) else r.llava_scene})
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar (Parquet) results store")
+    parser.add_argument("--store", default=STORE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import-json", help="Import per-frame JSON outputs of one dataset")
+    imp.add_argument("--dataset", required=True)
+    imp.add_argument("--yolo-metadata", default=None)
+    imp.add_argument("--llava-results", default=None)
+
+    imc = sub.add_parser("import-csv", help="Import the existing result CSVs")
+    imc.add_argument("--merged-csv", default=None)
+    imc.add_argument("--yolo-csv", default=None)
+    imc.add_argument("--llava-csv", default=None)
+
+    exp = sub.add_parser("export", help="Export a table with the current CSV schema")
+    exp.add_argument("kind", choices=["yolo", "llava", "merged"])
+    exp.add_argument("output")
+
+    sub.add_parser("compact", help="Merge the part files of every stage")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "import-json":
+        if args.yolo_metadata:
+            store.import_yolo_metadata(args.yolo_metadata, args.dataset)
+        if args.llava_results:
+            store.import_llava_results(args.llava_results, args.dataset)
+    elif args.command == "import-csv":
+        store.import_csv(args.merged_csv, args.yolo_csv, args.llava_csv)
+    elif args.command == "export":
+        print(f"Exported {store.export_csv(args.kind, args.output)} rows to {args.output}")
+    else:
+        for stage in SCHEMAS:
+            store.compact(stage)
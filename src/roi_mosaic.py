@@ -0,0 +1,275 @@
+"""
+roi_mosaic.py
+
+Region-of-interest mode for LLaVA: instead of uploading the full-resolution
+frame, the YOLO boxes of a frame (by default only the low-confidence
+"ambiguous" ones) are cut out with padding, tiled into one downscaled,
+numbered mosaic and sent with a per-tile prompt. Each tile answer is mapped
+back to its YOLO detection, giving a per-box verdict instead of a
+whole-frame count, with much smaller request bodies.
+"""
+
+import os
+import re
+import json
+import math
+import base64
+import asyncio
+import argparse
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from run_yolo_detection import CONF_LOW, CONF_HIGH
+from llava_analysis import build_payload, error_result, error_type_of
+from llava_schema import MalformedJSONError, SchemaError
+
+# ---------------------- Configuration ----------------------
+PADDING = 0.2        # Extra context around each box, as a fraction of its size
+MOSAIC_SIZE = 672    # Longest side of the mosaic sent to LLaVA
+MIN_TILE = 112       # Smallest tile side; fewer columns are used below this
+MAX_TILES = 16       # Most uncertain boxes first when a frame has more
+JPEG_QUALITY = 85
+
+TILE_PROMPT = """This image is a grid of {n} numbered tiles ({cols} per row, numbered left to right, top to bottom).
+        Each tile is a crop around one candidate found by a pedestrian detector.
+        For EACH tile decide whether it shows a real pedestrian.
+        Reject mannequins/statues, posters with human images, reflections and vehicle parts that resemble humans.
+
+        RESPONSE FORMAT (JSON):
+        {{
+            "tiles": [
+                {{
+                    "tile": integer,
+                    "is_pedestrian": true/false,
+                    "type": "string (e.g., 'adult walking', 'mannequin', 'reflection')",
+                    "confidence": 0-1
+                }}
+            ]
+        }}"""
+# Tile count of a TILE_PROMPT (read back by ollama_stub.py to answer per tile)
+TILE_COUNT = re.compile(r"grid of (\d+) numbered tiles")
+
+# ---------------------- Functions ----------------------
+def select_boxes(frame_data, all_boxes=False):
+    """
+    Detections to verify with LLaVA: the in-band (ambiguous) boxes, or every
+    box with all_boxes=True. Lowest confidence first, at most MAX_TILES.
+    """
+    detections = frame_data.get("detections", [])
+    if not all_boxes:
+        detections = [d for d in detections if CONF_LOW <= d["confidence"] < CONF_HIGH]
+    return sorted(detections, key=lambda d: d["confidence"])[:MAX_TILES]
+
+def crop_box(img, bbox, padding=PADDING):
+    """
+    Crop a bounding box with relative padding, clamped to the image.
+    """
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = bbox
+    pad_x, pad_y = int((x2 - x1) * padding), int((y2 - y1) * padding)
+    return img[max(0, y1 - pad_y):min(h, y2 + pad_y), max(0, x1 - pad_x):min(w, x2 + pad_x)]
+
+def build_mosaic(img, boxes, mosaic_size=MOSAIC_SIZE):
+    """
+    Tile the padded crops into a square-ish grid of numbered tiles.
+    Returns (mosaic, cols).
+    """
+    n = len(boxes)
+    cols = math.ceil(math.sqrt(n))
+    while cols > 1 and mosaic_size // cols < MIN_TILE:
+        cols -= 1
+    rows = math.ceil(n / cols)
+    tile = mosaic_size // cols
+    mosaic = np.zeros((rows * tile, cols * tile, 3), dtype=np.uint8)
+
+    for i, det in enumerate(boxes):
+        crop = crop_box(img, det["bbox"])
+        if crop.size == 0:
+            continue
+        # Fit the crop inside the tile, keeping its aspect ratio
+        scale = tile / max(crop.shape[:2])
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+        r, c = divmod(i, cols)
+        y0 = r * tile + (tile - crop.shape[0]) // 2
+        x0 = c * tile + (tile - crop.shape[1]) // 2
+        mosaic[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]] = crop
+
+        # Tile number in the top-left corner
+        label = str(i + 1)
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+        cv2.rectangle(mosaic, (c * tile, r * tile), (c * tile + tw + 8, r * tile + th + 10), (0, 0, 0), -1)
+        cv2.putText(mosaic, label, (c * tile + 4, r * tile + th + 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+    return mosaic, cols
+
+def encode_mosaic(mosaic):
+    """JPEG-encode the mosaic and return it base64-encoded."""
+    ok, buf = cv2.imencode(".jpg", mosaic, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode mosaic")
+    return base64.b64encode(buf.tobytes()).decode("utf-8")
+
+def tile_flag(value):
+    """is_pedestrian of a tile answer: a JSON boolean or "true"/"false"; raises SchemaError otherwise."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    raise SchemaError(f"is_pedestrian must be a boolean, got {value!r}")
+
+def tile_confidence(value):
+    """Confidence of a tile answer clamped to [0, 1]; 0.0 when missing or not a number."""
+    if isinstance(value, bool):
+        return 0.0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, min(1.0, value)) if value == value else 0.0  # NaN -> 0.0
+
+def map_verdicts(frame_data, boxes, answer):
+    """
+    Map per-tile answers back to the YOLO detections. Confident boxes that
+    were not sent keep their YOLO verdict. Returns the frame result.
+    Raises SchemaError when the answer has no usable tile verdicts or a
+    tile's is_pedestrian is not a boolean.
+    """
+    tiles = {}
+    answer_tiles = answer.get("tiles", []) if isinstance(answer, dict) else []
+    for t in answer_tiles if isinstance(answer_tiles, list) else []:
+        if not isinstance(t, dict):
+            continue
+        try:
+            tiles[int(t["tile"])] = t
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    sent = {id(det): i + 1 for i, det in enumerate(boxes)}
+    box_verdicts, rejected = [], []
+    for det in frame_data.get("detections", []):
+        verdict = {"bbox": det["bbox"], "yolo_confidence": det["confidence"]}
+        tile_no = sent.get(id(det))
+        if tile_no is None:
+            verdict.update({"tile": None, "verified": False, "is_pedestrian": det["confidence"] >= CONF_HIGH})
+        else:
+            t = tiles.get(tile_no, {})
+            verdict.update({
+                "tile": tile_no,
+                "verified": tile_no in tiles,
+                "is_pedestrian": tile_flag(t["is_pedestrian"]) if "is_pedestrian" in t else False,
+                "type": str(t.get("type", "")),
+                "llava_confidence": tile_confidence(t.get("confidence")),
+            })
+            if tile_no in tiles and not verdict["is_pedestrian"]:
+                rejected.append({"type": verdict["type"], "reason": f"ROI tile {tile_no} rejected",
+                                 "confidence": verdict["llava_confidence"]})
+        box_verdicts.append(verdict)
+
+    result = {
+        "frame": frame_data["frame"],
+        "mode": "roi_mosaic",
+        "human_count": sum(v["is_pedestrian"] for v in box_verdicts),
+        "box_verdicts": box_verdicts,
+        "rejected_items": rejected,
+    }
+    if boxes and not tiles:
+        raise SchemaError("No tile verdicts in LLaVA answer")
+    return result
+
+def tile_count(prompt):
+    """Number of tiles a TILE_PROMPT asks about, or None for any other prompt."""
+    match = TILE_COUNT.search(prompt or "")
+    return int(match.group(1)) if match else None
+
+def prepare_request(frame_path, frame_data, all_boxes=False):
+    """
+    Build the mosaic request for a frame.
+    Returns (boxes, b64_mosaic, prompt) or None when there is nothing to verify.
+    """
+    boxes = select_boxes(frame_data, all_boxes)
+    if not boxes:
+        return None
+    img = cv2.imread(frame_path)
+    if img is None:
+        return None
+    mosaic, cols = build_mosaic(img, boxes)
+    return boxes, encode_mosaic(mosaic), TILE_PROMPT.format(n=len(boxes), cols=cols)
+
+async def analyze_frames_roi(frame_paths, metadata, output_dir, client, all_boxes=False):
+    """
+    Send one mosaic per frame through the async LLaVA client and write one
+    JSON result per frame. Returns payload statistics.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stats = {"frames": 0, "boxes": 0, "mosaic_bytes": 0, "full_frame_bytes": 0}
+    progress = tqdm(total=len(frame_paths), desc="ROI mosaics")
+    pending = asyncio.Queue()
+    for p in frame_paths:
+        pending.put_nowait(p)
+
+    async def handle(frame_path):
+        frame = os.path.basename(frame_path)
+        frame_data = metadata.get(frame)
+        request = await asyncio.to_thread(prepare_request, frame_path, frame_data, all_boxes) if frame_data else None
+        if request is None:
+            return
+        boxes, b64_mosaic, prompt = request
+        try:
+            body = await client.generate(build_payload(b64_mosaic, prompt))
+            try:
+                answer = json.loads(body.get("response", ""))
+            except ValueError as e:
+                raise MalformedJSONError(f"Invalid JSON: {e}") from e
+            result = map_verdicts(frame_data, boxes, answer)
+        except Exception as e:
+            # A failed or malformed answer only fails this frame
+            client.stats.fail(error_type_of(e))
+            result = dict(error_result(str(e), error_type_of(e)), frame=frame, mode="roi_mosaic", box_verdicts=[])
+
+        stats["frames"] += 1
+        stats["boxes"] += len(boxes)
+        stats["mosaic_bytes"] += len(b64_mosaic)
+        stats["full_frame_bytes"] += math.ceil(os.path.getsize(frame_path) / 3) * 4
+        with open(os.path.join(output_dir, f"{os.path.splitext(frame)[0]}.json"), "w") as f:
+            json.dump(result, f, indent=2)
+
+    async def worker():
+        while not pending.empty():
+            await handle(pending.get_nowait())
+            progress.update(1)
+
+    async with client:
+        await asyncio.gather(*(worker() for _ in range(client.max_concurrency)))
+    progress.close()
+    return stats
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    from llava_analysis import FRAMES_DIR, OUTPUT_DIR, OLLAMA_URL
+    from llava_client import AsyncLlavaClient, MAX_CONCURRENCY, print_report
+    from llava_routing import load_yolo_metadata, YOLO_METADATA_DIR
+
+    parser = argparse.ArgumentParser(description="Per-box LLaVA verdicts from YOLO region-of-interest mosaics")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--yolo-metadata", default=YOLO_METADATA_DIR)
+    parser.add_argument("--output-dir", default=f"{OUTPUT_DIR}-roi")
+    parser.add_argument("--url", default=OLLAMA_URL)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--all-boxes", action="store_true", help="Verify every box, not only ambiguous ones")
+    args = parser.parse_args()
+
+    metadata = load_yolo_metadata(args.yolo_metadata)
+    frames = sorted(f for f in os.listdir(args.frames_dir) if f in metadata)
+    client = AsyncLlavaClient(args.url, max_concurrency=args.max_concurrency)
+    stats = asyncio.run(analyze_frames_roi([os.path.join(args.frames_dir, f) for f in frames],
+                                           metadata, args.output_dir, client, args.all_boxes))
+    print_report(client.stats.report(), client.limiter)
+
+    if stats["frames"]:
+        print(f"\n{stats['frames']} frames, {stats['boxes']} boxes verified")
+        print(f"Request images: {stats['mosaic_bytes'] / 1024**2:.1f} MB as mosaics vs "
+              f"{stats['full_frame_bytes'] / 1024**2:.1f} MB as full frames "
+              f"({stats['mosaic_bytes'] / stats['full_frame_bytes']:.1%})")
@@ -5,76 +5,84 @@ Processes extracted video frames using YOLOv8 for pedestrian detection.
 Generates:
 - Annotated frames for high-confidence and ambiguous detections
 - Metadata JSON files for each frame
+
+ultralytics is only imported when the model is first needed; with --server
+the frames go to a running detection_server.py instead and the model is
+never loaded here.
 """
 
 import os
 import cv2
 import json
-from ultralytics import YOLO
+import argparse
 from tqdm import tqdm
 
+import profiling
+from annotation_renderer import draw_detections
+from result_cache import ResultCache, file_digest, make_key
+
 # ---------------------- Configuration ----------------------
 FRAMES_DIR = "/home/serine/datos/newdataset/Frames-extracted/week30"
 OUTPUT_DIR = "/home/serine/datos/newdataset/YOLO-RESULTS/week30"
 
-# Create output directories
-os.makedirs(f"{OUTPUT_DIR}/detected_persons", exist_ok=True)
-os.makedirs(f"{OUTPUT_DIR}/ambiguous", exist_ok=True)
-os.makedirs(f"{OUTPUT_DIR}/metadata", exist_ok=True)
-
-# Load YOLOv8 model
-model = YOLO("yolov8m.pt")
+MODEL_PATH = "yolov8m.pt"
+BACKEND = "torch"  # Or onnx, onnx-int8, openvino, openvino-int8 (see yolo_backends.py)
+SERVER = None  # Socket of a running detection_server.py, used instead of a local model
+USE_CACHE = True  # Skip frames whose image, model and thresholds are unchanged
 
 # Detection thresholds
 CONF_HIGH = 0.6  # High confidence threshold for clear detections
 CONF_LOW = 0.4   # Low confidence threshold for ambiguous cases
 MIN_HEIGHT = 80  # Minimum pixel height for valid detection
+RAW_CONF = 0.05  # Raw boxes kept down to this confidence for threshold_sweep.py
+
+# Output subfolder and box colour for each frame decision
+CATEGORY_OUTPUTS = {
+    "person": ("detected_persons", (0, 255, 0)),  # Green
+    "ambiguous": ("ambiguous", (0, 255, 255)),    # Yellow
+}
+
+_model = None
 
 # ---------------------- Functions ----------------------
-def draw_boxes(image, detections, color):
+def create_output_dirs(output_dir=OUTPUT_DIR):
     """
-    Draw bounding boxes with confidence labels on the image.
+    Create the detected_persons, ambiguous and metadata output folders.
     """
-    annotated = image.copy()
-    for det in detections:
-        x1, y1, x2, y2 = det["bbox"]
-        conf = det["confidence"]
-        
-        # Draw rectangle
-        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
-        
-        # Draw label background
-        label = f"person: {conf:.2f}"
-        (w, h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
-        cv2.rectangle(annotated, (x1, y1 - h - 10), (x1 + w, y1), color, -1)
-        
-        # Draw label text
-        cv2.putText(annotated, label, (x1, y1 - 5), 
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-    return annotated
-
-def process_frame(frame_path):
+    os.makedirs(f"{output_dir}/detected_persons", exist_ok=True)
+    os.makedirs(f"{output_dir}/ambiguous", exist_ok=True)
+    os.makedirs(f"{output_dir}/metadata", exist_ok=True)
+
+def load_model():
     """
-    Process a single frame: detect pedestrians, categorize detections, 
-    save annotated images and metadata.
+    Load the YOLOv8 model once and reuse it for every subsequent call
+    (or connect to the detection server once, with SERVER set).
     """
-    img = cv2.imread(frame_path)
-    if img is None:
-        return None
-    
-    frame_name = os.path.basename(frame_path)
-    frame_data = {
-        "frame": frame_name,
-        "detections": [],
-        "human_count": 0,
-        "decision": "none",
-        "max_confidence": 0.0
-    }
+    global _model
+    if _model is None:
+        if SERVER is not None:
+            from detection_server import DetectionClient
+            _model = DetectionClient(SERVER)
+        elif BACKEND == "torch":
+            from ultralytics import YOLO
+            _model = YOLO(MODEL_PATH)
+        else:
+            from yolo_backends import load_backend
+            _model = load_backend(BACKEND, MODEL_PATH)
+    return _model
 
-    # Run detection with low confidence threshold
-    results = model(img, conf=CONF_LOW, classes=[0])  # Only detect persons
-    
-    # Process detections with size filtering
+def draw_boxes(image, detections, color):
+    """
+    Draw bounding boxes with confidence labels on the image, in place
+    (see annotation_renderer.py).
+    """
+    return draw_detections(image, detections, color)
+
+def extract_detections(results):
+    """
+    Convert YOLO results into detection dicts, dropping boxes below MIN_HEIGHT.
+    """
+    detections = []
     for r in results:
         for box in r.boxes:
             conf = float(box.conf[0])
@@ -84,44 +92,194 @@ def process_frame(frame_path):
             if height < MIN_HEIGHT:
                 continue
                 
-            detection = {
+            detections.append({
                 "bbox": [x1, y1, x2, y2],
                 "confidence": conf
-            }
-            frame_data["detections"].append(detection)
-            frame_data["max_confidence"] = max(frame_data["max_confidence"], conf)
+            })
+    return detections
+
+def extract_raw_boxes(results):
+    """
+    Convert YOLO results into detection dicts without any height filter,
+    so thresholds can be re-applied later (see filter_boxes).
+    """
+    return [
+        {"bbox": list(map(int, box.xyxy[0].tolist())), "confidence": float(box.conf[0])}
+        for r in results for box in r.boxes
+    ]
+
+def filter_boxes(boxes, conf_low=CONF_LOW, min_height=MIN_HEIGHT):
+    """
+    Apply the confidence and height thresholds to raw boxes; with the
+    default thresholds this gives the same list as extract_detections.
+    """
+    return [b for b in boxes if b["confidence"] >= conf_low and b["bbox"][3] - b["bbox"][1] >= min_height]
+
+def build_frame_data(frame_name, detections):
+    """
+    Build the per-frame metadata and decide the frame category
+    ("person", "ambiguous" or "none") from the filtered detections.
+    """
+    frame_data = {
+        "frame": frame_name,
+        "detections": detections,
+        "human_count": 0,
+        "decision": "none",
+        "max_confidence": 0.0
+    }
+    for det in detections:
+        frame_data["max_confidence"] = max(frame_data["max_confidence"], det["confidence"])
 
     # Categorize frame based on detections
-    high_conf_detections = [d for d in frame_data["detections"] if d["confidence"] >= CONF_HIGH]
-    low_conf_detections = [d for d in frame_data["detections"] if CONF_LOW <= d["confidence"] < CONF_HIGH]
+    high_conf_detections = [d for d in detections if d["confidence"] >= CONF_HIGH]
+    low_conf_detections = [d for d in detections if CONF_LOW <= d["confidence"] < CONF_HIGH]
     
     frame_data["human_count"] = len(high_conf_detections)
     
-    # Decide frame category and save annotated image
     if high_conf_detections:
         frame_data["decision"] = "person"
-        output_subdir = "detected_persons"
-        annotated_img = draw_boxes(img, high_conf_detections, (0, 255, 0))  # Green
     elif low_conf_detections:
         frame_data["decision"] = "ambiguous"
-        output_subdir = "ambiguous"
-        annotated_img = draw_boxes(img, low_conf_detections, (0, 255, 255))  # Yellow
+    return frame_data
+
+def decision_boxes(frame_data):
+    """
+    The detections that justify the frame decision, and their colour:
+    high-confidence boxes in green for "person" frames, low-confidence boxes
+    in yellow for "ambiguous" frames.
+    """
+    _, color = CATEGORY_OUTPUTS[frame_data["decision"]]
+    if frame_data["decision"] == "person":
+        boxes = [d for d in frame_data["detections"] if d["confidence"] >= CONF_HIGH]
     else:
-        return None  # Skip frames with no detections
+        boxes = [d for d in frame_data["detections"] if CONF_LOW <= d["confidence"] < CONF_HIGH]
+    return boxes, color
+
+def annotate_frame(img, frame_data):
+    """
+    Draw the boxes of decision_boxes on img, in place.
+    """
+    boxes, color = decision_boxes(frame_data)
+    return draw_boxes(img, boxes, color)
+
+def save_frame_outputs(annotated_img, frame_data, output_dir=OUTPUT_DIR, save_metadata=True):
+    """
+    Save the annotated image in its category folder and the metadata JSON
+    (skipped with save_metadata=False when results go to results_store.py).
+    """
+    output_subdir, _ = CATEGORY_OUTPUTS[frame_data["decision"]]
+    frame_name = frame_data["frame"]
 
     # Save visual output
-    cv2.imwrite(f"{OUTPUT_DIR}/{output_subdir}/{frame_name}", annotated_img)
+    with profiling.PROFILER.stage("imwrite"):
+        cv2.imwrite(f"{output_dir}/{output_subdir}/{frame_name}", annotated_img)
     
     # Save metadata
-    with open(f"{OUTPUT_DIR}/metadata/{os.path.splitext(frame_name)[0]}.json", "w") as f:
-        json.dump(frame_data, f, indent=2)
-    
+    if not save_metadata:
+        return
+    with profiling.PROFILER.stage("json_write"):
+        with open(f"{output_dir}/metadata/{os.path.splitext(frame_name)[0]}.json", "w") as f:
+            json.dump(frame_data, f, indent=2)
+
+def result_params():
+    """
+    (model, thresholds) that determine a frame's detections; the model
+    includes the backend.
+    """
+    params = {"conf_low": CONF_LOW, "conf_high": CONF_HIGH, "min_height": MIN_HEIGHT}
+    backend = load_model().info["backend"] if SERVER is not None else BACKEND
+    model = MODEL_PATH if backend == "torch" else f"{MODEL_PATH}:{backend}"
+    return model, params
+
+def cache_key(frame_path):
+    """
+    Cache key of a frame: image content, model and detection thresholds.
+    """
+    model, params = result_params()
+    return make_key(file_digest(frame_path), model, params)
+
+def outputs_up_to_date(frame_data, output_dir=OUTPUT_DIR):
+    """
+    Check whether the metadata JSON on disk already matches frame_data.
+    """
+    metadata_path = f"{output_dir}/metadata/{os.path.splitext(frame_data['frame'])[0]}.json"
+    try:
+        with open(metadata_path, "r") as f:
+            return json.load(f) == frame_data
+    except (OSError, ValueError):
+        return False
+
+def process_frame(frame_path, output_dir=OUTPUT_DIR, cache=None):
+    """
+    Process a single frame: detect pedestrians, categorize detections, 
+    save annotated images and metadata.
+    """
+    frame_name = os.path.basename(frame_path)
+    prof = profiling.PROFILER
+
+    # Reuse the cached result when image, model and thresholds are unchanged
+    with prof.stage("cache_lookup"):
+        key = cache_key(frame_path) if cache is not None else None
+        frame_data = cache.get(key) if cache is not None else None
+        if frame_data is not None:
+            frame_data["frame"] = frame_name
+            if frame_data["decision"] == "none":
+                return None
+            if outputs_up_to_date(frame_data, output_dir):
+                return frame_data
+
+    with prof.stage("decode"):
+        img = cv2.imread(frame_path)
+    if img is None:
+        return None
+
+    if frame_data is None:
+        # Run detection with low confidence threshold
+        with prof.stage("yolo"):
+            results = load_model()(img, conf=CONF_LOW, classes=[0])  # Only detect persons
+        if prof.enabled:
+            # Ultralytics' own breakdown of the call above, in milliseconds
+            for name, ms in getattr(results[0], "speed", {}).items():
+                prof.add(f"yolo_{name}", (ms or 0.0) / 1000)
+        with prof.stage("build_frame_data"):
+            frame_data = build_frame_data(frame_name, extract_detections(results))
+        if cache is not None:
+            cache.put(key, frame_data, {"frame": frame_name})
+
+    if frame_data["decision"] == "none":
+        return None  # Skip frames with no detections
+
+    with prof.stage("draw_boxes"):
+        annotated = annotate_frame(img, frame_data)
+    save_frame_outputs(annotated, frame_data, output_dir)
     return frame_data
 
 # ---------------------- Main Execution ----------------------
 if __name__ == "__main__":
-    frame_files = [f for f in os.listdir(FRAMES_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    for frame_file in tqdm(frame_files, desc="Processing frames"):
-        process_frame(f"{FRAMES_DIR}/{frame_file}")
+    parser = argparse.ArgumentParser(description="YOLOv8 pedestrian detection on extracted frames")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--backend", default=BACKEND,
+                        choices=["torch", "onnx", "onnx-int8", "openvino", "openvino-int8"],
+                        help="Inference backend (exported on first use, see yolo_backends.py)")
+    parser.add_argument("--server", default=None, help="Use the model of a running detection_server.py")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    BACKEND = args.backend
+    SERVER = args.server
+    prof = profiling.from_args(args)
+
+    create_output_dirs(args.output_dir)
+    cache = ResultCache("yolo") if USE_CACHE else None
+    frame_files = [f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    with profiling.run_profiled(args.profile, args.profile_output):
+        for frame_file in tqdm(frame_files, desc="Processing frames"):
+            frame_data = process_frame(f"{args.frames_dir}/{frame_file}", args.output_dir, cache=cache)
+            prof.end_frame(frame_file, decision=frame_data["decision"] if frame_data else "none")
+
+    if cache is not None:
+        cache.print_stats()
+    prof.print_report()
+    prof.close(args.metrics_file, job="run_yolo_detection")
 
-    print(f"\nProcessing complete. Results saved to: {OUTPUT_DIR}")
+    print(f"\nProcessing complete. Results saved to: {args.output_dir}")
@@ -0,0 +1,192 @@
+"""
+threshold_sweep.py
+
+Evaluates CONF_HIGH / CONF_LOW / MIN_HEIGHT combinations without rerunning
+YOLO. Detection stores every raw box once (yolo_pipeline.py --store DIR
+--raw-boxes, confidence down to RAW_CONF and no height filter); this tool
+re-applies the person/ambiguous/none decision and human_count of
+run_yolo_detection.build_frame_data for a whole grid of thresholds,
+entirely in NumPy, and scores every setting against the ground-truth counts.
+
+For each MIN_HEIGHT, per-frame box counts above every confidence threshold
+are built once with a single bincount, so each extra threshold costs one
+column of a cumulative sum rather than a pass over the boxes.
+
+Outputs:
+- sweep_results.csv:    metrics of every (conf_high, conf_low, min_height)
+- operating_points.csv: current setting, best F1 and best precision at
+                        a minimum recall
+- pr_curves.png:        precision/recall over conf_high, one curve per MIN_HEIGHT
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from run_yolo_detection import CONF_HIGH, CONF_LOW, MIN_HEIGHT, RAW_CONF
+from results_store import ResultsStore, STORE_DIR, KEY
+
+# ---------------------- Configuration ----------------------
+CONF_GRID = np.round(np.arange(0.10, 0.951, 0.05), 2)   # Candidate CONF_HIGH / CONF_LOW values
+HEIGHT_GRID = [0, 40, 60, 80, 100, 120, 160]             # Candidate MIN_HEIGHT values
+MIN_RECALL = 0.95       # Recall floor of the "best precision" operating point
+OUTPUT_DIR = "threshold_sweep"
+
+# ---------------------- Classes ----------------------
+class RawBoxes:
+    """
+    Flat arrays of every raw box (confidence, height, owning frame index)
+    plus the (dataset, frame) key of each frame, including frames with no box.
+    """
+    def __init__(self, frames, confidence, height, frame_idx):
+        self.frames = frames
+        self.confidence = confidence
+        self.height = height
+        self.frame_idx = frame_idx
+
+    @classmethod
+    def from_store(cls, store, datasets=None):
+        parts = store._parts("yolo_raw")
+        if not parts:
+            raise FileNotFoundError(f"No yolo_raw table in {store.root}; run yolo_pipeline.py --raw-boxes first")
+        filters = [("dataset", "in", list(datasets))] if datasets else None
+        table = pq.ParquetDataset(parts, filters=filters).read()
+
+        # Keep the latest row of each frame, like ResultsStore.read
+        keys = table.select(KEY + ["_written"]).to_pandas()
+        keep = keys.sort_values("_written", kind="stable").drop_duplicates(KEY, keep="last").index.sort_values()
+        table = table.take(keep.to_numpy())
+
+        n_boxes = pc.list_value_length(table["confidence"]).fill_null(0).to_numpy()
+        confidence = pc.list_flatten(table["confidence"]).to_numpy(zero_copy_only=False)
+        bbox = pc.list_flatten(pc.list_flatten(table["bbox"])).to_numpy(zero_copy_only=False).reshape(-1, 4)
+        frames = table.select(KEY).to_pandas()
+        return cls(frames, confidence.astype(np.float32), bbox[:, 3] - bbox[:, 1],
+                   np.repeat(np.arange(len(frames)), n_boxes))
+
+    def counts_above(self, thresholds, min_height):
+        """
+        Matrix [frame, t]: number of boxes with height >= min_height and
+        confidence >= thresholds[t]. thresholds must be sorted ascending.
+        """
+        valid = self.height >= min_height
+        # Bin of a box = how many thresholds it reaches
+        level = np.searchsorted(thresholds, self.confidence[valid], side="right")
+        n_levels = len(thresholds) + 1
+        hist = np.bincount(self.frame_idx[valid] * n_levels + level,
+                           minlength=len(self.frames) * n_levels).reshape(len(self.frames), n_levels)
+        # counts[:, t] = boxes reaching at least threshold t
+        return np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+# ---------------------- Functions ----------------------
+def load_ground_truth(store=None, merged_csv=None):
+    """(dataset, frame, true_person_count), from the store or merged-results.csv."""
+    if merged_csv is not None:
+        gt = pd.read_csv(merged_csv, usecols=["dataset_x", "frame", "true_person_count"])
+        return gt.rename(columns={"dataset_x": "dataset"}).drop_duplicates(KEY)
+    return store.read("ground_truth", ["true_person_count"])
+
+def sweep(raw, gt, conf_grid=CONF_GRID, height_grid=HEIGHT_GRID):
+    """
+    Score every (conf_high, conf_low <= conf_high, min_height) setting.
+    A frame is predicted to contain a person when human_count > 0, i.e. it
+    has a box with confidence >= conf_high, exactly as build_frame_data.
+    """
+    conf_grid = np.unique(np.asarray(conf_grid, dtype=np.float32))
+    if conf_grid[0] < RAW_CONF:
+        raise ValueError(f"Thresholds below RAW_CONF={RAW_CONF} were not stored")
+    labelled = raw.frames.reset_index().merge(gt, on=KEY, how="inner")
+    rows = labelled["index"].to_numpy()
+    true_count = labelled["true_person_count"].to_numpy(dtype=np.int64)
+    gt_person = true_count > 0
+
+    results = []
+    for min_height in height_grid:
+        counts = raw.counts_above(conf_grid, min_height)[rows]    # [frame, t]
+        person = counts > 0
+        tp = np.count_nonzero(person & gt_person[:, None], axis=0)
+        fp = np.count_nonzero(person & ~gt_person[:, None], axis=0)
+        fn = np.count_nonzero(~person & gt_person[:, None], axis=0)
+        diff = counts - true_count[:, None]
+        mae = np.abs(diff).mean(axis=0)
+        exact = (diff == 0).mean(axis=0)
+
+        for hi, conf_high in enumerate(conf_grid):
+            precision = tp[hi] / (tp[hi] + fp[hi]) if tp[hi] + fp[hi] else 0.0
+            recall = tp[hi] / (tp[hi] + fn[hi]) if tp[hi] + fn[hi] else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            # Ambiguous frames: no box >= conf_high but one in [conf_low, conf_high)
+            ambiguous = (counts[:, :hi + 1] > 0) & ~person[:, [hi]]
+            for li in range(hi + 1):
+                results.append({
+                    "conf_high": round(float(conf_high), 4), "conf_low": round(float(conf_grid[li]), 4),
+                    "min_height": min_height,
+                    "precision": precision, "recall": recall, "f1": f1,
+                    "accuracy": (len(rows) - fp[hi] - fn[hi]) / max(len(rows), 1),
+                    "count_mae": mae[hi], "count_exact": exact[hi],
+                    "ambiguous_rate": ambiguous[:, li].mean() if len(rows) else 0.0,
+                    "frames": len(rows),
+                })
+    return pd.DataFrame(results)
+
+def operating_points(df, min_recall=MIN_RECALL):
+    """Current thresholds, best F1 and best precision with recall >= min_recall."""
+    current = df[np.isclose(df["conf_high"], CONF_HIGH) & np.isclose(df["conf_low"], CONF_LOW)
+                 & (df["min_height"] == MIN_HEIGHT)]
+    points = [("current", current.head(1)),
+              ("best_f1", df.nlargest(1, "f1")),
+              (f"best_precision_recall>={min_recall}", df[df["recall"] >= min_recall].nlargest(1, "precision"))]
+    return pd.concat([p.assign(point=name) for name, p in points if len(p)], ignore_index=True)
+
+def plot_pr_curves(df, path):
+    """Precision vs recall over conf_high, one curve per MIN_HEIGHT."""
+    import matplotlib.pyplot as plt
+
+    curves = df.drop_duplicates(["conf_high", "min_height"])
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for min_height, curve in curves.groupby("min_height"):
+        curve = curve.sort_values("conf_high")
+        ax.plot(curve["recall"], curve["precision"], marker=".", label=f"MIN_HEIGHT={min_height}")
+    ax.set_xlabel("Recall")
+    ax.set_ylabel("Precision")
+    ax.set_title("YOLO frame-level PR curves (sweeping CONF_HIGH)")
+    ax.legend()
+    ax.grid(alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep YOLO thresholds over stored raw boxes")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--merged-csv", default=None,
+                        help="Take ground truth from merged-results.csv instead of the store")
+    parser.add_argument("--datasets", nargs="*", default=None)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--min-recall", type=float, default=MIN_RECALL)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    raw = RawBoxes.from_store(store, args.datasets)
+    gt = load_ground_truth(store, args.merged_csv)
+
+    start = time.perf_counter()
+    df = sweep(raw, gt)
+    elapsed = time.perf_counter() - start
+    settings = len(df)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    df.to_csv(os.path.join(args.output_dir, "sweep_results.csv"), index=False)
+    points = operating_points(df, args.min_recall)
+    points.to_csv(os.path.join(args.output_dir, "operating_points.csv"), index=False)
+    plot_pr_curves(df, os.path.join(args.output_dir, "pr_curves.png"))
+
+    print(f"Evaluated {settings} settings on {df['frames'].iloc[0] if settings else 0} frames "
+          f"({len(raw.confidence)} raw boxes) in {elapsed:.2f} s")
+    print(points[["point", "conf_high", "conf_low", "min_height", "precision", "recall", "f1", "ambiguous_rate"]])
@@ -0,0 +1,268 @@
+"""
+tiled_inference.py
+
+Tiled, multi-scale detection of small, distant pedestrians. Upscaling the
+whole frame to find them would multiply the cost of yolov8m by the square
+of the scale. This mode keeps the normal full-frame pass and adds
+high-resolution tiles only where distant pedestrians are expected:
+- a horizon band (HORIZON_BAND, as fractions of the frame height)
+- areas around the previous frame's detections
+Tiles are cut at `scale` times the source resolution (each tile covers
+TILE_IMGSZ / scale source pixels) with OVERLAP between neighbours, and all
+tiles of a frame go through the model in one batched call. Tile boxes are
+mapped back to frame coordinates and merged with the full-frame boxes by
+class-agnostic NMS. Boxes cut at a tile border are also suppressed when
+mostly contained in a higher-scoring box (intersection over the smaller box).
+
+The per-frame compute budget (TILE_BUDGET) is counted in model input
+pixels, as a multiple of the full-frame pass; the most promising tiles
+are kept first. The cost report compares the pixels actually processed with
+full-frame inference at the tiles' resolution (the frame upscaled by
+`scale`). With --compare-full, that full-frame run is also measured.
+
+Tile boxes are kept down to TILE_MIN_HEIGHT source pixels instead of
+MIN_HEIGHT, since the model saw them `scale` times larger.
+"""
+
+import os
+import json
+import math
+import time
+import argparse
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from run_yolo_detection import (
+    FRAMES_DIR, OUTPUT_DIR, CONF_LOW, MIN_HEIGHT,
+    load_model, create_output_dirs, extract_raw_boxes, filter_boxes,
+    build_frame_data, annotate_frame, save_frame_outputs,
+)
+
+# ---------------------- Configuration ----------------------
+IMGSZ = 640              # Full-frame pass input size
+TILE_IMGSZ = 640         # Model input size of a tile
+SCALE = 2.0              # Tile resolution relative to the source frame
+OVERLAP = 0.25           # Overlap between neighbouring tiles
+HORIZON_BAND = (0.35, 0.65)  # Rows (fractions of the height) where distant pedestrians appear
+AROUND_PREVIOUS = 1.5    # Region around a previous detection, as a multiple of its size
+TILE_BUDGET = 12.0       # Tile input pixels per frame, as a multiple of the full-frame pass (~8 tiles at 1080p)
+MAX_TILES = 16
+TILE_MIN_HEIGHT = 30     # Source pixels; MIN_HEIGHT applies to full-frame boxes
+NMS_IOU = 0.5
+NMS_IOS = 0.8            # Intersection over the smaller box, for boxes cut at tile borders
+
+# ---------------------- Classes ----------------------
+class TiledDetector:
+    """
+    Full-frame pass plus a batched pass over selected high-resolution tiles.
+    detect() returns the merged detections (dicts like extract_detections,
+    with a "source" of "full" or "tile") and the cost of the frame.
+    """
+    def __init__(self, model, imgsz=IMGSZ, tile_imgsz=TILE_IMGSZ, scale=SCALE, overlap=OVERLAP,
+                 horizon_band=HORIZON_BAND, around_previous=AROUND_PREVIOUS, budget=TILE_BUDGET,
+                 max_tiles=MAX_TILES, tile_min_height=TILE_MIN_HEIGHT):
+        self.model = model
+        self.imgsz = imgsz
+        self.tile_imgsz = tile_imgsz
+        self.scale = scale
+        self.overlap = overlap
+        self.horizon_band = horizon_band
+        self.around_previous = around_previous
+        self.budget = budget
+        self.max_tiles = max_tiles
+        self.tile_min_height = tile_min_height
+
+    def select_tiles(self, width, height, previous=()):
+        """
+        Tile origins in priority order (around previous detections, most
+        confident first, then the horizon band from the centre outwards),
+        skipping tiles mostly covered by already selected ones, within budget.
+        """
+        tile = min(int(round(self.tile_imgsz / self.scale)), width, height)
+        candidates = []
+        for det in sorted(previous, key=lambda d: -d["confidence"]):
+            x1, y1, x2, y2 = det["bbox"]
+            cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+            half_w = max(x2 - x1, tile / self.around_previous) * self.around_previous / 2
+            half_h = max(y2 - y1, tile / self.around_previous) * self.around_previous / 2
+            candidates += tiles_over((cx - half_w, cy - half_h, cx + half_w, cy + half_h),
+                                     tile, self.overlap, width, height)
+        if self.horizon_band:
+            band = tiles_over((0, self.horizon_band[0] * height, width, self.horizon_band[1] * height),
+                              tile, self.overlap, width, height)
+            candidates += sorted(band, key=lambda t: abs(t[0] + tile / 2 - width / 2))
+
+        base = input_pixels(width, height, self.imgsz)
+        max_tiles = min(self.max_tiles, int(self.budget * base // self.tile_imgsz ** 2))
+        selected = []
+        for x, y in candidates:
+            if len(selected) >= max_tiles:
+                break
+            covered = any(max(0, tile - abs(x - sx)) * max(0, tile - abs(y - sy)) > 0.7 * tile * tile
+                          for sx, sy in selected)
+            if not covered:
+                selected.append((x, y))
+        return selected, tile
+
+    def detect(self, img, previous=()):
+        height, width = img.shape[:2]
+        start = time.perf_counter()
+        full = self.model(img, conf=CONF_LOW, classes=[0], imgsz=self.imgsz, verbose=False)
+        full_boxes = [dict(b, source="full") for b in filter_boxes(extract_raw_boxes(full), CONF_LOW, MIN_HEIGHT)]
+        full_seconds = time.perf_counter() - start
+
+        tiles, tile = self.select_tiles(width, height, previous)
+        tile_boxes = []
+        start = time.perf_counter()
+        if tiles:
+            crops = [img[y:y + tile, x:x + tile] for x, y in tiles]
+            results = self.model(crops, conf=CONF_LOW, classes=[0], imgsz=self.tile_imgsz, verbose=False)
+            for (x, y), r in zip(tiles, results):
+                for b in filter_boxes(extract_raw_boxes([r]), CONF_LOW, self.tile_min_height):
+                    x1, y1, x2, y2 = b["bbox"]
+                    tile_boxes.append({"bbox": [x1 + x, y1 + y, x2 + x, y2 + y],
+                                       "confidence": b["confidence"], "source": "tile"})
+        tile_seconds = time.perf_counter() - start
+
+        merged = full_boxes + tile_boxes
+        keep = nms([d["bbox"] for d in merged], [d["confidence"] for d in merged])
+        detections = [merged[i] for i in sorted(keep)]
+
+        base = input_pixels(width, height, self.imgsz)
+        tiled = base + len(tiles) * self.tile_imgsz ** 2
+        equivalent = input_pixels(width * self.scale, height * self.scale, max(width, height) * self.scale)
+        cost = {
+            "tiles": len(tiles),
+            "full_pixels": base,
+            "tiled_pixels": tiled,
+            "equivalent_pixels": equivalent,
+            "cost_vs_full_pass": tiled / base,
+            "cost_vs_equivalent": tiled / equivalent,
+            "full_seconds": full_seconds,
+            "tile_seconds": tile_seconds,
+            "full_detections": len(full_boxes),
+            "added_detections": sum(d["source"] == "tile" for d in detections),
+        }
+        return detections, cost
+
+# ---------------------- Functions ----------------------
+def input_pixels(width, height, imgsz):
+    """Model input pixels of a frame letterboxed to imgsz (long side), padded to stride 32."""
+    r = imgsz / max(width, height)
+    return math.ceil(width * r / 32) * 32 * math.ceil(height * r / 32) * 32
+
+def tiles_over(region, tile, overlap, width, height):
+    """Grid of tile x tile windows (x1, y1) covering region, clamped to the frame."""
+    x1, y1, x2, y2 = region
+    step = max(1, int(tile * (1 - overlap)))
+    xs = list(range(int(x1), max(int(x1), int(x2) - tile) + 1, step)) or [int(x1)]
+    ys = list(range(int(y1), max(int(y1), int(y2) - tile) + 1, step)) or [int(y1)]
+    # Make sure the far edges are covered
+    if xs[-1] + tile < x2:
+        xs.append(int(x2) - tile)
+    if ys[-1] + tile < y2:
+        ys.append(int(y2) - tile)
+    return [(min(max(0, x), max(0, width - tile)), min(max(0, y), max(0, height - tile))) for y in ys for x in xs]
+
+def nms(boxes, scores, iou_threshold=NMS_IOU, ios_threshold=NMS_IOS):
+    """Indices kept by class-agnostic NMS on IoU and intersection over the smaller box."""
+    if len(boxes) == 0:
+        return np.empty(0, dtype=int)
+    boxes = np.asarray(boxes, dtype=np.float32)
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = w * h
+        iou = inter / np.maximum(area[i] + area[rest] - inter, 1e-6)
+        ios = inter / np.maximum(np.minimum(area[i], area[rest]), 1e-6)
+        order = rest[(iou < iou_threshold) & (ios < ios_threshold)]
+    return np.array(keep)
+
+def print_cost_report(costs, measured_full=None):
+    n = max(len(costs), 1)
+    mean = lambda key: sum(c[key] for c in costs) / n
+    print(f"\n=== Tiled inference ({len(costs)} frames) ===")
+    print(f"Tiles per frame:               {mean('tiles'):.1f}")
+    print(f"Cost vs full-frame pass:       {mean('cost_vs_full_pass'):.2f}x input pixels")
+    print(f"Cost vs full frame at tile res: {mean('cost_vs_equivalent'):.2f}x input pixels")
+    print(f"Time per frame:                {mean('full_seconds') * 1000:.1f} ms full + "
+          f"{mean('tile_seconds') * 1000:.1f} ms tiles")
+    print(f"Detections per frame:          {mean('full_detections'):.2f} full-frame, "
+          f"+{mean('added_detections'):.2f} from tiles")
+    if measured_full:
+        tiled_time = mean("full_seconds") + mean("tile_seconds")
+        print(f"Measured full frame at tile res: {measured_full['seconds'] * 1000:.1f} ms/frame, "
+              f"{measured_full['detections']:.2f} detections/frame (tiled: {tiled_time / measured_full['seconds']:.2f}x time)")
+
+def measure_full_resolution(model, frame_paths, scale, tile_min_height):
+    """Mean time and detections of plain full-frame inference at `scale` x resolution."""
+    seconds, detections = 0.0, 0
+    for path in frame_paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        imgsz = int(math.ceil(max(img.shape[:2]) * scale / 32) * 32)
+        start = time.perf_counter()
+        r = model(img, conf=CONF_LOW, classes=[0], imgsz=imgsz, verbose=False)
+        seconds += time.perf_counter() - start
+        detections += len(filter_boxes(extract_raw_boxes(r), CONF_LOW, tile_min_height))
+    n = max(len(frame_paths), 1)
+    return {"seconds": seconds / n, "detections": detections / n}
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiled multi-scale detection of small pedestrians")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--scale", type=float, default=SCALE, help="Tile resolution relative to the frame")
+    parser.add_argument("--tile-imgsz", type=int, default=TILE_IMGSZ)
+    parser.add_argument("--overlap", type=float, default=OVERLAP)
+    parser.add_argument("--band", type=float, nargs=2, default=HORIZON_BAND, metavar=("TOP", "BOTTOM"),
+                        help="Horizon band as fractions of the frame height")
+    parser.add_argument("--no-band", action="store_true", help="Only tile around previous detections")
+    parser.add_argument("--no-previous", action="store_true", help="Do not tile around previous detections")
+    parser.add_argument("--budget", type=float, default=TILE_BUDGET,
+                        help="Tile input pixels per frame, as a multiple of the full-frame pass")
+    parser.add_argument("--max-tiles", type=int, default=MAX_TILES)
+    parser.add_argument("--tile-min-height", type=int, default=TILE_MIN_HEIGHT)
+    parser.add_argument("--compare-full", type=int, default=0, metavar="N",
+                        help="Also time full-frame inference at tile resolution on N frames")
+    parser.add_argument("--server", default=None, help="Use the model of a running detection_server.py")
+    args = parser.parse_args()
+
+    if args.server:
+        import run_yolo_detection
+        run_yolo_detection.SERVER = args.server
+    model = load_model()
+    detector = TiledDetector(model, IMGSZ, args.tile_imgsz, args.scale, args.overlap,
+                             None if args.no_band else tuple(args.band), AROUND_PREVIOUS,
+                             args.budget, args.max_tiles, args.tile_min_height)
+    create_output_dirs(args.output_dir)
+    frames = sorted(f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+
+    costs, previous = [], []
+    for frame in tqdm(frames, desc="Tiled detection"):
+        img = cv2.imread(os.path.join(args.frames_dir, frame))
+        if img is None:
+            continue
+        detections, cost = detector.detect(img, [] if args.no_previous else previous)
+        costs.append(dict(cost, frame=frame))
+        previous = detections
+        frame_data = build_frame_data(frame, detections)
+        if frame_data["decision"] != "none":
+            save_frame_outputs(annotate_frame(img, frame_data), frame_data, args.output_dir)
+
+    with open(os.path.join(args.output_dir, "tiling_cost.json"), "w") as f:
+        json.dump(costs, f, indent=2)
+    measured = None
+    if args.compare_full:
+        measured = measure_full_resolution(model, [os.path.join(args.frames_dir, f) for f in frames[:args.compare_full]],
+                                           args.scale, args.tile_min_height)
+    print_cost_report(costs, measured)
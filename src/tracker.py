@@ -0,0 +1,328 @@
+"""
+tracker.py
+
+Temporal tracking layer that reuses detections across consecutive frames.
+Each pedestrian is a track with a constant-velocity Kalman filter on its
+box (centre, size and their velocities). The full YOLO model only runs
+every K frames, or earlier when a track's propagated confidence decays
+below REDETECT_CONF (the detector's own threshold); in between, boxes are
+propagated by the filters and re-filtered by MIN_HEIGHT. Detections are
+associated to tracks by greedy IoU matching, which gives stable
+per-pedestrian IDs. A track missed by a detector run is not reported (nor
+counted) until a later detection matches it again, and keeps its ID then.
+
+Modes:
+- detect:    tracked detection over a frames folder, writing the usual
+             outputs with a track_id per detection
+- benchmark: speedup vs. count-accuracy loss for several K, compared with
+             running the detector on every frame
+"""
+
+import os
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+from run_yolo_detection import (
+    FRAMES_DIR, OUTPUT_DIR, CONF_LOW,
+    load_model, create_output_dirs, extract_detections, filter_boxes,
+    build_frame_data, annotate_frame, save_frame_outputs,
+)
+
+# ---------------------- Configuration ----------------------
+DETECT_EVERY = 5       # K: run the detector at least every K frames
+IOU_MATCH = 0.3        # Minimum IoU to associate a detection with a track
+MAX_MISSES = 1         # Detector runs a track may miss before it is dropped
+DECAY = 0.98           # Per-frame decay of a propagated track's confidence
+REDETECT_CONF = CONF_LOW  # Run the detector early when a track's decayed confidence falls below this
+
+# ---------------------- Functions ----------------------
+def iou_matrix(a, b):
+    """
+    Pairwise IoU between two arrays of [x1, y1, x2, y2] boxes.
+    """
+    a = np.asarray(a, dtype=float).reshape(-1, 4)
+    b = np.asarray(b, dtype=float).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def greedy_match(iou, threshold=IOU_MATCH):
+    """
+    Greedy one-to-one matching on an IoU matrix, best pairs first.
+    Returns a list of (row, col) pairs.
+    """
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    used_rows, used_cols = set(), set()
+    order = np.dstack(np.unravel_index(np.argsort(-iou, axis=None), iou.shape))[0]
+    for r, c in order:
+        if iou[r, c] < threshold:
+            break
+        if r not in used_rows and c not in used_cols:
+            pairs.append((int(r), int(c)))
+            used_rows.add(r)
+            used_cols.add(c)
+    return pairs
+
+# ---------------------- Classes ----------------------
+class Track:
+    """
+    One pedestrian: constant-velocity Kalman filter over
+    [cx, cy, w, h, vcx, vcy, vw, vh].
+    """
+    F = np.eye(8) + np.eye(8, k=4)
+    H = np.eye(4, 8)
+
+    def __init__(self, track_id, det):
+        x1, y1, x2, y2 = det["bbox"]
+        self.id = track_id
+        self.x = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=float)
+        self.P = np.diag([10, 10, 10, 10, 100, 100, 100, 100]).astype(float)
+        self.confidence = det["confidence"]        # Last detector confidence
+        self.track_confidence = det["confidence"]  # Decays while propagated
+        self.misses = 0
+        self.hits = 1
+
+    def _noise(self):
+        scale = max(self.x[3], 1.0) / 20
+        q = np.diag([1, 1, 1, 1, 0.1, 0.1, 0.1, 0.1]) * scale**2
+        r = np.diag([1, 1, 2, 2]) * scale**2
+        return q, r
+
+    def predict(self):
+        q, _ = self._noise()
+        self.x = self.F @ self.x
+        self.x[2:4] = np.maximum(self.x[2:4], 1.0)
+        self.P = self.F @ self.P @ self.F.T + q
+        self.track_confidence *= DECAY
+
+    def update(self, det):
+        _, r = self._noise()
+        x1, y1, x2, y2 = det["bbox"]
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=float)
+        S = self.H @ self.P @ self.H.T + r
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - self.H @ self.x)
+        self.P = (np.eye(8) - K @ self.H) @ self.P
+        self.confidence = det["confidence"]
+        self.track_confidence = det["confidence"]
+        self.misses = 0
+        self.hits += 1
+
+    def bbox(self):
+        cx, cy, w, h = self.x[:4]
+        return [int(cx - w / 2), int(cy - h / 2), int(cx + w / 2), int(cy + h / 2)]
+
+    def detection(self, source):
+        return {
+            "bbox": self.bbox(),
+            "confidence": self.confidence,
+            "track_id": self.id,
+            "track_confidence": round(self.track_confidence, 4),
+            "source": source,
+        }
+
+
+class Tracker:
+    """
+    Maintains tracks across frames. Call step() once per frame with the
+    detector output, or with None on frames where the detector is skipped.
+    """
+    def __init__(self, iou_match=IOU_MATCH, max_misses=MAX_MISSES):
+        self.iou_match = iou_match
+        self.max_misses = max_misses
+        self.tracks = []
+        self.next_id = 1
+
+    def step(self, detections=None):
+        """
+        Advance all tracks by one frame and, if detections are given,
+        associate them. Returns the frame's detections with track IDs:
+        tracks missed by the last detector run are left out, and
+        propagated boxes go through the detector's height filter.
+        """
+        for t in self.tracks:
+            t.predict()
+        if detections is None:
+            return filter_boxes([t.detection("propagated") for t in self.tracks if t.misses == 0])
+
+        iou = iou_matrix([t.bbox() for t in self.tracks], [d["bbox"] for d in detections])
+        pairs = greedy_match(iou, self.iou_match)
+        matched_tracks = {r for r, _ in pairs}
+        matched_dets = {c for _, c in pairs}
+        for r, c in pairs:
+            self.tracks[r].update(detections[c])
+
+        # Unmatched tracks survive a few missed detections, then are dropped
+        for i, t in enumerate(self.tracks):
+            if i not in matched_tracks:
+                t.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        for c, det in enumerate(detections):
+            if c not in matched_dets:
+                self.tracks.append(Track(self.next_id, det))
+                self.next_id += 1
+
+        return [t.detection("detector") for t in self.tracks if t.misses == 0]
+
+    def needs_detection(self):
+        """True when a track's propagated confidence decayed below REDETECT_CONF."""
+        return any(t.confidence >= REDETECT_CONF > t.track_confidence for t in self.tracks)
+
+
+class TrackedDetector:
+    """
+    Runs detect_fn(img) -> detections every `detect_every` frames (or when
+    the tracker asks for it) and propagates tracks in between.
+    """
+    def __init__(self, detect_fn, detect_every=DETECT_EVERY, tracker=None):
+        self.detect_fn = detect_fn
+        self.detect_every = detect_every
+        self.tracker = tracker or Tracker()
+        self.since_detection = None
+        self.detector_calls = 0
+
+    def process(self, img):
+        if (self.since_detection is None or self.since_detection + 1 >= self.detect_every
+                or self.tracker.needs_detection()):
+            self.detector_calls += 1
+            self.since_detection = 0
+            return self.tracker.step(self.detect_fn(img)), True
+        self.since_detection += 1
+        return self.tracker.step(None), False
+
+# ---------------------- Functions ----------------------
+def yolo_detect_fn(model=None, imgsz=None):
+    """
+    Detection function for TrackedDetector based on the YOLO model, with the
+    CONF_LOW and MIN_HEIGHT filters of run_yolo_detection.py.
+    """
+    model = model or load_model()
+    size = {"imgsz": imgsz} if imgsz else {}
+    return lambda img: extract_detections(model(img, conf=CONF_LOW, classes=[0], verbose=False, **size))
+
+def draw_tracks(img, detections, color=(0, 255, 0)):
+    """
+    Draw tracked boxes with their track ID in place; propagated boxes are
+    drawn with a thinner line.
+    """
+    for det in detections:
+        x1, y1, x2, y2 = det["bbox"]
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2 if det["source"] == "detector" else 1)
+        cv2.putText(img, f"id {det['track_id']}: {det['confidence']:.2f}", (x1, y1 - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 1)
+    return img
+
+def list_frames(frames_dir):
+    return sorted(f for f in os.listdir(frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+
+def detect_sequence(frames_dir=FRAMES_DIR, output_dir=OUTPUT_DIR, detect_every=DETECT_EVERY):
+    """
+    Tracked detection over the sorted frames of one sequence, writing the
+    same outputs as process_frame plus track IDs in the metadata.
+    """
+    create_output_dirs(output_dir)
+    tracked = TrackedDetector(yolo_detect_fn(), detect_every)
+    frames = list_frames(frames_dir)
+    for frame_name in frames:
+        img = cv2.imread(os.path.join(frames_dir, frame_name))
+        if img is None:
+            continue
+        detections, detected = tracked.process(img)
+        frame_data = build_frame_data(frame_name, detections)
+        frame_data["detector_run"] = detected
+        if frame_data["decision"] != "none":
+            save_frame_outputs(annotate_frame(img, frame_data), frame_data, output_dir)
+    print(f"Detector ran on {tracked.detector_calls}/{len(frames)} frames")
+
+def count_flicker(counts):
+    """Number of frame-to-frame changes in human_count."""
+    return int(np.count_nonzero(np.diff(np.asarray(counts))))
+
+def benchmark(frames_dir=FRAMES_DIR, ks=(2, 3, 5, 10)):
+    """
+    Run the detector on every frame once (reference), then replay tracking
+    with each K using the reference detections on detector frames.
+    Tracked time = measured detector time on the frames it ran + tracker time.
+    """
+    detect = yolo_detect_fn()
+    frames = list_frames(frames_dir)
+    images, reference, det_times = [], [], []
+    for frame_name in frames:
+        img = cv2.imread(os.path.join(frames_dir, frame_name))
+        if img is None:
+            continue
+        start = time.perf_counter()
+        reference.append(detect(img))
+        det_times.append(time.perf_counter() - start)
+        images.append(img)
+
+    ref_data = [build_frame_data(str(i), d) for i, d in enumerate(reference)]
+    ref_counts = np.array([d["human_count"] for d in ref_data])
+    ref_decisions = [d["decision"] for d in ref_data]
+    full_time = sum(det_times)
+
+    rows = [{"K": 1, "detector_frames": len(images), "detector_ratio": 1.0, "speedup": 1.0, "count_mae": 0.0,
+             "count_exact": 1.0, "decision_agreement": 1.0, "count_flicker": count_flicker(ref_counts)}]
+    for k in ks:
+        index = {"i": 0}
+        tracked = TrackedDetector(lambda img: reference[index["i"]], k)
+        counts, decisions, tracked_time = [], [], 0.0
+        for i, img in enumerate(images):
+            index["i"] = i
+            start = time.perf_counter()
+            detections, detected = tracked.process(img)
+            tracked_time += time.perf_counter() - start
+            if detected:
+                tracked_time += det_times[i]
+            data = build_frame_data(str(i), detections)
+            counts.append(data["human_count"])
+            decisions.append(data["decision"])
+        counts = np.array(counts)
+        rows.append({
+            "K": k,
+            "detector_frames": tracked.detector_calls,
+            "detector_ratio": tracked.detector_calls / max(len(images), 1),
+            "speedup": full_time / max(tracked_time, 1e-9),
+            "count_mae": float(np.abs(counts - ref_counts).mean()),
+            "count_exact": float((counts == ref_counts).mean()),
+            "decision_agreement": float(np.mean([a == b for a, b in zip(decisions, ref_decisions)])),
+            "count_flicker": count_flicker(counts),
+        })
+
+    print(f"\n=== Tracking benchmark: {len(images)} frames from {frames_dir} ===")
+    print(f"{'K':>3} {'det.frames':>10} {'ratio':>6} {'speedup':>8} {'count MAE':>10} {'exact':>7} {'decision':>9} {'flicker':>8}")
+    for r in rows:
+        print(f"{r['K']:>3} {r['detector_frames']:>10} {r['detector_ratio']:>6.2f} {r['speedup']:>7.2f}x {r['count_mae']:>10.3f} "
+              f"{r['count_exact']:>7.1%} {r['decision_agreement']:>9.1%} {r['count_flicker']:>8}")
+    return rows
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tracked YOLOv8 detection across consecutive frames")
+    parser.add_argument("command", choices=["detect", "benchmark"])
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--detect-every", type=int, default=DETECT_EVERY)
+    parser.add_argument("--ks", default="2,3,5,10", help="Comma-separated K values to benchmark")
+    parser.add_argument("--server", default=None, help="Use the model of a running detection_server.py")
+    args = parser.parse_args()
+
+    if args.server:
+        import run_yolo_detection
+        run_yolo_detection.SERVER = args.server
+
+    if args.command == "detect":
+        detect_sequence(args.frames_dir, args.output_dir, args.detect_every)
+    else:
+        benchmark(args.frames_dir, [int(k) for k in args.ks.split(",")])
@@ -0,0 +1,321 @@
+"""
+yolo_backends.py
+
+CPU inference backends for the YOLOv8 person detector. The PyTorch
+checkpoint is exported once with ultralytics, and the exported model is
+loaded back through ultralytics.YOLO. Every backend therefore returns the
+same Results objects, and extract_detections / build_frame_data are
+unchanged:
+- torch:          yolov8m.pt through PyTorch (baseline)
+- onnx:           ONNX Runtime, FP32
+- onnx-int8:      ONNX Runtime, INT8 static quantization (QDQ) calibrated
+                  on our own extracted frames
+- openvino:       OpenVINO IR, FP32
+- openvino-int8:  OpenVINO IR, INT8 via NNCF calibrated on our frames
+
+Exports go to EXPORT_DIR and are reused on later runs. The export keeps
+the 80-class COCO head; person-only filtering stays in the classes=[0]
+argument of every detection call.
+
+Subcommands:
+- export:  build the models of the given backends
+- parity:  run the PyTorch baseline and each backend on the frames of
+           results/yolo-results.csv; report human_count and decision
+           agreement (also against the CSV itself) and per-frame latency
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+
+import cv2
+import numpy as np
+
+from run_yolo_detection import FRAMES_DIR, MODEL_PATH, CONF_LOW, extract_detections, build_frame_data
+from profiling import quantile
+
+# ---------------------- Configuration ----------------------
+BACKENDS = ("torch", "onnx", "onnx-int8", "openvino", "openvino-int8")
+EXPORT_DIR = "models"
+IMGSZ = 640
+CALIBRATION_FRAMES = 300   # Frames sampled (evenly, across datasets) for INT8 calibration
+YOLO_CSV = "results/yolo-results.csv"
+FRAMES_ROOT = os.path.dirname(FRAMES_DIR)  # <root>/<dataset>/<frame>
+PARITY_OUTPUT = "backend_parity"
+
+# Agreement with the PyTorch baseline required by `parity`
+MIN_DECISION_AGREEMENT = 0.98
+MIN_COUNT_AGREEMENT = 0.95
+
+# ---------------------- Classes ----------------------
+class FrameCalibrationReader:
+    """
+    Calibration data for onnxruntime.quantization.quantize_static: frames
+    preprocessed exactly like ultralytics does for a fixed-size model.
+    """
+    def __init__(self, frame_paths, input_name, imgsz=IMGSZ):
+        self.frame_paths = list(frame_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self.index = 0
+
+    def get_next(self):
+        while self.index < len(self.frame_paths):
+            img = cv2.imread(self.frame_paths[self.index])
+            self.index += 1
+            if img is not None:
+                return {self.input_name: preprocess(img, self.imgsz)}
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+# ---------------------- Functions ----------------------
+def letterbox(img, imgsz=IMGSZ, color=(114, 114, 114)):
+    """Resize keeping the aspect ratio and pad to imgsz x imgsz (ultralytics LetterBox)."""
+    h, w = img.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    nh, nw = int(round(h * r)), int(round(w * r))
+    if (nh, nw) != (h, w):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, left = (imgsz - nh) // 2, (imgsz - nw) // 2
+    return cv2.copyMakeBorder(img, top, imgsz - nh - top, left, imgsz - nw - left,
+                              cv2.BORDER_CONSTANT, value=color)
+
+def preprocess(img, imgsz=IMGSZ):
+    """BGR frame -> 1x3xHxW float32 RGB tensor in [0, 1]."""
+    x = letterbox(img, imgsz)[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(x, dtype=np.float32)[None] / 255.0
+
+def calibration_frames(frames_dirs, n=CALIBRATION_FRAMES):
+    """Evenly spaced sample of n frames over one or more frame folders."""
+    paths = []
+    for frames_dir in frames_dirs:
+        paths += sorted(os.path.join(frames_dir, f) for f in os.listdir(frames_dir)
+                        if f.lower().endswith((".png", ".jpg", ".jpeg")))
+    if len(paths) <= n:
+        return paths
+    return [paths[i] for i in np.linspace(0, len(paths) - 1, n).astype(int)]
+
+def model_path_for(backend, model_path=MODEL_PATH, export_dir=EXPORT_DIR):
+    """Path of the model file/folder of a backend (the checkpoint itself for torch)."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    if backend == "torch":
+        return model_path
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    if backend.startswith("onnx"):
+        return os.path.join(export_dir, f"{stem}{'-int8' if backend.endswith('int8') else ''}.onnx")
+    return os.path.join(export_dir, f"{stem}{'_int8' if backend.endswith('int8') else ''}_openvino_model")
+
+def quantize_onnx(fp32_path, int8_path, frame_paths, imgsz=IMGSZ):
+    """INT8 static quantization (QDQ, per-channel weights) calibrated on frame_paths."""
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    prepared = f"{os.path.splitext(int8_path)[0]}-prep.onnx"
+    quant_pre_process(fp32_path, prepared)
+    quantize_static(
+        prepared, int8_path, FrameCalibrationReader(frame_paths, input_name, imgsz),
+        quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        per_channel=True, calibrate_method=CalibrationMethod.MinMax,
+        # The detection head concatenates boxes and class scores of very
+        # different ranges; keeping it in float avoids most of the accuracy loss
+        nodes_to_exclude=_head_nodes(prepared),
+    )
+    os.remove(prepared)
+    return int8_path
+
+def _head_nodes(onnx_path):
+    """
+    Box decoding nodes of the final Detect head: everything in the last
+    /model.N/ block except its cv2 (box) and cv3 (class) conv branches.
+    """
+    import onnx
+
+    names = [n.name for n in onnx.load(onnx_path).graph.node]
+    blocks = [int(m.group(1)) for m in map(re.compile(r"^/model\.(\d+)/").match, names) if m]
+    if not blocks:
+        return []
+    head = f"/model.{max(blocks)}/"
+    return [n for n in names if n.startswith(head) and "/cv2." not in n and "/cv3." not in n]
+
+def export_model(backend, model_path=MODEL_PATH, export_dir=EXPORT_DIR, calib_dirs=(FRAMES_DIR,),
+                 calib_frames=CALIBRATION_FRAMES, imgsz=IMGSZ, force=False):
+    """Export (and quantize) the model of a backend unless it already exists; returns its path."""
+    from ultralytics import YOLO
+
+    target = model_path_for(backend, model_path, export_dir)
+    if backend == "torch" or (os.path.exists(target) and not force):
+        return target
+    os.makedirs(export_dir, exist_ok=True)
+
+    if backend == "onnx-int8":
+        fp32 = export_model("onnx", model_path, export_dir, calib_dirs, calib_frames, imgsz)
+        return quantize_onnx(fp32, target, calibration_frames(calib_dirs, calib_frames), imgsz)
+
+    if backend == "onnx":
+        exported = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    elif backend == "openvino":
+        exported = YOLO(model_path).export(format="openvino", imgsz=imgsz, dynamic=True)
+    else:
+        # NNCF calibrates on the "val" images of a dataset yaml: point it at our frames
+        calib = os.path.join(export_dir, "calibration")
+        shutil.rmtree(calib, ignore_errors=True)
+        os.makedirs(os.path.join(calib, "images"))
+        for i, path in enumerate(calibration_frames(calib_dirs, calib_frames)):
+            # Frame names repeat across datasets
+            os.symlink(os.path.abspath(path), os.path.join(calib, "images", f"{i:05d}_{os.path.basename(path)}"))
+        data_yaml = os.path.join(calib, "data.yaml")
+        with open(data_yaml, "w") as f:
+            f.write(f"path: {os.path.abspath(calib)}\ntrain: images\nval: images\nnames:\n  0: person\n")
+        exported = YOLO(model_path).export(format="openvino", imgsz=imgsz, int8=True, data=data_yaml)
+
+    # ultralytics writes next to the checkpoint; move the result into export_dir
+    if os.path.abspath(str(exported)) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.move(str(exported), target)
+    return target
+
+def load_backend(backend, model_path=MODEL_PATH, export_dir=EXPORT_DIR):
+    """ultralytics.YOLO for a backend, exporting it first if needed."""
+    from ultralytics import YOLO
+
+    path = export_model(backend, model_path, export_dir)
+    return YOLO(path, task="detect")
+
+def detect_frame(model, img, imgsz=IMGSZ):
+    """Detections of one frame, exactly as process_frame computes them."""
+    return extract_detections(model(img, conf=CONF_LOW, classes=[0], imgsz=imgsz, verbose=False))
+
+def run_backend(model, frames, imgsz=IMGSZ, warmup=3):
+    """
+    frame_data per frame key and per-frame inference latencies of one model
+    over (key, frame path) pairs. Frames are decoded one at a time and only
+    the model call is timed; unreadable frames are skipped.
+    """
+    for _, path in frames[:warmup]:
+        img = cv2.imread(path)
+        if img is not None:
+            detect_frame(model, img, imgsz)
+    results, latencies = {}, []
+    for key, path in frames:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        start = time.perf_counter()
+        raw = model(img, conf=CONF_LOW, classes=[0], imgsz=imgsz, verbose=False)
+        latencies.append(time.perf_counter() - start)
+        results[key] = build_frame_data(key[1], extract_detections(raw))
+    return results, latencies
+
+def parity_check(backends, yolo_csv=YOLO_CSV, frames_root=FRAMES_ROOT, limit=None, imgsz=IMGSZ,
+                 model_path=MODEL_PATH, export_dir=EXPORT_DIR, output_dir=PARITY_OUTPUT):
+    """
+    Compare each backend with the PyTorch baseline (and with the CSV) on the
+    frames of yolo-results.csv. Writes per-frame results and summary.json;
+    returns the summary.
+    """
+    import pandas as pd
+
+    expected = pd.read_csv(yolo_csv)
+    if limit:
+        expected = expected.sample(n=min(limit, len(expected)), random_state=0)
+    frames = []  # (key, path): decoded per backend run, not all held in memory
+    for r in expected.itertuples(index=False):
+        path = os.path.join(frames_root, r.dataset, r.frame)
+        if os.path.isfile(path):
+            frames.append(((r.dataset, r.frame), path))
+    if not frames:
+        raise FileNotFoundError(f"None of the {len(expected)} frames of {yolo_csv} found under {frames_root}")
+    expected = expected.set_index(["dataset", "frame"])
+
+    runs = {}
+    for backend in ("torch",) + tuple(b for b in backends if b != "torch"):
+        model = load_backend(backend, model_path, export_dir)
+        runs[backend] = run_backend(model, frames, imgsz)
+        del model
+
+    baseline = runs["torch"][0]
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {"frames": len(baseline), "csv_rows": len(expected), "backends": {}}
+    for backend, (results, latencies) in runs.items():
+        rows = []
+        for key in baseline:
+            rows.append({
+                "dataset": key[0], "frame": key[1],
+                "human_count": results[key]["human_count"], "decision": results[key]["decision"],
+                "torch_count": baseline[key]["human_count"], "torch_decision": baseline[key]["decision"],
+                "csv_count": expected.loc[key, "yolo_count"], "csv_decision": expected.loc[key, "yolo_decision"],
+            })
+        df = pd.DataFrame(rows)
+        df.to_csv(os.path.join(output_dir, f"{backend}.csv"), index=False)
+        ordered = sorted(latencies)
+        summary["backends"][backend] = {
+            "count_agreement": float((df["human_count"] == df["torch_count"]).mean()),
+            "decision_agreement": float((df["decision"] == df["torch_decision"]).mean()),
+            "count_mae": float((df["human_count"] - df["torch_count"]).abs().mean()),
+            "csv_count_agreement": float((df["human_count"] == df["csv_count"]).mean()),
+            "csv_decision_agreement": float((df["decision"] == df["csv_decision"]).mean()),
+            "decision_changes": df[df["decision"] != df["torch_decision"]]
+                .groupby(["torch_decision", "decision"]).size().rename("frames").reset_index().to_dict("records"),
+            "latency_p50_ms": quantile(ordered, 0.50) * 1000,
+            "latency_p95_ms": quantile(ordered, 0.95) * 1000,
+            "fps": len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+        }
+        stats = summary["backends"][backend]
+        stats["passed"] = (stats["decision_agreement"] >= MIN_DECISION_AGREEMENT
+                           and stats["count_agreement"] >= MIN_COUNT_AGREEMENT)
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def print_parity(summary):
+    torch_p50 = summary["backends"]["torch"]["latency_p50_ms"]
+    print(f"\n=== Backend parity on {summary['frames']} frames (vs torch) ===")
+    print(f"{'backend':<15}{'count':>8}{'decision':>10}{'MAE':>7}{'vs CSV':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'speedup':>9}  result")
+    for backend, s in summary["backends"].items():
+        print(f"{backend:<15}{s['count_agreement']:>8.1%}{s['decision_agreement']:>10.1%}{s['count_mae']:>7.3f}"
+              f"{s['csv_decision_agreement']:>8.1%}{s['latency_p50_ms']:>9.1f}{s['latency_p95_ms']:>9.1f}"
+              f"{torch_p50 / s['latency_p50_ms'] if s['latency_p50_ms'] else 0:>8.2f}x  "
+              f"{'ok' if s['passed'] else 'FAILED'}")
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export, quantize and check CPU YOLO backends")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ex = sub.add_parser("export", help="Export (and quantize) models")
+    ex.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=BACKENDS)
+    ex.add_argument("--calib-dirs", nargs="+", default=[FRAMES_DIR], help="Frame folders to calibrate INT8 on")
+    ex.add_argument("--calib-frames", type=int, default=CALIBRATION_FRAMES)
+    ex.add_argument("--force", action="store_true", help="Re-export even if the model exists")
+
+    pa = sub.add_parser("parity", help="Compare backends with PyTorch on yolo-results.csv frames")
+    pa.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"], choices=BACKENDS)
+    pa.add_argument("--yolo-csv", default=YOLO_CSV)
+    pa.add_argument("--frames-root", default=FRAMES_ROOT, help="Frames are read from <root>/<dataset>/<frame>")
+    pa.add_argument("--limit", type=int, default=None, help="Random sample of the CSV frames")
+    pa.add_argument("--output-dir", default=PARITY_OUTPUT)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for backend in args.backends:
+            path = export_model(backend, args.model, args.export_dir, args.calib_dirs, args.calib_frames,
+                                args.imgsz, args.force)
+            print(f"{backend:<15} {path}")
+    else:
+        summary = parity_check(args.backends, args.yolo_csv, args.frames_root, args.limit, args.imgsz,
+                               args.model, args.export_dir, args.output_dir)
+        print_parity(summary)
+        raise SystemExit(0 if all(s["passed"] for s in summary["backends"].values()) else 1)
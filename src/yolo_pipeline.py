@@ -0,0 +1,337 @@
+"""
+yolo_pipeline.py
+
+Batched, pipelined version of run_yolo_detection.py for large frame folders.
+Decoding, YOLOv8 inference and result writing run as separate stages joined
+by bounded queues, so JPEG decode and annotated-image encode overlap with
+inference. Produces exactly the same detected_persons/ambiguous images and
+metadata JSON files as process_frame, plus a frames/sec report per stage.
+With --store, metadata goes to the columnar results_store.py instead of one
+JSON file per frame.
+"""
+
+import os
+import time
+import queue
+import argparse
+import threading
+
+import cv2
+from tqdm import tqdm
+
+from run_yolo_detection import (
+    FRAMES_DIR, OUTPUT_DIR, CONF_LOW, RAW_CONF,
+    load_model, create_output_dirs, extract_detections, extract_raw_boxes, filter_boxes,
+    build_frame_data, annotate_frame, save_frame_outputs,
+)
+
+# ---------------------- Configuration ----------------------
+BATCH_SIZE = 8       # Frames per YOLO call
+QUEUE_SIZE = 32      # Max frames buffered between two stages
+DECODE_WORKERS = 2   # Threads reading/decoding JPEGs
+WRITE_WORKERS = 2    # Threads drawing and encoding results
+
+_DONE = object()     # End-of-stream marker passed through the queues
+
+# ---------------------- Classes ----------------------
+class StageStats:
+    """
+    Accumulates processed frames and busy time for one pipeline stage.
+    Thread-safe so several workers of the same stage can share it.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, frames, seconds):
+        with self._lock:
+            self.frames += frames
+            self.busy += seconds
+
+    def fps(self):
+        return self.frames / self.busy if self.busy > 0 else 0.0
+
+
+class BatchedDetector:
+    """
+    Fixed-size batch API around a YOLOv8 model.
+
+    predict() accepts at most batch_size images and returns one detection
+    list per image. With pad_partial=True, short batches are padded with
+    copies of the last image so every model call sees the same batch shape
+    (needed by static-shape backends); padded results are discarded.
+    """
+    def __init__(self, model, batch_size=BATCH_SIZE, pad_partial=False):
+        self.model = model
+        self.batch_size = batch_size
+        self.pad_partial = pad_partial
+
+    def predict(self, images):
+        if not images:
+            return []
+        return [extract_detections([r]) for r in self._run(images, CONF_LOW)]
+
+    def predict_raw(self, images):
+        """
+        Like predict(), but returns every box down to RAW_CONF with no
+        height filter (the raw boxes threshold_sweep.py re-evaluates).
+        """
+        if not images:
+            return []
+        return [extract_raw_boxes([r]) for r in self._run(images, RAW_CONF)]
+
+    def _run(self, images, conf):
+        if len(images) > self.batch_size:
+            raise ValueError(f"Batch of {len(images)} exceeds batch_size={self.batch_size}")
+
+        batch = list(images)
+        if self.pad_partial:
+            batch += [batch[-1]] * (self.batch_size - len(batch))
+
+        results = self.model(batch, conf=conf, classes=[0], verbose=False)
+        return results[:len(images)]
+
+# ---------------------- Stages ----------------------
+def _decode_worker(paths, decode_q, stats, stop):
+    """Read frames from the shared path queue and push decoded images."""
+    try:
+        while not stop.is_set():
+            try:
+                frame_path = paths.get_nowait()
+            except queue.Empty:
+                break
+            start = time.perf_counter()
+            img = cv2.imread(frame_path)
+            stats.add(1, time.perf_counter() - start)
+            if img is not None:
+                _put(decode_q, (os.path.basename(frame_path), img), stop)
+    finally:
+        _put(decode_q, _DONE, stop)
+
+
+def _source_worker(source, decode_q, stats, stop):
+    """Push (frame_name, image) pairs from an in-memory frame source."""
+    try:
+        source = iter(source)
+        while not stop.is_set():
+            start = time.perf_counter()
+            item = next(source, None)
+            if item is None:
+                break
+            stats.add(1, time.perf_counter() - start)
+            _put(decode_q, item, stop)
+    finally:
+        _put(decode_q, _DONE, stop)
+
+
+def _write_worker(write_q, errors, output_dir, stats, progress, raw_frames_dir=None, save_metadata=True):
+    """
+    Annotate and save frames whose decision is not "none". A failure is
+    recorded in errors right away, so the inference loop stops at its next
+    batch instead of after the remaining frames.
+    """
+    try:
+        while True:
+            item = write_q.get()
+            if item is _DONE:
+                break
+            img, frame_data = item
+            start = time.perf_counter()
+            if frame_data["decision"] != "none":
+                if raw_frames_dir is not None:
+                    cv2.imwrite(os.path.join(raw_frames_dir, frame_data["frame"]), img)
+                save_frame_outputs(annotate_frame(img, frame_data), frame_data, output_dir, save_metadata)
+            stats.add(1, time.perf_counter() - start)
+            progress.update(1)
+    except BaseException as e:
+        errors.append(e)
+        # Keep consuming until _DONE so the inference loop never blocks on a full queue
+        while write_q.get() is not _DONE:
+            pass
+
+
+def _guarded(worker, errors):
+    """Thread target running worker and recording its exception for the main thread."""
+    def run(*args):
+        try:
+            worker(*args)
+        except BaseException as e:
+            errors.append(e)
+    return run
+
+
+def _put(q, item, stop):
+    """q.put that gives up once stop is set (the consumer is gone)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def run_pipeline(frame_paths=None, output_dir=OUTPUT_DIR, batch_size=BATCH_SIZE,
+                 queue_size=QUEUE_SIZE, decode_workers=DECODE_WORKERS,
+                 write_workers=WRITE_WORKERS, detector=None, source=None,
+                 raw_frames_dir=None, store_writer=None, raw_writer=None):
+    """
+    Run decode -> batched inference -> write over frame_paths, or over an
+    iterable `source` of already decoded (frame_name, image) pairs.
+    With raw_frames_dir, the unannotated image of every frame with a
+    detection is also saved there. With store_writer (a
+    results_store.StageWriter for the "yolo" stage), every frame, including
+    the ones without detections, is written to the columnar store instead
+    of a metadata JSON. With raw_writer (a StageWriter for "yolo_raw"),
+    detection runs once at RAW_CONF, all raw boxes are stored for
+    threshold_sweep.py and the usual detections are filtered from them.
+
+    Returns (results, stats) where results holds the frame_data of every
+    frame with a "person" or "ambiguous" decision, as process_frame would.
+    """
+    detector = detector or BatchedDetector(load_model(), batch_size)
+    stats = {name: StageStats(name) for name in ("decode", "inference", "write")}
+
+    decode_q = queue.Queue(maxsize=queue_size)
+    write_q = queue.Queue(maxsize=queue_size)
+    progress = tqdm(total=len(frame_paths) if frame_paths is not None else None, desc="Processing frames")
+    errors = []                # Exceptions raised in worker threads
+    stop = threading.Event()   # Set when the inference loop exits, releases blocked decoders
+
+    if source is not None:
+        decode_workers = 1
+        decoders = [threading.Thread(target=_guarded(_source_worker, errors), daemon=True,
+                                     args=(source, decode_q, stats["decode"], stop))]
+    else:
+        paths = queue.Queue()
+        for p in frame_paths:
+            paths.put(p)
+        decoders = [threading.Thread(target=_guarded(_decode_worker, errors), daemon=True,
+                                     args=(paths, decode_q, stats["decode"], stop))
+                    for _ in range(decode_workers)]
+    if raw_frames_dir is not None:
+        os.makedirs(raw_frames_dir, exist_ok=True)
+    if store_writer is not None:
+        from results_store import yolo_row
+    if raw_writer is not None:
+        from results_store import raw_boxes_row
+    writers = [threading.Thread(target=_write_worker, daemon=True,
+                                args=(write_q, errors, output_dir, stats["write"], progress, raw_frames_dir,
+                                      store_writer is None))
+               for _ in range(write_workers)]
+    for t in decoders + writers:
+        t.start()
+
+    results = []
+    wall_start = time.perf_counter()
+    active_decoders = decode_workers
+    try:
+        while active_decoders and not errors:
+            # Block for the first frame, then fill the batch with what is ready
+            batch = []
+            while active_decoders and len(batch) < detector.batch_size:
+                item = decode_q.get() if not batch else _get_nowait(decode_q)
+                if item is None:
+                    break
+                if item is _DONE:
+                    active_decoders -= 1
+                    continue
+                batch.append(item)
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            if raw_writer is not None:
+                batch_raw = detector.predict_raw([img for _, img in batch])
+                batch_detections = [filter_boxes(boxes) for boxes in batch_raw]
+                for (frame_name, _), boxes in zip(batch, batch_raw):
+                    raw_writer.write(raw_boxes_row(raw_writer.dataset, frame_name, boxes))
+            else:
+                batch_detections = detector.predict([img for _, img in batch])
+            stats["inference"].add(len(batch), time.perf_counter() - start)
+
+            for (frame_name, img), detections in zip(batch, batch_detections):
+                frame_data = build_frame_data(frame_name, detections)
+                if frame_data["decision"] != "none":
+                    results.append(frame_data)
+                if store_writer is not None:
+                    store_writer.write(yolo_row(store_writer.dataset, frame_data))
+                write_q.put((img, frame_data))
+    finally:
+        stop.set()
+        for t in decoders:
+            t.join()
+        for _ in writers:
+            write_q.put(_DONE)
+        for t in writers:
+            t.join()
+        progress.close()
+    if errors:
+        raise errors[0]
+    for writer in (store_writer, raw_writer):
+        if writer is not None:
+            writer.flush()
+
+    stats["total"] = StageStats("total")
+    stats["total"].add(stats["inference"].frames, time.perf_counter() - wall_start)
+    return results, stats
+
+
+def _get_nowait(q):
+    try:
+        return q.get_nowait()
+    except queue.Empty:
+        return None
+
+
+def print_stage_report(stats):
+    """Print frames/sec and busy time for every stage."""
+    print("\n=== Stage throughput ===")
+    for s in stats.values():
+        print(f"{s.name:<10} {s.frames:>7} frames  {s.busy:8.2f} s  {s.fps():8.1f} frames/s")
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched, pipelined YOLOv8 pedestrian detection")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--decode-workers", type=int, default=DECODE_WORKERS)
+    parser.add_argument("--write-workers", type=int, default=WRITE_WORKERS)
+    parser.add_argument("--store", default=None, help="Write results to this results_store.py directory")
+    parser.add_argument("--dataset", default=None, help="Dataset name of the frames (required with --store)")
+    parser.add_argument("--raw-boxes", action="store_true",
+                        help="Also store every raw box down to RAW_CONF for threshold_sweep.py")
+    parser.add_argument("--server", default=None, help="Use the model of a running detection_server.py")
+    args = parser.parse_args()
+    if args.store and not args.dataset:
+        parser.error("--store requires --dataset")
+    if args.raw_boxes and not args.store:
+        parser.error("--raw-boxes requires --store")
+
+    if args.server:
+        import run_yolo_detection
+        run_yolo_detection.SERVER = args.server
+
+    store_writer = raw_writer = None
+    if args.store:
+        from results_store import ResultsStore
+        store_writer = ResultsStore(args.store).writer("yolo", dataset=args.dataset)
+        if args.raw_boxes:
+            raw_writer = ResultsStore(args.store).writer("yolo_raw", dataset=args.dataset)
+    create_output_dirs(args.output_dir)
+    frame_files = [f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    _, stats = run_pipeline(
+        [f"{args.frames_dir}/{f}" for f in frame_files],
+        output_dir=args.output_dir,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        decode_workers=args.decode_workers,
+        write_workers=args.write_workers,
+        store_writer=store_writer,
+        raw_writer=raw_writer,
+    )
+    print_stage_report(stats)
+    print(f"\nProcessing complete. Results saved to: {args.output_dir}")
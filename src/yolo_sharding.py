@@ -0,0 +1,244 @@
+"""
+yolo_sharding.py
+
+Sharded, multi-process execution of run_yolo_detection.py for CPU-only nodes.
+The sorted frame list is split into fixed-size shards that are handed out to
+N worker processes. Each worker pins its thread count, loads the YOLOv8 model
+once and writes the usual per-frame outputs plus one completion file per
+shard. Shards held by a worker that dies are re-queued on a fresh worker,
+and a rerun skips shards that already completed. The shard files are merged
+into a single result set sorted by frame name.
+"""
+
+import os
+import json
+import time
+import queue
+import argparse
+import traceback
+import multiprocessing as mp
+
+from tqdm import tqdm
+
+# ---------------------- Configuration ----------------------
+FRAMES_DIR = "/home/serine/datos/newdataset/Frames-extracted/week30"
+OUTPUT_DIR = "/home/serine/datos/newdataset/YOLO-RESULTS/week30"
+
+NUM_WORKERS = max(1, (os.cpu_count() or 1) // 4)
+SHARD_SIZE = 200           # Frames per shard (unit of work and of re-queueing)
+MAX_SHARD_ATTEMPTS = 3     # Give up on a shard after this many worker failures
+MERGED_FILE = "metadata_merged.json"
+
+# ---------------------- Functions ----------------------
+def make_shards(frame_files, shard_size=SHARD_SIZE):
+    """
+    Split the sorted frame list into consecutive shards of shard_size frames.
+    """
+    frame_files = sorted(frame_files)
+    return [frame_files[i:i + shard_size] for i in range(0, len(frame_files), shard_size)]
+
+def shard_path(output_dir, shard_id):
+    return os.path.join(output_dir, "shards", f"shard_{shard_id:05d}.json")
+
+def shard_params():
+    """Model, backend and thresholds a shard's results depend on."""
+    from run_yolo_detection import result_params
+    model, params = result_params()
+    return dict(params, model=model)
+
+def load_completed_shard(output_dir, shard_id, frames, params=None):
+    """
+    Return the stored results of a shard if it completed for the same frame
+    list and the same shard_params(), otherwise None.
+    """
+    path = shard_path(output_dir, shard_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    params = shard_params() if params is None else params
+    return data["results"] if data.get("frames") == frames and data.get("params") == params else None
+
+def _pin_threads(threads):
+    """Limit every native thread pool in this process to `threads` threads."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    import cv2
+    import torch
+    cv2.setNumThreads(1)
+    torch.set_num_threads(threads)
+
+def _worker(worker_id, inbox, outbox, shards, frames_dir, output_dir, threads):
+    """
+    Worker process: load the model once, then process the shards it is sent
+    until it receives None.
+    """
+    _pin_threads(threads)
+    # Imported after pinning so torch picks up the thread limits
+    import run_yolo_detection as ryd
+    from result_cache import ResultCache
+    ryd.load_model()
+    cache = ResultCache("yolo") if ryd.USE_CACHE else None
+    params = shard_params()
+    outbox.put(("ready", worker_id, None, None))
+
+    while True:
+        shard_id = inbox.get()
+        if shard_id is None:
+            break
+        try:
+            results = []
+            for frame_file in shards[shard_id]:
+                frame_data = ryd.process_frame(f"{frames_dir}/{frame_file}", output_dir, cache)
+                if frame_data is not None:
+                    results.append(frame_data)
+
+            # Write to a temporary file first so a crash never leaves a partial shard
+            path = shard_path(output_dir, shard_id)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"frames": shards[shard_id], "params": params, "results": results}, f)
+            os.replace(path + ".tmp", path)
+            outbox.put(("done", worker_id, shard_id, None))
+        except Exception:
+            outbox.put(("error", worker_id, shard_id, traceback.format_exc()))
+
+def run_sharded(frame_files, frames_dir=FRAMES_DIR, output_dir=OUTPUT_DIR,
+                num_workers=NUM_WORKERS, shard_size=SHARD_SIZE, threads_per_worker=None):
+    """
+    Process frame_files with num_workers processes and return the merged
+    results sorted by frame name. Completed shards from a previous run are
+    reused as-is when their model, backend and thresholds are unchanged.
+    """
+    import run_yolo_detection as ryd
+    ryd.create_output_dirs(output_dir)
+    os.makedirs(os.path.join(output_dir, "shards"), exist_ok=True)
+
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    shards = make_shards(frame_files, shard_size)
+    params = shard_params()
+    pending = [i for i, frames in enumerate(shards) if load_completed_shard(output_dir, i, frames, params) is None]
+    attempts = {i: 0 for i in pending}
+    failed = []
+
+    ctx = mp.get_context("spawn")
+    outbox = ctx.Queue()
+    workers = {}   # worker_id -> (process, inbox)
+    assigned = {}  # worker_id -> shard_id
+    idle = []
+    ready = set()
+    startup_failures = 0
+    next_worker_id = 0
+
+    def spawn_worker():
+        nonlocal next_worker_id
+        inbox = ctx.Queue()
+        proc = ctx.Process(target=_worker, daemon=True,
+                           args=(next_worker_id, inbox, outbox, shards, frames_dir, output_dir, threads_per_worker))
+        proc.start()
+        workers[next_worker_id] = (proc, inbox)
+        next_worker_id += 1
+
+    def requeue(shard_id, reason):
+        attempts[shard_id] += 1
+        if attempts[shard_id] >= MAX_SHARD_ATTEMPTS:
+            print(f"Shard {shard_id} failed {attempts[shard_id]} times, giving up:\n{reason}")
+            failed.append(shard_id)
+        else:
+            print(f"Re-queueing shard {shard_id} (attempt {attempts[shard_id] + 1}): {reason.strip().splitlines()[-1]}")
+            pending.append(shard_id)
+
+    for _ in range(min(num_workers, len(pending))):
+        spawn_worker()
+
+    progress = tqdm(total=len(shards), initial=len(shards) - len(pending), desc="Shards")
+    while pending or assigned:
+        while idle and pending:
+            worker_id = idle.pop()
+            shard_id = pending.pop(0)
+            assigned[worker_id] = shard_id
+            workers[worker_id][1].put(shard_id)
+
+        try:
+            kind, worker_id, shard_id, info = outbox.get(timeout=1.0)
+        except queue.Empty:
+            kind = None
+
+        if kind == "ready":
+            ready.add(worker_id)
+            idle.append(worker_id)
+        elif kind == "done":
+            assigned.pop(worker_id, None)
+            idle.append(worker_id)
+            progress.update(1)
+        elif kind == "error":
+            assigned.pop(worker_id, None)
+            idle.append(worker_id)
+            requeue(shard_id, info)
+
+        # Detect workers that died (OOM kill, segfault...) and replace them
+        for worker_id, (proc, _) in list(workers.items()):
+            if proc.is_alive():
+                continue
+            del workers[worker_id]
+            if worker_id not in ready:
+                startup_failures += 1
+                if startup_failures >= MAX_SHARD_ATTEMPTS:
+                    raise RuntimeError(f"Workers keep dying before loading the model (exit code {proc.exitcode})")
+            if worker_id in idle:
+                idle.remove(worker_id)
+            shard_id = assigned.pop(worker_id, None)
+            if shard_id is not None:
+                requeue(shard_id, f"worker {worker_id} exited with code {proc.exitcode}")
+            if pending or assigned:
+                spawn_worker()
+    progress.close()
+
+    for proc, inbox in workers.values():
+        inbox.put(None)
+    for proc, _ in workers.values():
+        proc.join(timeout=10)
+
+    if failed:
+        print(f"Warning: {len(failed)} shard(s) could not be processed: {sorted(failed)}")
+    return merge_shards(shards, output_dir, params)
+
+def merge_shards(shards, output_dir=OUTPUT_DIR, params=None):
+    """
+    Merge the completed shard files into one list sorted by frame name and
+    save it next to the metadata folder.
+    """
+    params = shard_params() if params is None else params
+    merged = []
+    for shard_id, frames in enumerate(shards):
+        results = load_completed_shard(output_dir, shard_id, frames, params)
+        if results is not None:
+            merged.extend(results)
+    merged.sort(key=lambda d: d["frame"])
+
+    with open(os.path.join(output_dir, MERGED_FILE), "w") as f:
+        json.dump(merged, f, indent=2)
+    return merged
+
+# ---------------------- Main Execution ----------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded multi-process YOLOv8 pedestrian detection")
+    parser.add_argument("--frames-dir", default=FRAMES_DIR)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frame_files = [f for f in os.listdir(args.frames_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    merged = run_sharded(frame_files, args.frames_dir, args.output_dir,
+                         args.workers, args.shard_size, args.threads_per_worker)
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{len(frame_files)} frames in {elapsed:.1f} s ({len(frame_files) / max(elapsed, 1e-9):.1f} frames/s), "
+          f"{len(merged)} with detections")
+    print(f"Merged metadata saved to: {os.path.join(args.output_dir, MERGED_FILE)}")
@@ -0,0 +1,28 @@
+import json
+
+import cv2
+import numpy as np
+
+from annotation_renderer import draw_llava, render_batch
+from llava_analysis import error_result
+
+
+def test_draw_llava_error_result():
+    img = np.zeros((120, 320, 3), dtype=np.uint8)
+    draw_llava(img, error_result("Read timed out", "timeout"))
+    assert img.any()
+
+
+def test_render_batch_with_error_result(tmp_path):
+    frames_dir, llava_dir, output_dir = tmp_path / "frames", tmp_path / "llava", tmp_path / "out"
+    frames_dir.mkdir()
+    llava_dir.mkdir()
+    for name in ("frame_0001", "frame_0002"):
+        cv2.imwrite(str(frames_dir / f"{name}.jpg"), np.zeros((120, 320, 3), dtype=np.uint8))
+    (llava_dir / "frame_0001.json").write_text(json.dumps(error_result("HTTP 500", "http_error")))
+    (llava_dir / "frame_0002.json").write_text(json.dumps({
+        "human_count": 1, "confidence": 0.8, "rejected_items": [],
+        "pedestrians": [{"position": "left", "approximate_age": "adult", "activity": "walking"}],
+    }))
+    written = render_batch(str(frames_dir), str(output_dir), llava_dir=str(llava_dir), mode="llava", workers=2)
+    assert written == 2
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+import pytest
+
+from disagreement_index import DisagreementIndex
+
+MERGED_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "results", "merged-results.csv")
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    index = DisagreementIndex(str(tmp_path_factory.mktemp("index")))
+    index.update_csv(MERGED_CSV)
+    index.derive()
+    return index.df.set_index(["dataset", "frame"])
+
+
+def test_frame_in_two_datasets(index):
+    # frame_1060.jpg exists in part1 and video2; the CSV pairs each with both
+    assert index.loc[("part1", "frame_1060.jpg"), "yolo_count"] == 10
+    assert index.loc[("part1", "frame_1060.jpg"), "llava_count"] == 9
+    assert index.loc[("video2", "frame_1060.jpg"), "yolo_count"] == 2
+    assert index.loc[("video2", "frame_1060.jpg"), "llava_count"] == 2
+
+
+def test_counts_match_same_dataset_rows(index):
+    df = pd.read_csv(MERGED_CSV)
+    same = df[df["dataset_x"] == df["dataset_y"]].drop_duplicates(["dataset_x", "frame"])
+    indexed = index.loc[list(zip(same["dataset_x"], same["frame"]))]
+    assert (indexed["yolo_count"].to_numpy() == same["yolo_count"].to_numpy()).all()
+    assert (indexed["llava_count"].to_numpy() == same["llava_count"].to_numpy()).all()
+    keys = set(zip(df["dataset_x"], df["frame"])) | set(zip(df["dataset_y"], df["frame"]))
+    assert len(index) == len(keys)
+
+
+def test_rewritten_csv_is_reindexed(tmp_path):
+    csv = str(tmp_path / "merged-results.csv")
+    df = pd.read_csv(MERGED_CSV)
+    df.to_csv(csv, index=False)
+    index = DisagreementIndex(str(tmp_path / "index"))
+    index.update_csv(csv)
+    index.save()
+
+    # Regenerated with fewer, different rows: the old offset would skip them all
+    kept = df[df["dataset_x"] == "video2"].head(5).assign(yolo_count=99)
+    kept.to_csv(csv, index=False)
+    index = DisagreementIndex.load(str(tmp_path / "index"))
+    assert index.update_csv(csv) == len(kept)
+    assert set(index.df["dataset"]) <= set(kept["dataset_x"]) | set(kept["dataset_y"].dropna())
+    left = index.df.set_index(["dataset", "frame"]).loc[list(zip(kept["dataset_x"], kept["frame"]))]
+    assert (left["yolo_count"] == 99).all()
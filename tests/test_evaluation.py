@@ -0,0 +1,43 @@
+import pandas as pd
+
+from evaluation import EvaluationEngine
+
+
+def write_rows(path, rows, mode="w"):
+    df = pd.DataFrame(rows, columns=["dataset_x", "true_person_count", "fake_person_count", "yolo_count", "llava_count"])
+    df.to_csv(path, mode=mode, header=mode == "w", index=False)
+
+
+def snapshot(engine):
+    return engine.persons, engine.joint, {k: c.to_dict() for k, c in engine.counts.items()}
+
+
+def test_appended_rows_are_read_once(tmp_path):
+    csv = str(tmp_path / "merged-results.csv")
+    write_rows(csv, [("a", 1, 0, 1, 2), ("a", 0, 0, 0, 0)])
+    engine = EvaluationEngine()
+    assert engine.update_csv(csv) == 2
+    write_rows(csv, [("b", 2, 1, 3, 2)], mode="a")
+    assert engine.update_csv(csv) == 1
+
+    fresh = EvaluationEngine()
+    fresh.update_csv(csv)
+    assert snapshot(engine) == snapshot(fresh)
+
+
+def test_rewritten_csv_is_rebuilt(tmp_path):
+    csv = str(tmp_path / "merged-results.csv")
+    state = str(tmp_path / "state.json")
+    write_rows(csv, [("a", 1, 0, 1, 2), ("a", 0, 0, 0, 0), ("a", 2, 0, 2, 2)])
+    engine = EvaluationEngine()
+    engine.update_csv(csv)
+    engine.save(state)
+
+    # Regenerated with different and fewer rows: the old offset would skip them all
+    write_rows(csv, [("b", 3, 1, 1, 4), ("c", 0, 0, 2, 0)])
+    engine = EvaluationEngine.load(state)
+    assert engine.update_csv(csv) == 2
+
+    fresh = EvaluationEngine()
+    fresh.update_csv(csv)
+    assert snapshot(engine) == snapshot(fresh)
@@ -0,0 +1,42 @@
+import os
+import stat
+
+import pytest
+
+import frame_stream
+
+WIDTH, HEIGHT = 4, 2
+
+
+def fake_ffmpeg(tmp_path, monkeypatch, frames, exit_code):
+    """An ffmpeg on PATH that writes `frames` raw frames, then exits with exit_code."""
+    script = tmp_path / "ffmpeg"
+    script.write_text(
+        "#!/bin/sh\n"
+        f"head -c {frames * WIDTH * HEIGHT * 3} /dev/zero\n"
+        "echo 'Invalid NAL unit size' >&2\n"
+        f"exit {exit_code}\n"
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(frame_stream, "video_size", lambda path: (WIDTH, HEIGHT))
+
+
+def test_complete_stream(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, frames=3, exit_code=0)
+    names = [name for name, _ in frame_stream.ffmpeg_frames("video.h264", 1)]
+    assert names == ["frame_0001.jpg", "frame_0002.jpg", "frame_0003.jpg"]
+
+
+def test_decode_error_raises(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, frames=2, exit_code=1)
+    frames = frame_stream.ffmpeg_frames("video.h264", 1)
+    with pytest.raises(RuntimeError, match="Invalid NAL unit size"):
+        list(frames)
+
+
+def test_early_stop_is_not_an_error(tmp_path, monkeypatch):
+    fake_ffmpeg(tmp_path, monkeypatch, frames=3, exit_code=1)
+    frames = frame_stream.ffmpeg_frames("video.h264", 1)
+    next(frames)
+    frames.close()
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+import pytest
+
+import llava_analysis
+from ollama_stub import start_stub_server
+
+
+@pytest.fixture
+def frame(tmp_path):
+    path = tmp_path / "frame_0001.jpg"
+    cv2.imwrite(str(path), np.zeros((64, 64, 3), dtype=np.uint8))
+    return str(path)
+
+
+def analyze_with_stub(monkeypatch, frame, **stub_kwargs):
+    server, url = start_stub_server(port=0, latency=0.0, jitter=0.0, **stub_kwargs)
+    monkeypatch.setattr(llava_analysis, "OLLAMA_URL", url)
+    try:
+        return llava_analysis.analyze_image(frame)
+    finally:
+        server.shutdown()
+
+
+def test_server_error_is_http_error(monkeypatch, frame):
+    result = analyze_with_stub(monkeypatch, frame, error_rate=1.0)
+    assert result["error_type"] == "http_error"
+    assert result["human_count"] is None
+
+
+def test_valid_answer(monkeypatch, frame):
+    result = analyze_with_stub(monkeypatch, frame)
+    assert "error" not in result
+    assert isinstance(result["human_count"], int)
@@ -0,0 +1,51 @@
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+
+from llava_client import AsyncLlavaClient, print_report
+from ollama_stub import IMAGE_TOKENS, start_stub_server
+
+
+@pytest.fixture
+def frames(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"frame_{i:04d}.jpg"
+        cv2.imwrite(str(path), np.full((64, 64, 3), i * 40, dtype=np.uint8))
+        paths.append(str(path))
+    return paths
+
+
+def run_client(frames, stream):
+    server, url = start_stub_server(port=0, latency=0.0, jitter=0.0)
+
+    async def run():
+        async with AsyncLlavaClient(url=url) as client:
+            analyze = client.analyze_stream if stream else client.analyze
+            results = [await analyze(p) for p in frames]
+        return results, client.stats.report()
+
+    try:
+        return asyncio.run(run())
+    finally:
+        server.shutdown()
+
+
+def test_prompt_tokens_reported(frames):
+    results, report = run_client(frames, stream=False)
+    assert all("error" not in r for r in results)
+    assert report["unreported_prompt_tokens"] == 0
+    assert report["prompt_tokens_per_frame"] >= IMAGE_TOKENS
+
+
+def test_stopped_streams_do_not_report_zero_prompt_tokens(frames, capsys):
+    # The stub answers with the required fields first, so every stream stops early
+    results, report = run_client(frames, stream=True)
+    assert all("error" not in r for r in results)
+    assert report["stopped_early"] == len(frames)
+    assert report["unreported_prompt_tokens"] == len(frames)
+    assert report["prompt_tokens_per_frame"] is None
+    print_report(report)
+    assert "n/a prompt" in capsys.readouterr().out
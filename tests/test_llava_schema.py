@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from llava_schema import (
+    MalformedJSONError, RunawayResponseError, SchemaError, StreamingResponseParser,
+    TruncatedResponseError,
+)
+
+VALID = json.dumps({
+    "human_count": 2,
+    "confidence": 0.85,
+    "pedestrians": [{"position": "left", "activity": "walking, \"fast\" [sic]"}, {"position": "right"}],
+    "rejected_items": [{"type": "mannequin", "reason": "static {display}"}],
+    "scene_understanding": "A street with two people.",
+})
+CHUNK_SIZES = [1, 2, 3, 7, 64, len(VALID)]
+
+
+def feed(text, size, **kwargs):
+    parser = StreamingResponseParser(**kwargs)
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    return parser
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_valid(size):
+    parser = feed(VALID, size)
+    assert parser.complete
+    assert parser.finish() == json.loads(VALID)
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_complete_before_optional_fields(size):
+    parser = feed(VALID[:VALID.index('"scene_understanding"')], size)
+    assert parser.complete
+    assert parser.finish()["human_count"] == 2
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_prose(size):
+    with pytest.raises(MalformedJSONError):
+        feed("There are two people in the image.", size)
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_unknown_key(size):
+    with pytest.raises(SchemaError):
+        feed(json.dumps({"people": 2, "human_count": 2}), size)
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+@pytest.mark.parametrize("answer", [{"human_count": "2 people"}, {"human_count": 2, "pedestrians": "none"},
+                                    {"human_count": 2, "pedestrians": [1, 2]}])
+def test_wrong_type(size, answer):
+    with pytest.raises(SchemaError):
+        feed(json.dumps(answer), size).finish()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_truncated(size):
+    parser = feed(VALID[:40], size)
+    assert not parser.complete
+    with pytest.raises(TruncatedResponseError):
+        parser.finish()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_closed_with_missing_fields(size):
+    parser = feed(json.dumps({"human_count": 2}), size)
+    with pytest.raises(SchemaError):
+        parser.finish()
+
+
+@pytest.mark.parametrize("size", CHUNK_SIZES)
+def test_runaway(size):
+    text = json.dumps({"human_count": 2, "scene_understanding": "x" * 500})
+    with pytest.raises(RunawayResponseError):
+        feed(text, size, max_chars=200)
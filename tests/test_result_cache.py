@@ -0,0 +1,20 @@
+from result_cache import ResultCache
+
+
+def disk_size(cache):
+    return sum(size for _, size, _ in cache._entries())
+
+
+def test_size_counts_bytes(tmp_path):
+    cache = ResultCache("test", str(tmp_path))
+    cache.put("ab" * 32, {"scene": "café, señal, 東京"})
+    assert cache.size == disk_size(cache)
+
+
+def test_overwrite_is_not_double_counted(tmp_path):
+    cache = ResultCache("test", str(tmp_path))
+    key = "cd" * 32
+    for count in range(5):
+        cache.put(key, {"human_count": count, "pedestrians": [{}] * count})
+    assert cache.size == disk_size(cache)
+    assert ResultCache("test", str(tmp_path)).size == cache.size
@@ -0,0 +1,27 @@
+import json
+
+from results_store import ResultsStore
+
+
+def write_llava_json(results_dir, stem, result):
+    results_dir.mkdir(exist_ok=True)
+    (results_dir / f"{stem}.json").write_text(json.dumps(result))
+
+
+def test_llava_frames_keep_their_extension(tmp_path):
+    store = ResultsStore(str(tmp_path / "store"))
+    with store.writer("ground_truth") as w:
+        for frame in ("frame_0001.png", "frame_0002.jpeg"):
+            w.write({"dataset": "part1", "frame": frame, "true_person_count": 1, "fake_person_count": 0})
+    results = tmp_path / "llava"
+    answer = {"human_count": 1, "confidence": 0.8}
+    write_llava_json(results, "frame_0001", answer)
+    write_llava_json(results, "frame_0002", answer)
+    write_llava_json(results, "frame_0003", dict(answer, frame="frame_0003.png"))
+    write_llava_json(results, "frame_0004", answer)
+
+    store.import_llava_results(str(results), "part1")
+    frames = list(store.read("llava", ["llava_count"])["frame"])
+    assert frames == ["frame_0001.png", "frame_0002.jpeg", "frame_0003.png", "frame_0004.jpg"]
+    merged = store.merged(["true_person_count", "llava_count"])
+    assert merged.set_index("frame").loc["frame_0001.png", "llava_count"] == 1
@@ -0,0 +1,91 @@
+import json
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+import requests
+
+from llava_analysis import PROMPT, build_payload
+from llava_client import RequestStats
+from llava_schema import SchemaError
+from ollama_stub import start_stub_server
+from roi_mosaic import TILE_PROMPT, analyze_frames_roi, map_verdicts, tile_count
+
+
+def test_tile_count_of_tile_prompt():
+    assert tile_count(TILE_PROMPT.format(n=7, cols=3)) == 7
+    assert tile_count(PROMPT) is None
+
+
+def test_stub_answers_every_tile():
+    server, url = start_stub_server(port=0, latency=0.0, jitter=0.0)
+    try:
+        payload = build_payload("", TILE_PROMPT.format(n=5, cols=3))
+        body = requests.post(url, json=payload, timeout=10).json()
+    finally:
+        server.shutdown()
+    assert [t["tile"] for t in json.loads(body["response"])["tiles"]] == [1, 2, 3, 4, 5]
+
+
+def frame_with_boxes():
+    detections = [{"bbox": [0, 0, 40, 100], "confidence": 0.45}, {"bbox": [50, 0, 90, 100], "confidence": 0.5}]
+    return {"frame": "frame_0001.jpg", "detections": detections}
+
+
+def test_map_verdicts_parses_tile_answers():
+    frame_data = frame_with_boxes()
+    answer = {"tiles": [{"tile": 1, "is_pedestrian": "false", "confidence": "high"},
+                        {"tile": 2, "is_pedestrian": True, "confidence": 1.7}]}
+    result = map_verdicts(frame_data, frame_data["detections"], answer)
+    assert [v["is_pedestrian"] for v in result["box_verdicts"]] == [False, True]
+    assert [v["llava_confidence"] for v in result["box_verdicts"]] == [0.0, 1.0]
+    assert result["human_count"] == 1
+
+
+@pytest.mark.parametrize("answer", [{"tiles": [{"tile": 1, "is_pedestrian": "no"}]},
+                                    {"tiles": "none"}, {"tiles": ["1"]}, [], {}])
+def test_map_verdicts_rejects_malformed_answers(answer):
+    frame_data = frame_with_boxes()
+    with pytest.raises(SchemaError):
+        map_verdicts(frame_data, frame_data["detections"], answer)
+
+
+
+class ScriptedClient:
+    """Stand-in for AsyncLlavaClient answering the frames in order with the given bodies."""
+    max_concurrency = 1
+
+    def __init__(self, bodies):
+        self.bodies = list(bodies)
+        self.stats = RequestStats()
+
+    async def generate(self, payload):
+        return self.bodies.pop(0)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+def test_failed_frames_are_error_results(tmp_path):
+    bodies = [{"response": "not json"},
+              {"response": json.dumps({"tiles": [{"tile": 1, "is_pedestrian": "maybe"}]})},
+              {"response": json.dumps({"tiles": [{"tile": 1, "is_pedestrian": True},
+                                                 {"tile": 2, "is_pedestrian": False}]})}]
+    metadata, paths = {}, []
+    for i in range(len(bodies)):
+        name = f"frame_{i:04d}.jpg"
+        cv2.imwrite(str(tmp_path / name), np.zeros((120, 120, 3), dtype=np.uint8))
+        metadata[name] = dict(frame_with_boxes(), frame=name)
+        paths.append(str(tmp_path / name))
+
+    client = ScriptedClient(bodies)
+    asyncio.run(analyze_frames_roi(paths, metadata, str(tmp_path / "out"), client))
+
+    results = [json.loads((tmp_path / "out" / f"frame_{i:04d}.json").read_text()) for i in range(len(bodies))]
+    assert [r.get("error_type") for r in results] == ["malformed_json", "schema_violation", None]
+    assert [r["human_count"] for r in results] == [None, None, 1]
+    assert client.stats.errors == {"malformed_json": 1, "schema_violation": 1}
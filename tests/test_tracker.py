@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+import pytest
+
+from tracker import Tracker, TrackedDetector
+
+
+def walking(frame, x0, conf, height=120):
+    """Detection of a pedestrian walking right at 3 px/frame."""
+    x = x0 + 3 * frame
+    return {"bbox": [x, 100, x + 40, 100 + height], "confidence": conf}
+
+
+@pytest.mark.parametrize("k", [2, 3, 5, 10])
+def test_detector_ratio_is_one_over_k(k):
+    # 0.62 is just above CONF_HIGH: its decay must not force early detections
+    frames = 100
+    tracked = TrackedDetector(lambda i: [walking(i, 0, 0.62), walking(i, 300, 0.9)], k)
+    for i in range(frames):
+        tracked.process(i)
+    assert tracked.detector_calls == math.ceil(frames / k)
+
+
+def test_missed_track_is_not_counted():
+    tracker = Tracker()
+    tracker.step([walking(0, 0, 0.9), walking(0, 300, 0.9)])
+    detections = tracker.step([walking(1, 0, 0.9)])  # Second pedestrian missed
+    assert len(detections) == 1
+    assert len(tracker.step(None)) == 1
+    # Detected again at the next run: same track ID as before the miss
+    detections = tracker.step([walking(3, 0, 0.9), walking(3, 300, 0.9)])
+    assert sorted(d["track_id"] for d in detections) == [1, 2]
+
+
+def test_propagated_boxes_use_height_filter():
+    tracker = Tracker()
+    tracker.step([{"bbox": [0, 0, 40, 100], "confidence": 0.9}])
+    tracker.step([{"bbox": [0, 8, 40, 98], "confidence": 0.9}])   # Shrinking: 100 -> 90 px
+    heights = []
+    for _ in range(10):
+        detections = tracker.step(None)
+        heights += [d["bbox"][3] - d["bbox"][1] for d in detections]
+    assert heights and min(heights) >= 80
+    assert len(tracker.step(None)) == 0
+
+
+def test_yolo_detect_fn_matches_propagated_filter():
+    from detection_server import RemoteResult
+    from tracker import yolo_detect_fn
+
+    boxes = [[0, 0, 40, 120, 0.9],      # Kept
+             [100, 0, 140, 120, 0.3],   # Below CONF_LOW
+             [200, 0, 220, 50, 0.9]]    # Below MIN_HEIGHT
+
+    def model(img, conf=0.25, **kwargs):
+        return [RemoteResult([b for b in boxes if b[4] >= conf])]
+
+    tracked = TrackedDetector(yolo_detect_fn(model, imgsz=416), 3)
+    counts = [len(tracked.process(None)[0]) for _ in range(9)]
+    assert counts == [1] * 9
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+import pytest
+
+from yolo_pipeline import run_pipeline
+
+
+class FakeDetector:
+    """Detector returning one confident person per frame, or raising after `fail_after` frames."""
+    batch_size = 4
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.frames = 0
+
+    def predict(self, images):
+        self.frames += len(images)
+        if self.fail_after is not None and self.frames > self.fail_after:
+            raise RuntimeError("detector failed")
+        return [[{"bbox": [0, 0, 10, 40], "confidence": 0.9}] for _ in images]
+
+
+def frames(n, fail_at=None):
+    for i in range(n):
+        if i == fail_at:
+            raise IOError("cannot read frame")
+        yield f"frame_{i:04d}.jpg", np.zeros((48, 64, 3), dtype=np.uint8)
+
+
+def output_dir(tmp_path):
+    """Output directory with the folders the writers save into."""
+    for sub in ("detected_persons", "ambiguous", "metadata"):
+        (tmp_path / sub).mkdir()
+    return str(tmp_path)
+
+
+def run_with_timeout(**kwargs):
+    """Run the pipeline in a thread so a hang fails the test instead of blocking it."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = run_pipeline(**kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "run_pipeline hung"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def test_source_error_is_raised(tmp_path):
+    with pytest.raises(IOError, match="cannot read frame"):
+        run_with_timeout(source=frames(100, fail_at=50), detector=FakeDetector(),
+                         output_dir=output_dir(tmp_path), queue_size=2)
+
+
+def test_detector_error_is_raised(tmp_path):
+    with pytest.raises(RuntimeError, match="detector failed"):
+        run_with_timeout(source=frames(200), detector=FakeDetector(fail_after=20),
+                         output_dir=output_dir(tmp_path), queue_size=2)
+
+
+def test_write_error_is_raised(tmp_path):
+    # Missing detected_persons/ folder: the writers fail on the first frame
+    missing = tmp_path / "missing" / "nested"
+    detector = FakeDetector()
+    with pytest.raises(FileNotFoundError):
+        run_with_timeout(source=frames(200), detector=detector, output_dir=str(missing),
+                         queue_size=2)
+    # Inference stops soon after the failure instead of running through the source
+    assert detector.frames < 100
+
+
+def test_all_frames_processed(tmp_path):
+    results, stats = run_with_timeout(source=frames(30), detector=FakeDetector(),
+                                      output_dir=output_dir(tmp_path), queue_size=2)
+    assert len(results) == 30
+    assert stats["inference"].frames == 30
@@ -0,0 +1,30 @@
+import json
+
+import run_yolo_detection
+from yolo_sharding import load_completed_shard, shard_params, shard_path
+
+
+def write_shard(output_dir, frames, params):
+    path = shard_path(str(output_dir), 0)
+    (output_dir / "shards").mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"frames": frames, "params": params, "results": [{"frame": frames[0]}]}, f)
+
+
+def test_completed_shard_is_reused(tmp_path):
+    write_shard(tmp_path, ["frame_0001.jpg"], shard_params())
+    assert load_completed_shard(str(tmp_path), 0, ["frame_0001.jpg"]) == [{"frame": "frame_0001.jpg"}]
+
+
+def test_shard_of_other_thresholds_or_backend_is_stale(tmp_path, monkeypatch):
+    write_shard(tmp_path, ["frame_0001.jpg"], shard_params())
+    monkeypatch.setattr(run_yolo_detection, "CONF_LOW", 0.3)
+    assert load_completed_shard(str(tmp_path), 0, ["frame_0001.jpg"]) is None
+    monkeypatch.undo()
+    monkeypatch.setattr(run_yolo_detection, "BACKEND", "onnx")
+    assert load_completed_shard(str(tmp_path), 0, ["frame_0001.jpg"]) is None
+
+
+def test_shard_without_params_is_stale(tmp_path):
+    write_shard(tmp_path, ["frame_0001.jpg"], None)
+    assert load_completed_shard(str(tmp_path), 0, ["frame_0001.jpg"]) is None